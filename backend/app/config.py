@@ -9,6 +9,133 @@ PINECONE_INDEX_NAME = os.getenv("PINECONE_INDEX_NAME", "papertrailai")
 UPLOAD_DIR = os.path.join(os.path.dirname(__file__), "../storage/uploads")
 UPLOAD_DIR = os.path.join(os.path.dirname(__file__), "../storage/uploads")
 
+# Document processing: 'queue' hands work to `python -m app.worker`, 'background' runs it in the API process
+PROCESSING_BACKEND = os.getenv("PROCESSING_BACKEND", "queue")
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", "2"))
+WORKER_POLL_SECONDS = float(os.getenv("WORKER_POLL_SECONDS", "2"))
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "300"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_BASE_SECONDS = int(os.getenv("JOB_RETRY_BASE_SECONDS", "30"))
+JOB_RETRY_MAX_SECONDS = int(os.getenv("JOB_RETRY_MAX_SECONDS", "900"))
+
+# Embedding batching (ingest pipeline)
+EMBEDDING_BATCH_MAX_TOKENS = int(os.getenv("EMBEDDING_BATCH_MAX_TOKENS", "64000"))
+EMBEDDING_BATCH_MAX_INPUTS = int(os.getenv("EMBEDDING_BATCH_MAX_INPUTS", "256"))
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", "4"))
+
+# PDF page extraction: documents with at least this many pages are split across a process pool
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "40"))
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(min(4, os.cpu_count() or 1))))
+PDF_STREAM_RANGE_PAGES = int(os.getenv("PDF_STREAM_RANGE_PAGES", "16"))
+
+# Chunking: 'tokens' (sentence-aware, token-budgeted) or 'chars' (legacy fixed 1000-char windows)
+CHUNK_STRATEGY = os.getenv("CHUNK_STRATEGY", "tokens")
+CHUNK_TARGET_TOKENS = int(os.getenv("CHUNK_TARGET_TOKENS", "350"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "40"))
+CHUNK_MIN_TOKENS = int(os.getenv("CHUNK_MIN_TOKENS", "100"))
+
+# Streaming ingest: pages OCR'd together, chunks per embed/upsert batch, and batches in flight at once
+PIPELINE_PAGE_WINDOW = int(os.getenv("PIPELINE_PAGE_WINDOW", "16"))
+PIPELINE_CHUNK_BATCH = int(os.getenv("PIPELINE_CHUNK_BATCH", "128"))
+PIPELINE_MAX_INFLIGHT = int(os.getenv("PIPELINE_MAX_INFLIGHT", "2"))
+# Leading document text kept in memory for classification/extraction prompts
+EXTRACTION_TEXT_CHARS = int(os.getenv("EXTRACTION_TEXT_CHARS", "8000"))
+# How classification and field extraction are obtained: 'sectioned' (map-reduce over the whole
+# document), 'single' (one LLM call on the leading text returns both), 'parallel' (two calls at once)
+# or 'sequential' (classify, then extract)
+EXTRACTION_MODE = os.getenv("EXTRACTION_MODE", "sectioned").lower()
+# Sectioned extraction: section size, how many sections are read, and calls in flight per document
+EXTRACTION_SECTION_TOKENS = int(os.getenv("EXTRACTION_SECTION_TOKENS", "3000"))
+EXTRACTION_MAX_SECTIONS = int(os.getenv("EXTRACTION_MAX_SECTIONS", "24"))
+EXTRACTION_CONCURRENCY = int(os.getenv("EXTRACTION_CONCURRENCY", "8"))
+# Regex/dictionary pre-extraction ahead of the LLM (app.services.rule_extraction).
+# Short bills at or above the skip confidence are stored without an LLM call; at or above
+# the shrink confidence the LLM is not asked for amounts, dates and addresses.
+RULE_EXTRACTION_ENABLED = os.getenv("RULE_EXTRACTION_ENABLED", "true").lower() == "true"
+RULE_EXTRACTION_SKIP_CONFIDENCE = float(os.getenv("RULE_EXTRACTION_SKIP_CONFIDENCE", "0.85"))
+RULE_EXTRACTION_SHRINK_CONFIDENCE = float(os.getenv("RULE_EXTRACTION_SHRINK_CONFIDENCE", "0.5"))
+RULE_EXTRACTION_SKIP_MAX_CHARS = int(os.getenv("RULE_EXTRACTION_SKIP_MAX_CHARS", "8000"))
+
+# OCR stage
+OCR_DPI = int(os.getenv("OCR_DPI", "200"))
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# Local on-disk caches
+CACHE_DIR = os.getenv("CACHE_DIR", os.path.join(os.path.dirname(__file__), "../storage/cache"))
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+EMBEDDING_CACHE_MAX_MB = int(os.getenv("EMBEDDING_CACHE_MAX_MB", "512"))
+OCR_CACHE_ENABLED = os.getenv("OCR_CACHE_ENABLED", "true").lower() == "true"
+OCR_CACHE_MAX_MB = int(os.getenv("OCR_CACHE_MAX_MB", "256"))
+# Chat completion responses keyed on (model, messages, params): 'off', 'readwrite', or
+# 'replay' (read-only; a miss raises instead of calling OpenAI, for offline tests and benchmarks)
+LLM_CACHE_MODE = os.getenv("LLM_CACHE_MODE", "readwrite").lower()
+LLM_CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+LLM_CACHE_MAX_MB = int(os.getenv("LLM_CACHE_MAX_MB", "256"))
+
+# Hybrid retrieval: BM25 keyword index (SQLite FTS5) fused with vector results
+LEXICAL_INDEX_ENABLED = os.getenv("LEXICAL_INDEX_ENABLED", "true").lower() == "true"
+LEXICAL_INDEX_PATH = os.getenv("LEXICAL_INDEX_PATH", os.path.join(os.path.dirname(__file__), "../storage/index/lexical.sqlite"))
+HYBRID_RRF_K = int(os.getenv("HYBRID_RRF_K", "60"))
+# Identifier/amount lookups answered by the keyword index alone skip the embedding call
+HYBRID_LEXICAL_ONLY = os.getenv("HYBRID_LEXICAL_ONLY", "true").lower() == "true"
+
+# In-memory cache of retrieval results, invalidated by the per-user corpus version
+RETRIEVAL_CACHE_ENABLED = os.getenv("RETRIEVAL_CACHE_ENABLED", "true").lower() == "true"
+RETRIEVAL_CACHE_MAX_ENTRIES = int(os.getenv("RETRIEVAL_CACHE_MAX_ENTRIES", "1024"))
+RETRIEVAL_CACHE_TTL_SECONDS = float(os.getenv("RETRIEVAL_CACHE_TTL_SECONDS", "300"))
+
+# Post-retrieval rerank + MMR: fewer, non-redundant chunks in the chat prompt
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "true").lower() == "true"
+RERANK_MAX_CHUNKS = int(os.getenv("RERANK_MAX_CHUNKS", "8"))
+# 1.0 = pure relevance, lower values favour diversity
+RERANK_MMR_LAMBDA = float(os.getenv("RERANK_MMR_LAMBDA", "0.7"))
+# Word 3-gram Jaccard at or above which a chunk counts as a near-duplicate
+RERANK_DUPLICATE_THRESHOLD = float(os.getenv("RERANK_DUPLICATE_THRESHOLD", "0.35"))
+
+# Token budget for the document context sent with each chat request
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "6000"))
+
+# OpenAI HTTP clients: one pooled client per process (sync) and per event loop (async)
+OPENAI_TIMEOUT_SECONDS = float(os.getenv("OPENAI_TIMEOUT_SECONDS", "60"))
+OPENAI_CONNECT_TIMEOUT_SECONDS = float(os.getenv("OPENAI_CONNECT_TIMEOUT_SECONDS", "5"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+# OpenAI requests in flight from async endpoints; further requests wait for a slot
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "64"))
+# OpenAI quota shared by the API and worker processes, per model: "gpt-4o=500:30000,..."
+# (requests and tokens per minute). Models not listed are not throttled locally.
+OPENAI_RATE_LIMITS = os.getenv("OPENAI_RATE_LIMITS", "")
+OPENAI_RATE_LIMIT_STATE = os.getenv("OPENAI_RATE_LIMIT_STATE", os.path.join(os.path.dirname(__file__), "../storage/ratelimit/openai.sqlite"))
+# Share of each model's quota lower-priority calls may not use, so chat keeps headroom during bulk ingest
+LLM_RESERVE_NORMAL = float(os.getenv("LLM_RESERVE_NORMAL", "0.1"))
+LLM_RESERVE_BACKGROUND = float(os.getenv("LLM_RESERVE_BACKGROUND", "0.3"))
+# Attempts after a 429 before chat gives up (lower priority calls try 4x as often); each waits for Retry-After
+OPENAI_RATE_LIMIT_RETRIES = int(os.getenv("OPENAI_RATE_LIMIT_RETRIES", "5"))
+# Threads for blocking retrieval (embedding, vector query, SQL) called from async endpoints
+RETRIEVAL_MAX_THREADS = int(os.getenv("RETRIEVAL_MAX_THREADS", "32"))
+
+# Pinecone bulk writes: size-bounded batches sent concurrently, retried with backoff
+PINECONE_UPSERT_BATCH_SIZE = int(os.getenv("PINECONE_UPSERT_BATCH_SIZE", "100"))
+PINECONE_UPSERT_MAX_BYTES = int(os.getenv("PINECONE_UPSERT_MAX_BYTES", str(2 * 1024 * 1024)))
+PINECONE_CONCURRENCY = int(os.getenv("PINECONE_CONCURRENCY", "4"))
+PINECONE_TIMEOUT_SECONDS = float(os.getenv("PINECONE_TIMEOUT_SECONDS", "30"))
+# Pooled HTTP connections shared by all threads using the index (0 = client default)
+PINECONE_POOL_MAXSIZE = int(os.getenv("PINECONE_POOL_MAXSIZE", "32"))
+PINECONE_MAX_RETRIES = int(os.getenv("PINECONE_MAX_RETRIES", "4"))
+PINECONE_RETRY_BASE_SECONDS = float(os.getenv("PINECONE_RETRY_BASE_SECONDS", "0.5"))
+
+# Vector store: 'pinecone' (hosted) or 'local' (memory-mapped index under VECTOR_INDEX_DIR)
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "pinecone").lower()
+VECTOR_INDEX_DIR = os.getenv("VECTOR_INDEX_DIR", os.path.join(os.path.dirname(__file__), "../storage/vectors"))
+# Local backend switches from exact to IVF (approximate) search above this many vectors; 0 disables
+LOCAL_VECTOR_ANN_MIN_VECTORS = int(os.getenv("LOCAL_VECTOR_ANN_MIN_VECTORS", "50000"))
+LOCAL_VECTOR_ANN_NPROBE = int(os.getenv("LOCAL_VECTOR_ANN_NPROBE", "8"))
+
+# Metrics snapshots written by worker processes and merged by /api/metrics
+METRICS_DIR = os.getenv("METRICS_DIR", os.path.join(os.path.dirname(__file__), "../storage/metrics"))
+# Snapshots not rewritten for this long are ignored (their worker is gone); live workers rewrite theirs more often
+METRICS_SNAPSHOT_MAX_AGE_SECONDS = int(os.getenv("METRICS_SNAPSHOT_MAX_AGE_SECONDS", "900"))
+
 # Database Configuration
 DB_HOST = os.getenv("DB_HOST", "localhost")
 DB_USER = os.getenv("DB_USER", "papertrail_user")
@@ -1,7 +1,9 @@
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from app.routers import documents, chat, timeline, graph, actions, auth, arena
 from app.db import init_db
+from app.services import metrics, llm
 from contextlib import asynccontextmanager
 import os
 
@@ -9,6 +11,7 @@ import os
 async def lifespan(app: FastAPI):
     init_db()
     yield
+    await llm.aclose()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -34,5 +37,12 @@ app.include_router(arena.router, prefix="/api/arena", tags=["arena"])
 
 
 @app.get("/api/health")
-def health():
+async def health():
+    # async so it is answered on the event loop even when the threadpool is saturated
     return {"status": "ok"}
+
+
+@app.get("/api/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    # Prometheus text exposition format
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
@@ -20,10 +20,12 @@ class Document(SQLModel, table=True):
     created_at: datetime
     created_at: datetime
     user_id: str = Field(index=True) # Foreign key to User.id
+    file_sha256: Optional[str] = Field(default=None, index=True) # Fingerprint of the uploaded bytes, used to detect duplicate uploads
     doc_type: Optional[str] = None
     issuer: Optional[str] = None
     primary_due_date: Optional[date] = None
     extracted_json: Optional[str] = Field(default=None, sa_column=Column(LONGTEXT))
+    text_hash: Optional[str] = None # sha256 of the full extracted text; unchanged text skips LLM extraction on re-process
     status: str
     error_message: Optional[str] = None
     chunks: List["Chunk"] = Relationship(back_populates="document")
@@ -35,9 +37,17 @@ class Chunk(SQLModel, table=True):
     page: int
     chunk_index: int
     text: str = Field(sa_column=Column(LONGTEXT))
+    content_hash: Optional[str] = None # sha256 of text; unchanged chunks are not re-embedded on re-process
     created_at: datetime
     document: Optional[Document] = Relationship(back_populates="chunks")
 
+class DocumentPage(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    document_id: str = Field(foreign_key="document.id", index=True)
+    page: int
+    content_hash: str
+    char_count: int
+
 class Deadline(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     document_id: str = Field(foreign_key="document.id")
@@ -74,3 +84,26 @@ class ActionItem(SQLModel, table=True):
     
     document: Optional[Document] = Relationship()
 
+
+class ProcessingJob(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    document_id: str = Field(foreign_key="document.id", index=True)
+    user_id: str = Field(index=True)
+    status: str = Field(default="queued", index=True) # 'queued', 'running', 'succeeded', 'failed'
+    stage: Optional[str] = None
+    progress: float = 0.0
+    attempts: int = 0
+    max_attempts: int = 3
+    force: bool = False # Re-embed and re-extract everything instead of diffing against the previous run
+    next_run_at: datetime = Field(default_factory=datetime.utcnow, index=True)
+    lease_owner: Optional[str] = None
+    lease_expires_at: Optional[datetime] = None
+    last_error: Optional[str] = Field(default=None, sa_column=Column(LONGTEXT))
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+class CorpusVersion(SQLModel, table=True):
+    # Bumped whenever a user's searchable corpus changes; part of the retrieval cache key
+    user_id: str = Field(primary_key=True)
+    version: int = 0
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
@@ -1,24 +1,25 @@
 from fastapi import APIRouter, HTTPException, Depends
 from app.schemas import ArenaStartRequest, ArenaTurnRequest, ArenaResponse, ArenaPersona
-from app.services import rag
+from app.services import rag, rerank, context_packer
 from sqlmodel import Session
 from app.db import get_session
-import openai
-from app.config import OPENAI_API_KEY
+from app.auth import get_current_user
+from app.models import User
+from app.services import llm
 from typing import List, Dict, Any
 
 router = APIRouter()
-openai.api_key = OPENAI_API_KEY
 
 @router.post("/start", response_model=Dict[str, Any])
-def start_arena(req: ArenaStartRequest, session: Session = Depends(get_session)):
+async def start_arena(req: ArenaStartRequest, current_user: User = Depends(get_current_user), session: Session = Depends(get_session)):
     try:
         # 1. Retrieve Context
         # Using the first document ID or general topic search
         doc_id = req.document_ids[0] if req.document_ids else None
-        chunks = rag.retrieve_chunks(session, req.topic, top_k=15, document_id=doc_id)
+        chunks = await rag.aretrieve_chunks(session, req.topic, current_user.id, top_k=15, document_id=doc_id)
+        chunks = rerank.rerank_chunks(req.topic, chunks, max_chunks=10)
         
-        context_text = "\n".join([f"{c['text']}" for c in chunks])
+        context_text, _ = context_packer.pack_context(chunks, markers=False)
         if not context_text:
             context_text = "No specific document context found. Debating based on general knowledge."
 
@@ -35,7 +36,8 @@ def start_arena(req: ArenaStartRequest, session: Session = Depends(get_session))
             {"role": "user", "content": "Please make your opening statement."}
         ]
 
-        resp = openai.chat.completions.create(
+        resp = await llm.achat_completion(
+            "arena_open",
             model="gpt-4o",
             messages=messages,
             temperature=0.7
@@ -54,7 +56,7 @@ def start_arena(req: ArenaStartRequest, session: Session = Depends(get_session))
         raise HTTPException(status_code=500, detail=f"Failed to start arena: {str(e)}")
 
 @router.post("/turn", response_model=ArenaResponse)
-def play_turn(req: ArenaTurnRequest):
+async def play_turn(req: ArenaTurnRequest, current_user: User = Depends(get_current_user)):
     try:
         persona = req.current_speaker
         
@@ -84,7 +86,8 @@ def play_turn(req: ArenaTurnRequest):
             {"role": "user", "content": f"Your opponent just said:\n\"{last_turn_content}\"\n\nRespond to this point."}
         ]
 
-        resp = openai.chat.completions.create(
+        resp = await llm.achat_completion(
+            "arena_turn",
             model="gpt-4o",
             messages=messages,
             temperature=0.7
@@ -1,19 +1,66 @@
 from fastapi import APIRouter, HTTPException, Depends
+from fastapi.responses import StreamingResponse
 from app.schemas import ChatRequest, ChatResponse, ChatCitation
-from app.services import rag
+from app.services import rag, rerank, metrics
 from typing import List
 from sqlmodel import Session
 from app.db import get_session
+from app.auth import get_current_user
+from app.models import User
+import json
+import time
 
 router = APIRouter()
 
 @router.post("/", response_model=ChatResponse)
-def chat_endpoint(req: ChatRequest, session: Session = Depends(get_session)):
+async def chat_endpoint(req: ChatRequest, current_user: User = Depends(get_current_user), session: Session = Depends(get_session)):
     try:
-        chunks = rag.retrieve_chunks(session, req.message, top_k=req.top_k or 10, document_id=req.document_id)
-        result = rag.chat_with_context(req.message, chunks, image_url=req.image_url, history=req.history)
+        chunks = await rag.aretrieve_chunks(session, req.message, current_user.id, top_k=req.top_k or 10, document_id=req.document_id)
+        chunks = rerank.rerank_chunks(req.message, chunks)
+        result = await rag.achat_with_context(req.message, chunks, image_url=req.image_url, history=req.history)
         citations = [ChatCitation(**c) for c in result["citations"]]
         return ChatResponse(answer=result["answer"], citations=citations)
     except Exception as e:
         print(f"Chat Error: {e}")
         raise HTTPException(status_code=500, detail=f"Chat failed: {str(e)}")
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@router.post("/stream")
+async def chat_stream_endpoint(req: ChatRequest, current_user: User = Depends(get_current_user), session: Session = Depends(get_session)):
+    """
+    Same as POST /api/chat/, streamed as server-sent events:
+      event: citations  {"citations": [...]}        as soon as retrieval finishes
+      event: token      {"text": "..."}             for each piece of the answer
+      event: done       {"answer": "...", "citations": [...]}
+      event: error      {"detail": "..."}           if generation fails mid-stream
+    """
+    started = time.perf_counter()
+    # Retrieval runs before the response starts, while the request's DB session is open
+    try:
+        chunks = await rag.aretrieve_chunks(session, req.message, current_user.id, top_k=req.top_k or 10, document_id=req.document_id)
+        chunks = rerank.rerank_chunks(req.message, chunks)
+        messages, citations = rag.build_chat_messages(req.message, chunks, image_url=req.image_url, history=req.history, stream=True)
+    except Exception as e:
+        print(f"Chat Error: {e}")
+        raise HTTPException(status_code=500, detail=f"Chat failed: {str(e)}")
+
+    async def events():
+        yield _sse("citations", {"citations": citations})
+        metrics.CHAT_TTFB_SECONDS.observe(time.perf_counter() - started)
+        answer = []
+        try:
+            async for text in rag.astream_chat(messages):
+                if not answer:
+                    metrics.CHAT_TTFT_SECONDS.observe(time.perf_counter() - started)
+                answer.append(text)
+                yield _sse("token", {"text": text})
+        except Exception as e:
+            print(f"Chat Stream Error: {e}")
+            yield _sse("error", {"detail": f"Chat failed: {str(e)}"})
+            return
+        yield _sse("done", {"answer": "".join(answer), "citations": citations})
+
+    # No proxy buffering, so each event reaches the browser as it is produced
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
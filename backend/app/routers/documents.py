@@ -3,12 +3,14 @@ from fastapi.responses import StreamingResponse
 from app.models import Document, Chunk, Deadline, User
 from app.db import get_session, init_db, engine
 from sqlmodel import select, Session
-from app.schemas import DocumentBase, DocumentSummary
-from app.services import pdf, ocr, chunking, embeddings, pinecone_store, extraction, graph
+from app.schemas import DocumentBase, DocumentSummary, ProcessingJobStatus
+from app.services import vector_store, lexical_index, corpus, processing, jobs
+from app.config import PROCESSING_BACKEND
 from app.auth import get_current_user
 from fastapi import Depends
 import os
 import shutil
+import hashlib
 import uuid
 from datetime import datetime
 from typing import List
@@ -17,7 +19,6 @@ router = APIRouter()
 
 UPLOAD_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../storage/uploads'))
 MAX_UPLOAD_MB = 100
-MAX_CHUNKS = 200
 
 @router.on_event("startup")
 def startup():
@@ -40,6 +41,8 @@ def upload_document(file: UploadFile = File(...), current_user: User = Depends(g
 		CHUNK_SIZE = 1024 * 1024
 		total_size = 0
 		MAX_BYTES = MAX_UPLOAD_MB * 1024 * 1024
+		# Fingerprint while streaming so duplicate uploads can reuse earlier processing
+		hasher = hashlib.sha256()
 		
 		with open(file_path, "wb") as f:
 			while True:
@@ -56,13 +59,15 @@ def upload_document(file: UploadFile = File(...), current_user: User = Depends(g
 						os.rmdir(doc_dir)
 					raise HTTPException(status_code=400, detail="File too large.")
 				f.write(chunk)
+				hasher.update(chunk)
 		doc = Document(
 			id=doc_id,
 			filename=file.filename,
 			path=file_path,
 			created_at=datetime.utcnow(),
 			status="uploaded",
-            user_id=current_user.id
+            user_id=current_user.id,
+			file_sha256=hasher.hexdigest()
 		)
 		# Use a fresh session for this operation since we need it strictly for this
 		with Session(engine) as session:
@@ -81,7 +86,7 @@ def upload_document(file: UploadFile = File(...), current_user: User = Depends(g
 		raise HTTPException(status_code=500, detail=f"Upload failed: {e}")
 
 @router.post("/{document_id}/process")
-def process_document(document_id: str, background_tasks: BackgroundTasks, current_user: User = Depends(get_current_user), session: Session = Depends(get_session)):
+def process_document(document_id: str, background_tasks: BackgroundTasks, force: bool = False, current_user: User = Depends(get_current_user), session: Session = Depends(get_session)):
 	doc = session.get(Document, document_id)
 	if not doc:
 		raise HTTPException(status_code=404, detail="Document not found.")
@@ -96,165 +101,15 @@ def process_document(document_id: str, background_tasks: BackgroundTasks, curren
 	session.commit()
 	session.refresh(doc)
 	
-	# Offload heavy lifting to background
-	background_tasks.add_task(_process_document_bg, document_id)
+	# Offload heavy lifting to the worker queue (or the API's own threadpool if configured)
+	if PROCESSING_BACKEND == "background":
+		background_tasks.add_task(processing.process_document_safe, document_id, force)
+	else:
+		jobs.enqueue_document(session, document_id, current_user.id, force=force)
 	
 	from app.schemas import DocumentBase
 	return DocumentBase.model_validate(doc.model_dump())
 
-def _process_document_bg(document_id: str):
-	"""
-	Background task to process the document:
-	- Extract text (PDF/OCR)
-	- Chunking
-	- Embeddings (Pinecone)
-	- Classification
-	- Extraction
-	- Deadlines & Graph
-	"""
-	with Session(engine) as session:
-		doc = session.get(Document, document_id)
-		if not doc:
-			return
-
-		try:
-			# Remove old vectors/chunks/deadlines/actions
-			pinecone_store.delete_vectors_by_document(document_id)
-			session.query(Chunk).filter(Chunk.document_id == document_id).delete()
-			session.query(Deadline).filter(Deadline.document_id == document_id).delete()
-			from app.models import ActionItem
-			session.query(ActionItem).filter(ActionItem.document_id == document_id).delete()
-			session.commit()
-
-			# Extract text
-			if doc.filename.lower().endswith(".pdf"):
-				pages = pdf.extract_pdf_text_per_page(doc.path)
-				# OCR fallback for empty pages
-				for p in pages:
-					if not p["text"].strip():
-						img = pdf.extract_page_image(doc.path, p["page_number"])
-						if img:
-							ocr_text = ocr.ocr_image(img)
-							if ocr_text:
-								p["text"] = ocr_text
-			else:
-				# For images, treat as single page
-				try:
-					from PIL import Image
-					img = Image.open(doc.path)
-					text = ocr.ocr_image(img) or ""
-				except ImportError:
-					text = ""
-				pages = [{"page_number": 1, "text": text, "bbox": None}]
-
-			# Chunking
-			chunks = chunking.chunk_text_per_page(pages, doc.id, doc.filename)
-			if len(chunks) > MAX_CHUNKS:
-				# We can't raise HTTP exception here, just mark as error
-				doc.status = "error"
-				doc.error_message = "Too many chunks. Document too large."
-				session.add(doc)
-				session.commit()
-				return
-
-			# Embeddings & Pinecone
-			vectors = []
-			for c in chunks:
-				emb = embeddings.get_embedding(c["text"])
-				vector_id = f"{doc.id}:{c['page']}:{c['chunk_index']}"
-				vectors.append((vector_id, emb, {
-					"document_id": doc.id,
-					"filename": doc.filename,
-					"page": c["page"],
-					"chunk_index": c["chunk_index"],
-					"text_preview": c["text_preview"]
-				}))
-				# Save chunk in DB
-				chunk_obj = Chunk(
-					id=vector_id,
-					document_id=doc.id,
-					page=c["page"],
-					chunk_index=c["chunk_index"],
-					text=c["text"],
-					created_at=datetime.utcnow()
-				)
-				session.add(chunk_obj)
-			
-			pinecone_store.upsert_vectors(vectors)
-
-			# Classification & Extraction
-			all_text = "\n".join([p["text"] for p in pages])
-			classify = extraction.classify_document(all_text)
-			extract = extraction.extract_fields(all_text)
-			
-			import json
-			doc.doc_type = classify.get("doc_type")
-			doc.issuer = classify.get("issuer")
-			doc.extracted_json = json.dumps(extract) if extract else None
-			doc.status = "extracted" if extract else "error"
-			doc.error_message = None if extract else "Extraction failed"
-
-			# Deadlines
-			if extract and extract.get("deadlines"):
-				from datetime import date
-				for d in extract["deadlines"]:
-					due_date_val = d["due_date"]
-					try:
-						due_date_obj = date.fromisoformat(due_date_val)
-					except Exception:
-						due_date_obj = None
-					
-					if due_date_obj is None:
-						continue
-						
-					deadline = Deadline(
-						document_id=doc.id,
-						label=d.get("action", "Deadline"),
-						due_date=due_date_obj,
-						severity=d["severity"],
-						action=d.get("action")
-					)
-					session.add(deadline)
-
-			# Primary due date
-			if extract and extract.get("deadlines"):
-				due_date_str = extract["deadlines"][0]["due_date"]
-				try:
-					doc.primary_due_date = date.fromisoformat(due_date_str)
-				except Exception:
-					doc.primary_due_date = None
-			
-			session.add(doc)
-			session.commit()
-			session.refresh(doc)
-   
-			# Generate smart actions (pending actions)
-			try:
-				from app.services.agents import generate_actions_for_document
-				generate_actions_for_document(session, doc)
-			except Exception as e:
-				print(f"Action generation warning: {e}")
-   
-			# Trigger graph rebuild to include new nodes/edges
-			try:
-				# Fetch user to pass to rebuild_graph
-				user = session.get(User, doc.user_id)
-				if user:
-					graph.rebuild_graph(session, user)
-				else:
-					print(f"Graph rebuild skipped: User {doc.user_id} not found")
-			except Exception as e:
-				print(f"Graph rebuild warning: {e}")
-
-			print(f"Background processing completed for {document_id}")
-
-		except Exception as e:
-			print(f"Error processing document {document_id}: {e}")
-			doc.status = "error"
-			doc.error_message = str(e)
-			session.add(doc)
-			session.commit()
-
 @router.get("/", response_model=List[DocumentSummary])
 def list_documents(current_user: User = Depends(get_current_user), session: Session = Depends(get_session)):
 	# Defer loading extracted_json for performance if possible, 
@@ -269,6 +124,16 @@ def get_document(document_id: str, current_user: User = Depends(get_current_user
 		raise HTTPException(status_code=404, detail="Document not found.")
 	return doc
 
+@router.get("/{document_id}/job", response_model=ProcessingJobStatus)
+def get_processing_job(document_id: str, current_user: User = Depends(get_current_user), session: Session = Depends(get_session)):
+	doc = session.get(Document, document_id)
+	if not doc or doc.user_id != current_user.id:
+		raise HTTPException(status_code=404, detail="Document not found.")
+	job = jobs.get_latest_job(session, document_id)
+	if not job:
+		raise HTTPException(status_code=404, detail="No processing job for this document.")
+	return job
+
 @router.get("/{document_id}/pdf")
 def stream_pdf(document_id: str, current_user: User = Depends(get_current_user), session: Session = Depends(get_session)):
 	doc = session.get(Document, document_id)
@@ -296,16 +161,25 @@ def delete_document(document_id: str, current_user: User = Depends(get_current_u
 		if chunk_ids:
 			try:
 				print(f"DEBUG: Deleting {len(chunk_ids)} vectors for document {document_id}")
-				pinecone_store.delete_vectors(chunk_ids)
+				failed = vector_store.failed_ids(vector_store.delete_vectors(chunk_ids))
+				if failed:
+					print(f"Warning: Failed to delete {len(failed)} of {len(chunk_ids)} vectors by ID for {document_id}")
 			except Exception as e:
 				print(f"Warning: Failed to delete vectors by ID for {document_id}: {e}")
 
 		try:
 			# Backup: delete by filter
-			pinecone_store.delete_vectors_by_document(document_id)
+			result = vector_store.delete_vectors_by_document(document_id)
+			if not result["ok"]:
+				print(f"Warning: Failed to delete vectors by filter for {document_id}: {result['error']}")
 		except Exception as e:
 			print(f"Warning: Failed to delete vectors by filter for {document_id}: {e}")
 
+		try:
+			lexical_index.delete_document(document_id)
+		except Exception as e:
+			print(f"Warning: Failed to remove {document_id} from the keyword index: {e}")
+
 		# 2. Delete SQL Chunk records
 		for chunk in chunks:
 			session.delete(chunk)
@@ -315,8 +189,10 @@ def delete_document(document_id: str, current_user: User = Depends(get_current_u
 
 		# 4. Delete SQL ActionItem records (Import locally to avoid circular imports if needed, 
 		#    but we can also duplicate the model import or just use SQL)
-		from app.models import ActionItem, GraphNode, GraphEdge
+		from app.models import ActionItem, GraphNode, GraphEdge, ProcessingJob, DocumentPage
 		session.query(ActionItem).filter(ActionItem.document_id == document_id).delete()
+		session.query(ProcessingJob).filter(ProcessingJob.document_id == document_id).delete()
+		session.query(DocumentPage).filter(DocumentPage.document_id == document_id).delete()
 
 		# 5. Delete GraphNode (document) and related edges
 		print(f"DEBUG: Deleting graph nodes/edges for {document_id}")
@@ -379,6 +255,7 @@ def delete_document(document_id: str, current_user: User = Depends(get_current_u
 		# 7. Delete Document record
 		session.delete(doc)
 		session.commit()
+		corpus.bump_version(session, current_user.id)
 		
 		# Rebuild graph to clean up any orphaned nodes if necessary, 
 		# though strict orphaned node cleanup might be too aggressive/expensive here.
@@ -26,6 +26,22 @@ class DocumentSummary(BaseModel):
     status: str
     error_message: Optional[str]
 
+class ProcessingJobStatus(BaseModel):
+    id: int
+    document_id: str
+    status: str
+    stage: Optional[str]
+    progress: float
+    attempts: int
+    max_attempts: int
+    next_run_at: datetime
+    last_error: Optional[str]
+    created_at: datetime
+    updated_at: datetime
+
+    class Config:
+        from_attributes = True
+
 class ChunkBase(BaseModel):
     id: str
     document_id: str
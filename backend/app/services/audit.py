@@ -2,12 +2,9 @@ from sqlmodel import Session, select
 from app.models import Document, GraphNode, GraphEdge
 from app.schemas import ConflictReport, ConflictItem
 from typing import List, Dict, Any
-import openai
-from app.config import OPENAI_API_KEY
+from app.services import llm
 import json
 
-openai.api_key = OPENAI_API_KEY
-
 def analyze_conflicts(session: Session, user, node_ids: List[str] = None) -> ConflictReport:
     """
     Analyzes the selected nodes (and their immediate neighbors) for conflicting information.
@@ -103,7 +100,8 @@ def analyze_conflicts(session: Session, user, node_ids: List[str] = None) -> Con
     """
 
     try:
-        response = openai.chat.completions.create(
+        response = llm.chat_completion(
+            "audit",
             model="gpt-4o",
             messages=[
                 {"role": "system", "content": "You are an expert auditor AI. Find logical inconsistencies in financial and legal documents."},
@@ -0,0 +1,188 @@
+import os
+import sqlite3
+import threading
+import time
+import logging
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, Hashable
+from app.services import metrics
+
+class DiskCache:
+	"""
+	Small persistent key/value cache backed by a local SQLite file.
+	Entries are evicted least-recently-used first once the store grows past max_bytes.
+	Safe to share between threads and between worker processes (WAL journal).
+	"""
+
+	def __init__(self, path: str, max_bytes: int, evict_fraction: float = 0.1):
+		self.path = os.path.abspath(path)
+		self.max_bytes = max_bytes
+		self.evict_fraction = evict_fraction
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self._local = threading.local()
+		self._lock = threading.Lock()
+		os.makedirs(os.path.dirname(self.path), exist_ok=True)
+		conn = self._conn()
+		conn.execute(
+			"CREATE TABLE IF NOT EXISTS entries ("
+			"key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+		)
+		conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_last_access ON entries(last_access)")
+		conn.commit()
+
+	def _conn(self) -> sqlite3.Connection:
+		conn = getattr(self._local, "conn", None)
+		if conn is None:
+			conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+			conn.execute("PRAGMA journal_mode=WAL")
+			conn.execute("PRAGMA synchronous=NORMAL")
+			self._local.conn = conn
+		return conn
+
+	def get(self, key: str) -> Optional[bytes]:
+		return self.get_many([key]).get(key)
+
+	def get_many(self, keys: List[str]) -> Dict[str, bytes]:
+		"""
+		Look up several keys at once. Missing keys are absent from the result.
+		"""
+		found = {}
+		if not keys:
+			return found
+		try:
+			conn = self._conn()
+			unique = list(dict.fromkeys(keys))
+			# Stay well below SQLite's bound-parameter limit
+			for i in range(0, len(unique), 500):
+				batch = unique[i:i+500]
+				placeholders = ",".join("?" * len(batch))
+				rows = conn.execute(f"SELECT key, value FROM entries WHERE key IN ({placeholders})", batch).fetchall()
+				for k, v in rows:
+					found[k] = v
+				if rows:
+					now = time.time()
+					conn.executemany("UPDATE entries SET last_access = ? WHERE key = ?", [(now, k) for k, _ in rows])
+		except sqlite3.Error as e:
+			logging.warning(f"Cache read failed ({self.path}): {e}")
+		with self._lock:
+			self.hits += sum(1 for k in keys if k in found)
+			self.misses += sum(1 for k in keys if k not in found)
+		return found
+
+	def set(self, key: str, value: bytes):
+		self.set_many({key: value})
+
+	def set_many(self, items: Dict[str, bytes]):
+		if not items:
+			return
+		try:
+			conn = self._conn()
+			now = time.time()
+			conn.executemany(
+				"INSERT OR REPLACE INTO entries (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+				[(k, v, len(v), now) for k, v in items.items()]
+			)
+			self._evict_if_needed(conn)
+		except sqlite3.Error as e:
+			logging.warning(f"Cache write failed ({self.path}): {e}")
+
+	def _evict_if_needed(self, conn: sqlite3.Connection):
+		total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+		if total <= self.max_bytes:
+			return
+		# Evict down to (1 - evict_fraction) of the budget so we don't evict on every write
+		target = int(self.max_bytes * (1 - self.evict_fraction))
+		to_free = total - target
+		freed = 0
+		evicted = []
+		for key, size in conn.execute("SELECT key, size FROM entries ORDER BY last_access ASC"):
+			evicted.append((key,))
+			freed += size
+			if freed >= to_free:
+				break
+		conn.executemany("DELETE FROM entries WHERE key = ?", evicted)
+		with self._lock:
+			self.evictions += len(evicted)
+
+	def stats(self) -> Dict[str, Any]:
+		entries, size = 0, 0
+		try:
+			entries, size = self._conn().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+		except sqlite3.Error as e:
+			logging.warning(f"Cache stats failed ({self.path}): {e}")
+		lookups = self.hits + self.misses
+		return {
+			"hits": self.hits,
+			"misses": self.misses,
+			"hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+			"evictions": self.evictions,
+			"entries": entries,
+			"bytes": size,
+			"max_bytes": self.max_bytes,
+		}
+
+	def clear(self):
+		self._conn().execute("DELETE FROM entries")
+
+class TTLCache:
+	"""
+	Bounded in-memory LRU cache whose entries also expire after ttl_seconds.
+	Thread-safe. Lookups, evictions and expirations are counted in metrics under `name`.
+	"""
+
+	def __init__(self, name: str, max_entries: int, ttl_seconds: float):
+		self.name = name
+		self.max_entries = max_entries
+		self.ttl_seconds = ttl_seconds
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.expirations = 0
+		self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+		self._lock = threading.Lock()
+
+	def get(self, key: Hashable) -> Optional[Any]:
+		now = time.monotonic()
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry is not None and entry[0] <= now:
+				del self._entries[key]
+				self.expirations += 1
+				metrics.CACHE_EVICTIONS.inc(cache=self.name, reason="expired")
+				entry = None
+			if entry is None:
+				self.misses += 1
+				metrics.CACHE_LOOKUPS.inc(cache=self.name, result="miss")
+				return None
+			self._entries.move_to_end(key)
+			self.hits += 1
+		metrics.CACHE_LOOKUPS.inc(cache=self.name, result="hit")
+		return entry[1]
+
+	def set(self, key: Hashable, value: Any):
+		with self._lock:
+			self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+			self._entries.move_to_end(key)
+			while len(self._entries) > self.max_entries:
+				self._entries.popitem(last=False)
+				self.evictions += 1
+				metrics.CACHE_EVICTIONS.inc(cache=self.name, reason="size")
+
+	def clear(self):
+		with self._lock:
+			self._entries.clear()
+
+	def stats(self) -> Dict[str, Any]:
+		with self._lock:
+			lookups = self.hits + self.misses
+			return {
+				"hits": self.hits,
+				"misses": self.misses,
+				"hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+				"evictions": self.evictions,
+				"expirations": self.expirations,
+				"entries": len(self._entries),
+				"max_entries": self.max_entries,
+			}
@@ -1,13 +1,19 @@
 
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Iterator, Tuple
+from app.config import CHUNK_STRATEGY, CHUNK_TARGET_TOKENS, CHUNK_OVERLAP_TOKENS, CHUNK_MIN_TOKENS
+from app.services.tokens import count_tokens, truncate_to_tokens
 import math
+import re
 
-def chunk_text_per_page(pages: List[Dict[str, Any]], document_id: str, filename: str, chunk_size: int = 1000, overlap: int = 150) -> List[Dict[str, Any]]:
+PARAGRAPH_SPLIT = re.compile(r"\n\s*\n")
+# Sentence end followed by whitespace and something that looks like the start of a new sentence
+SENTENCE_SPLIT = re.compile(r"(?<=[.!?;:])\s+(?=[\"'(\[]?[A-Z0-9])")
+
+def iter_chunks_per_page(pages: Iterable[Dict[str, Any]], document_id: str, filename: str, chunk_size: int = 1000, overlap: int = 150) -> Iterator[Dict[str, Any]]:
 	"""
-	For each page, chunk text into ~chunk_size chars with overlap.
-	Returns list of chunks with metadata.
+	Streaming variant of chunk_text_per_page: consumes pages lazily and yields chunks
+	as soon as each page is split, so memory does not grow with document length.
 	"""
-	all_chunks = []
 	for page in pages:
 		text = page["text"]
 		page_number = page["page_number"]
@@ -16,16 +22,170 @@ def chunk_text_per_page(pages: List[Dict[str, Any]], document_id: str, filename:
 		while start < len(text):
 			end = min(start + chunk_size, len(text))
 			chunk_text = text[start:end]
-			all_chunks.append({
+			yield {
 				"document_id": document_id,
 				"filename": filename,
 				"page": page_number,
 				"chunk_index": chunk_index,
 				"text": chunk_text,
 				"text_preview": chunk_text[:120],
-			})
+			}
 			chunk_index += 1
 			if end == len(text):
 				break
 			start = end - overlap
-	return all_chunks
+
+def chunk_text_per_page(pages: List[Dict[str, Any]], document_id: str, filename: str, chunk_size: int = 1000, overlap: int = 150) -> List[Dict[str, Any]]:
+	"""
+	For each page, chunk text into ~chunk_size chars with overlap.
+	Returns list of chunks with metadata.
+	"""
+	return list(iter_chunks_per_page(pages, document_id, filename, chunk_size, overlap))
+
+def _split_units(text: str, max_tokens: int) -> Iterator[Tuple[str, int, bool]]:
+	"""
+	Split page text into sentence-sized units, yielding (text, tokens, starts_paragraph).
+	Sentences longer than max_tokens are hard-split on token boundaries.
+	"""
+	for paragraph in PARAGRAPH_SPLIT.split(text):
+		# PDF text has hard line breaks inside paragraphs; normalise them to spaces
+		paragraph = " ".join(paragraph.split())
+		if not paragraph:
+			continue
+		first = True
+		for sentence in SENTENCE_SPLIT.split(paragraph):
+			tokens = count_tokens(sentence)
+			while tokens > max_tokens:
+				head = truncate_to_tokens(sentence, max_tokens)
+				yield head, count_tokens(head), first
+				first = False
+				sentence = sentence[len(head):].lstrip()
+				tokens = count_tokens(sentence)
+			if sentence:
+				yield sentence, tokens, first
+				first = False
+
+def _join_units(units: List[Tuple[str, int, bool]]) -> str:
+	parts = []
+	for i, (text, _, starts_paragraph) in enumerate(units):
+		if i > 0:
+			parts.append("\n\n" if starts_paragraph else " ")
+		parts.append(text)
+	return "".join(parts)
+
+def iter_token_chunks(pages: Iterable[Dict[str, Any]], document_id: str, filename: str, target_tokens: int = CHUNK_TARGET_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS, min_tokens: int = CHUNK_MIN_TOKENS) -> Iterator[Dict[str, Any]]:
+	"""
+	Token-budgeted chunking that respects paragraph and sentence boundaries.
+	- Chunks fill up to ~target_tokens of whole sentences (local tokenizer when available).
+	- Consecutive chunks of the same page share up to overlap_tokens of trailing sentences.
+	- Short pages are merged: a chunk only ends at a page break once it holds min_tokens.
+	Each chunk keeps provenance: `page` is where it starts (used in its id and citations)
+	and `page_end` where it ends.
+	"""
+	buffer: List[Tuple[str, int, bool]] = []
+	buffer_tokens = 0
+	start_page = None
+	end_page = None
+	next_index: Dict[int, int] = {}
+
+	def emit():
+		text = _join_units(buffer)
+		chunk_index = next_index.get(start_page, 0)
+		next_index[start_page] = chunk_index + 1
+		return {
+			"document_id": document_id,
+			"filename": filename,
+			"page": start_page,
+			"page_end": end_page,
+			"chunk_index": chunk_index,
+			"text": text,
+			"text_preview": text[:120],
+		}
+
+	for page in pages:
+		page_number = page["page_number"]
+		if buffer and buffer_tokens >= min_tokens:
+			# Page break with a reasonably sized chunk: close it so citations stay on one page
+			yield emit()
+			buffer, buffer_tokens, start_page = [], 0, None
+		for unit in _split_units(page["text"] or "", target_tokens):
+			if buffer and buffer_tokens + unit[1] > target_tokens:
+				yield emit()
+				# Carry trailing sentences forward as overlap, unless they came from an earlier page
+				carried, carried_tokens = [], 0
+				if end_page == page_number:
+					for prev in reversed(buffer):
+						if carried_tokens + prev[1] > overlap_tokens:
+							break
+						carried.insert(0, prev)
+						carried_tokens += prev[1]
+				buffer, buffer_tokens = carried, carried_tokens
+				start_page = page_number
+			if not buffer:
+				start_page = page_number
+			buffer.append(unit)
+			buffer_tokens += unit[1]
+			end_page = page_number
+	if buffer:
+		yield emit()
+
+def iter_chunks(pages: Iterable[Dict[str, Any]], document_id: str, filename: str, strategy: str = CHUNK_STRATEGY) -> Iterator[Dict[str, Any]]:
+	"""
+	Chunk a stream of pages with the configured strategy ('tokens' or the legacy 'chars').
+	"""
+	if strategy == "chars":
+		return iter_chunks_per_page(pages, document_id, filename)
+	return iter_token_chunks(pages, document_id, filename)
+
+class SectionBuilder:
+	"""
+	Groups a stream of pages into token-bounded sections for sectioned LLM extraction.
+	Whole pages are kept together where they fit; a page larger than a section is split
+	on sentence boundaries. Stops collecting after max_sections (truncated is then True).
+	"""
+
+	def __init__(self, max_tokens: int, max_sections: int):
+		self.max_tokens = max_tokens
+		self.max_sections = max_sections
+		self.sections: List[Dict[str, Any]] = []
+		self.truncated = False
+		self._parts: List[str] = []
+		self._tokens = 0
+		self._first_page = None
+		self._last_page = None
+
+	def _flush(self):
+		if self._parts:
+			self.sections.append({
+				"text": "\n".join(self._parts),
+				"first_page": self._first_page,
+				"last_page": self._last_page,
+				"tokens": self._tokens,
+			})
+		self._parts, self._tokens, self._first_page = [], 0, None
+
+	def _add(self, page_number: int, text: str, tokens: int):
+		if self._tokens + tokens > self.max_tokens:
+			self._flush()
+		if len(self.sections) >= self.max_sections:
+			self.truncated = True
+			return
+		if self._first_page is None:
+			self._first_page = page_number
+		self._last_page = page_number
+		self._parts.append(text)
+		self._tokens += tokens
+
+	def add_page(self, page_number: int, text: str):
+		if self.truncated or not text.strip():
+			return
+		tokens = count_tokens(text)
+		if tokens <= self.max_tokens:
+			self._add(page_number, text, tokens)
+			return
+		for unit, unit_tokens, _ in _split_units(text, self.max_tokens):
+			self._add(page_number, unit, unit_tokens)
+
+	def finish(self) -> List[Dict[str, Any]]:
+		self._flush()
+		return self.sections
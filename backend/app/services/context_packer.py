@@ -0,0 +1,80 @@
+from typing import List, Dict, Any, Optional, Tuple
+from app.services import metrics
+from app.services.tokens import count_tokens, truncate_to_tokens
+from app.config import CONTEXT_TOKEN_BUDGET
+
+# Shortest shared edge treated as chunker overlap rather than coincidence
+MIN_OVERLAP_CHARS = 20
+MAX_OVERLAP_CHARS = 2000
+
+def citation_marker(chunk: Dict[str, Any]) -> str:
+    return f"[doc:{chunk['document_id']} page:{chunk['page']} chunk:{chunk['chunk_index']}]"
+
+def overlap_length(prev: str, text: str) -> int:
+    """
+    Length of the longest suffix of prev that is also a prefix of text
+    (the overlap the chunker copies between neighbouring chunks), or 0.
+    """
+    limit = min(len(prev), len(text), MAX_OVERLAP_CHARS)
+    for k in range(limit, MIN_OVERLAP_CHARS - 1, -1):
+        if prev.endswith(text[:k]):
+            return k
+    return 0
+
+def _blocks(selected: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+    """
+    Group chunks into runs of consecutive chunk_index on the same document page,
+    ordered by the priority of each run's best chunk.
+    """
+    order = {id(c): i for i, c in enumerate(selected)}
+    ordered = sorted(selected, key=lambda c: (c["document_id"], c["page"], c["chunk_index"]))
+    blocks: List[List[Dict[str, Any]]] = []
+    for c in ordered:
+        last = blocks[-1][-1] if blocks else None
+        if last and last["document_id"] == c["document_id"] and last["page"] == c["page"] and last["chunk_index"] + 1 == c["chunk_index"]:
+            blocks[-1].append(c)
+        else:
+            blocks.append([c])
+    blocks.sort(key=lambda b: min(order[id(c)] for c in b))
+    return blocks
+
+def _render(selected: List[Dict[str, Any]], markers: bool) -> str:
+    parts = []
+    for block in _blocks(selected):
+        pieces = []
+        prev = None
+        for c in block:
+            text = c["text"]
+            if prev is not None:
+                text = text[overlap_length(prev, text):]
+            prev = c["text"]
+            pieces.append(f"{citation_marker(c)} {text}" if markers else text)
+        parts.append(" ".join(pieces) if markers else "".join(pieces))
+    return "\n\n".join(parts)
+
+def pack_context(chunks: List[Dict[str, Any]], max_tokens: Optional[int] = None, markers: bool = True) -> Tuple[str, List[Dict[str, Any]]]:
+    """
+    Build the prompt context from ranked chunks within a token budget.
+    Chunks are taken in the given (priority) order while the packed context still fits;
+    consecutive chunks of one page are stitched into a single passage with the shared
+    overlap removed, so an added neighbour only costs its new text. Every chunk keeps its
+    own [doc: page: chunk:] marker at the point where its text starts, so citations stay valid.
+    Returns (context, packed_chunks); packed_chunks are the chunks present in the context.
+    """
+    max_tokens = max_tokens or CONTEXT_TOKEN_BUDGET
+    selected: List[Dict[str, Any]] = []
+    context = ""
+    with metrics.track("context_pack", items=len(chunks)):
+        for c in chunks:
+            candidate = _render(selected + [c], markers)
+            if count_tokens(candidate) <= max_tokens:
+                selected.append(c)
+                context = candidate
+            elif not selected:
+                # A single chunk larger than the whole budget: keep its head rather than nothing
+                head = dict(c)
+                marker = f"{citation_marker(c)} " if markers else ""
+                head["text"] = truncate_to_tokens(c["text"], max(0, max_tokens - count_tokens(marker)))
+                selected.append(head)
+                context = _render(selected, markers)
+    return context, selected
@@ -0,0 +1,29 @@
+from sqlmodel import Session, update
+from sqlalchemy.exc import IntegrityError
+from app.models import CorpusVersion
+from datetime import datetime
+
+def get_version(session: Session, user_id: str) -> int:
+    """
+    Current corpus version for a user (0 if their corpus never changed).
+    """
+    row = session.get(CorpusVersion, user_id)
+    return row.version if row else 0
+
+def bump_version(session: Session, user_id: str):
+    """
+    Mark the user's corpus as changed, invalidating cached retrievals in every process.
+    Commits the session.
+    """
+    now = datetime.utcnow()
+    stmt = update(CorpusVersion).where(CorpusVersion.user_id == user_id).values(version=CorpusVersion.version + 1, updated_at=now)
+    if session.exec(stmt).rowcount == 0:
+        try:
+            session.add(CorpusVersion(user_id=user_id, version=1, updated_at=now))
+            session.commit()
+            return
+        except IntegrityError:
+            # Another process created the row first
+            session.rollback()
+            session.exec(stmt)
+    session.commit()
@@ -1,19 +1,146 @@
-
-import openai
 import os
-from typing import List
-from app.config import OPENAI_API_KEY
-
-openai.api_key = OPENAI_API_KEY
+import hashlib
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Dict, Any
+from app.config import (
+	EMBEDDING_BATCH_MAX_TOKENS, EMBEDDING_BATCH_MAX_INPUTS, EMBEDDING_CONCURRENCY,
+	CACHE_DIR, EMBEDDING_CACHE_ENABLED, EMBEDDING_CACHE_MAX_MB
+)
+from app.services import llm, metrics
+from app.services.cache import DiskCache
+from app.services.tokens import count_tokens, truncate_to_tokens
 
 EMBEDDING_MODEL = "text-embedding-3-small"  # Update if newer stable model is available
+EMBEDDING_MAX_INPUT_TOKENS = 8191
+
+_cache: Optional[DiskCache] = None
+
+def _get_cache() -> Optional[DiskCache]:
+	global _cache
+	if not EMBEDDING_CACHE_ENABLED:
+		return None
+	if _cache is None:
+		_cache = DiskCache(os.path.join(CACHE_DIR, "embeddings.sqlite"), max_bytes=EMBEDDING_CACHE_MAX_MB * 1024 * 1024)
+	return _cache
+
+metrics.register_cache("embedding", _get_cache)
+
+def _cache_key(text: str) -> str:
+	"""
+	Content-addressed cache key: (model, sha256(text)).
+	"""
+	return f"{EMBEDDING_MODEL}:{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
+
+def _encode(embedding: List[float]) -> bytes:
+	return array("f", embedding).tobytes()
+
+def _decode(blob: bytes) -> List[float]:
+	values = array("f")
+	values.frombytes(blob)
+	return values.tolist()
+
+def get_cache_stats() -> Dict[str, Any]:
+	"""
+	Hit/miss counters and size of the embedding cache.
+	"""
+	cache = _get_cache()
+	return cache.stats() if cache else {"enabled": False}
 
 def get_embedding(text: str) -> List[float]:
 	"""
 	Get embedding vector for a text chunk using OpenAI API.
+	Reads through the local embedding cache.
 	"""
-	resp = openai.embeddings.create(
+	cache = _get_cache()
+	key = _cache_key(text)
+	if cache:
+		blob = cache.get(key)
+		metrics.CACHE_LOOKUPS.inc(cache="embedding", result="hit" if blob is not None else "miss")
+		if blob is not None:
+			return _decode(blob)
+	resp = llm.create_embeddings(
+		"query_embedding",
 		input=text,
 		model=EMBEDDING_MODEL
 	)
-	return resp.data[0].embedding
+	embedding = resp.data[0].embedding
+	if cache:
+		cache.set(key, _encode(embedding))
+	return embedding
+
+def _pack_batches(texts: List[str], max_tokens: int, max_inputs: int) -> List[List[int]]:
+	"""
+	Group text indices into batches bounded by total tokens and number of inputs.
+	"""
+	batches = []
+	current = []
+	current_tokens = 0
+	for i, text in enumerate(texts):
+		n = min(count_tokens(text), EMBEDDING_MAX_INPUT_TOKENS)
+		if current and (current_tokens + n > max_tokens or len(current) >= max_inputs):
+			batches.append(current)
+			current = []
+			current_tokens = 0
+		current.append(i)
+		current_tokens += n
+	if current:
+		batches.append(current)
+	return batches
+
+def _embed_batch(texts: List[str]) -> List[List[float]]:
+	resp = llm.create_embeddings(
+		"embedding",
+		input=texts,
+		model=EMBEDDING_MODEL
+	)
+	# The API returns items tagged with their input index; don't rely on response order
+	ordered = sorted(resp.data, key=lambda d: d.index)
+	return [d.embedding for d in ordered]
+
+def get_embeddings_batch(texts: List[str], max_tokens: int = EMBEDDING_BATCH_MAX_TOKENS, max_inputs: int = EMBEDDING_BATCH_MAX_INPUTS, concurrency: int = EMBEDDING_CONCURRENCY) -> List[List[float]]:
+	"""
+	Get embedding vectors for many texts.
+	Texts are packed into token-bounded batches that are sent concurrently.
+	Results are returned in the same order as the input.
+	Cached texts are served from the local embedding cache; only misses hit the API.
+	"""
+	if not texts:
+		return []
+	# Empty strings are rejected by the API and oversized inputs would fail the whole batch
+	inputs = [truncate_to_tokens(t, EMBEDDING_MAX_INPUT_TOKENS) if t.strip() else " " for t in texts]
+	results: List[List[float]] = [None] * len(inputs)
+
+	cache = _get_cache()
+	keys = [_cache_key(t) for t in inputs]
+	if cache:
+		cached = cache.get_many(keys)
+		for i, key in enumerate(keys):
+			if key in cached:
+				results[i] = _decode(cached[key])
+		hits = sum(1 for r in results if r is not None)
+		metrics.CACHE_LOOKUPS.inc(hits, cache="embedding", result="hit")
+		metrics.CACHE_LOOKUPS.inc(len(results) - hits, cache="embedding", result="miss")
+
+	# Embed each distinct missing text once
+	missing: Dict[str, List[int]] = {}
+	for i, emb in enumerate(results):
+		if emb is None:
+			missing.setdefault(keys[i], []).append(i)
+	if not missing:
+		return results
+	pending = [positions[0] for positions in missing.values()]
+	batches = _pack_batches([inputs[i] for i in pending], max_tokens, max_inputs)
+
+	fresh = {}
+	with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(batches)))) as pool:
+		futures = [(batch, pool.submit(_embed_batch, [inputs[pending[j]] for j in batch])) for batch in batches]
+		for batch, future in futures:
+			for j, emb in zip(batch, future.result()):
+				key = keys[pending[j]]
+				fresh[key] = emb
+				for i in missing[key]:
+					results[i] = emb
+	if cache:
+		cache.set_many({k: _encode(v) for k, v in fresh.items()})
+	return results
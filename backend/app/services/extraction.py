@@ -1,14 +1,22 @@
 
 
-import openai
+from app.services import llm, metrics, rule_extraction
+from app.services.graph import normalize_entity_name
+from app.config import (
+	EXTRACTION_MODE, EXTRACTION_CONCURRENCY, EXTRACTION_SECTION_TOKENS,
+	RULE_EXTRACTION_ENABLED, RULE_EXTRACTION_SKIP_CONFIDENCE, RULE_EXTRACTION_SHRINK_CONFIDENCE, RULE_EXTRACTION_SKIP_MAX_CHARS
+)
 import os
+import math
+import time
 import logging
 import json
-from typing import Dict, Any, Optional
-from app.config import OPENAI_API_KEY
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional, Tuple, List, Callable
 from pydantic import BaseModel, ValidationError
 
-openai.api_key = OPENAI_API_KEY
+DOC_CLASSES = ["rent", "bill", "insurance", "IRS", "immigration", "medical", "other"]
 
 CLASSIFY_PROMPT = (
 	"You are a document classifier. Given the following text, classify the document type as one of: rent, bill, insurance, IRS, immigration, medical, other. "
@@ -58,6 +66,22 @@ EXTRACT_SCHEMA = {
 	"recommended_actions": ["string", "..."]
 }
 
+SECTION_NOTE = (
+	"The text below is section {index} of {count} of a longer document (pages {first_page}-{last_page}). "
+	"Extract only what this section states; the other sections are processed separately and merged.\n"
+)
+
+RULES_NOTE = "Amounts, dates and addresses have already been extracted from this document; only fill the fields in the schema.\n"
+
+LIST_FIELDS = ["people", "organizations", "roles", "locations", "custom_entities", "tags", "addresses", "amounts", "dates", "deadlines", "summary_bullets", "recommended_actions"]
+SEVERITY_RANK = {"low": 0, "medium": 1, "high": 2}
+# Sections may be merged up to this multiple of EXTRACTION_SECTION_TOKENS to fit one wave of calls
+MAX_SECTION_GROWTH = 4
+
+# Single-pass mode: the extraction call also returns the classifier's coarse class,
+# so Document.doc_type keeps the same vocabulary without a separate classify call
+SINGLE_PASS_SCHEMA = {"document_class": "|".join(DOC_CLASSES), **EXTRACT_SCHEMA}
+
 class ExtractedFieldsModel(BaseModel):
 	doc_type: str
 	issuer: Optional[str] = None
@@ -82,7 +106,8 @@ def classify_document(text: str) -> Dict[str, Any]:
 	prompt = CLASSIFY_PROMPT.replace("{input}", text[:2000])
 	logging.info(f"[OpenAI] Classification prompt: {prompt[:500]}")
 	try:
-		resp = openai.chat.completions.create(
+		resp = llm.chat_completion(
+			"classify",
 			model="gpt-3.5-turbo-1106",
 			messages=[{"role": "system", "content": "Classify document and extract issuer."},
 					  {"role": "user", "content": prompt}],
@@ -96,11 +121,16 @@ def classify_document(text: str) -> Dict[str, Any]:
 		logging.error(f"[OpenAI] Classification error: {e}")
 		return {"doc_type": "other", "issuer": None}
 
-def extract_fields(text: str) -> Optional[Dict[str, Any]]:
-	prompt = EXTRACT_PROMPT.replace("{input}", text[:4000]).replace("{schema}", str(EXTRACT_SCHEMA))
+def extract_fields(text: str, schema: Dict[str, Any] = EXTRACT_SCHEMA, max_chars: Optional[int] = 4000, note: str = "") -> Optional[Dict[str, Any]]:
+	"""
+	Extract fields from text (cut to max_chars; None sends it whole, for pre-sized sections).
+	"""
+	body = text[:max_chars] if max_chars else text
+	prompt = note + EXTRACT_PROMPT.replace("{input}", body).replace("{schema}", str(schema))
 	logging.info(f"[OpenAI] Extraction prompt: {prompt[:1000]}")
 	try:
-		resp = openai.chat.completions.create(
+		resp = llm.chat_completion(
+			"extract",
 			model="gpt-4o",
 			messages=[{"role": "system", "content": "Extract fields as strict JSON."},
 					  {"role": "user", "content": prompt}],
@@ -113,7 +143,7 @@ def extract_fields(text: str) -> Optional[Dict[str, Any]]:
 			# Note: Pydantic v2 model_validate does not mutate in-place usually if dict is passed directly unless we instantiate model.
 			# But here we just want to ensure structure is roughly correct.
 			# We'll manually fix None -> [] for safety.
-			for k in ["people", "organizations", "roles", "locations", "custom_entities", "tags", "addresses", "amounts", "dates", "deadlines", "summary_bullets", "recommended_actions"]:
+			for k in LIST_FIELDS:
 				if k not in data or data[k] is None:
 					data[k] = []
 			
@@ -126,3 +156,229 @@ def extract_fields(text: str) -> Optional[Dict[str, Any]]:
 	except Exception as e:
 		logging.error(f"[OpenAI] Extraction error: {e}")
 		return None
+
+def _classify_tracked(text: str) -> Dict[str, Any]:
+	with metrics.track("classify"):
+		return classify_document(text)
+
+def _extract_tracked(text: str, schema: Dict[str, Any] = EXTRACT_SCHEMA, max_chars: Optional[int] = 4000, note: str = "") -> Optional[Dict[str, Any]]:
+	with metrics.track("extract"):
+		return extract_fields(text, schema, max_chars=max_chars, note=note)
+
+def _merge_records(lists: List[list], key: Callable[[Dict[str, Any]], Any]) -> list:
+	"""
+	Concatenate record lists, keeping the first record per key and filling its empty
+	fields from later duplicates.
+	"""
+	merged: Dict[Any, Dict[str, Any]] = {}
+	for records in lists:
+		for r in records or []:
+			if not isinstance(r, dict):
+				continue
+			k = key(r)
+			if not k or (isinstance(k, tuple) and not any(k)):
+				continue
+			if k not in merged:
+				merged[k] = dict(r)
+			else:
+				for field, value in r.items():
+					if merged[k].get(field) in (None, "") and value not in (None, ""):
+						merged[k][field] = value
+	return list(merged.values())
+
+def _unique_strings(lists: List[list]) -> List[str]:
+	seen, out = set(), []
+	for values in lists:
+		for v in values or []:
+			k = normalize_entity_name(str(v))
+			if k and k not in seen:
+				seen.add(k)
+				out.append(v)
+	return out
+
+def _name_key(r: Dict[str, Any]) -> str:
+	return normalize_entity_name(r.get("name") or "")
+
+def merge_extractions(parts: List[Optional[Dict[str, Any]]]) -> Optional[Dict[str, Any]]:
+	"""
+	Reduce per-section extractions into one document-level result.
+	Entities are deduplicated by graph.normalize_entity_name (so "TechCorp, Inc." and
+	"TechCorp" merge), relationships by normalized endpoints and relation, and amounts,
+	dates and deadlines by value; a deadline found twice keeps its highest severity.
+	Document-level fields come from the first section that states them.
+	"""
+	parts = [p for p in parts if p]
+	if len(parts) <= 1:
+		return parts[0] if parts else None
+
+	merged: Dict[str, Any] = {}
+	for k in ("doc_type", "issuer", "category"):
+		merged[k] = next((p[k] for p in parts if p.get(k)), None)
+	classes = [p["document_class"] for p in parts if p.get("document_class")]
+	if classes:
+		merged["document_class"] = Counter(classes).most_common(1)[0][0]
+	scores = [p["priority_score"] for p in parts if isinstance(p.get("priority_score"), (int, float))]
+	merged["priority_score"] = max(scores) if scores else None
+
+	merged["people"] = _merge_records([p.get("people") for p in parts], _name_key)
+	merged["organizations"] = _merge_records([p.get("organizations") for p in parts], _name_key)
+	merged["roles"] = _merge_records([p.get("roles") for p in parts], _name_key)
+	merged["locations"] = _merge_records([p.get("locations") for p in parts], _name_key)
+	merged["custom_entities"] = _merge_records(
+		[p.get("custom_entities") for p in parts],
+		lambda r: (_name_key(r), (r.get("type") or "").lower())
+	)
+	merged["relationships"] = _merge_records(
+		[p.get("relationships") for p in parts],
+		lambda r: (normalize_entity_name(r.get("source") or ""), (r.get("relation") or "").strip().upper(), normalize_entity_name(r.get("target") or ""))
+	)
+	merged["addresses"] = _merge_records([p.get("addresses") for p in parts], lambda r: " ".join((r.get("address") or "").lower().split()))
+	merged["amounts"] = _merge_records(
+		[p.get("amounts") for p in parts],
+		lambda r: ((r.get("label") or "").lower(), r.get("value"), (r.get("currency") or "").upper())
+	)
+	merged["dates"] = _merge_records([p.get("dates") for p in parts], lambda r: ((r.get("label") or "").lower(), r.get("date")))
+
+	deadlines: Dict[Any, Dict[str, Any]] = {}
+	for p in parts:
+		for d in p.get("deadlines") or []:
+			if not isinstance(d, dict):
+				continue
+			k = (normalize_entity_name(d.get("action") or ""), d.get("due_date"))
+			current = deadlines.get(k)
+			if current is None or SEVERITY_RANK.get(d.get("severity"), 0) > SEVERITY_RANK.get(current.get("severity"), 0):
+				deadlines[k] = d
+	merged["deadlines"] = list(deadlines.values())
+
+	merged["tags"] = _unique_strings([p.get("tags") for p in parts])
+	merged["summary_bullets"] = _unique_strings([p.get("summary_bullets") for p in parts])
+	merged["recommended_actions"] = _unique_strings([p.get("recommended_actions") for p in parts])
+	merged["detailed_summary"] = "\n\n".join(p["detailed_summary"] for p in parts if p.get("detailed_summary")) or None
+	return merged
+
+def group_sections(sections: List[Dict[str, Any]], groups: int, section_tokens: int = EXTRACTION_SECTION_TOKENS) -> List[Dict[str, Any]]:
+	"""
+	Merge consecutive sections so there are about `groups` of them, each at most
+	MAX_SECTION_GROWTH x section_tokens. Latency is driven by output more than input
+	tokens, so fewer, larger sections finish in one wave of concurrent calls.
+	"""
+	if len(sections) <= groups:
+		return sections
+	per_group = math.ceil(len(sections) / groups)
+	budget = section_tokens * MAX_SECTION_GROWTH
+	grouped: List[Dict[str, Any]] = []
+	members = 0
+	for s in sections:
+		last = grouped[-1] if grouped else None
+		if last and members < per_group and last["tokens"] + s["tokens"] <= budget:
+			members += 1
+			last["text"] += "\n" + s["text"]
+			last["last_page"] = s["last_page"]
+			last["tokens"] += s["tokens"]
+		else:
+			grouped.append(dict(s))
+			members = 1
+	return grouped
+
+def _extract_sections(sections: List[Dict[str, Any]], schema: Dict[str, Any] = SINGLE_PASS_SCHEMA, note: str = "") -> Optional[Dict[str, Any]]:
+	"""
+	Map step of sectioned extraction: one single-pass call per section, at most
+	EXTRACTION_CONCURRENCY in flight, so wall time stays close to one call.
+	"""
+	sections = group_sections(sections, EXTRACTION_CONCURRENCY)
+	count = len(sections)
+	def run(indexed):
+		i, section = indexed
+		section_note = SECTION_NOTE.format(index=i + 1, count=count, first_page=section["first_page"], last_page=section["last_page"])
+		return _extract_tracked(section["text"], schema, max_chars=None, note=note + section_note)
+	with ThreadPoolExecutor(max_workers=max(1, min(EXTRACTION_CONCURRENCY, count))) as pool:
+		parts = list(pool.map(run, enumerate(sections)))
+	failed = sum(1 for p in parts if not p)
+	if failed:
+		logging.error(f"[OpenAI] Extraction failed for {failed} of {count} sections")
+	return merge_extractions(parts)
+
+def _classification_from(extract: Optional[Dict[str, Any]], text: str) -> Dict[str, Any]:
+	if not extract:
+		return _classify_tracked(text)
+	doc_class = extract.pop("document_class", None)
+	return {
+		"doc_type": doc_class if doc_class in DOC_CLASSES else "other",
+		"issuer": extract.get("issuer")
+	}
+
+def _without_rule_fields(schema: Dict[str, Any]) -> Dict[str, Any]:
+	return {k: v for k, v in schema.items() if k not in rule_extraction.RULE_FIELDS}
+
+def rule_decision(pre: Optional[Dict[str, Any]], length: int) -> str:
+	"""
+	What rule-based pre-extraction does to the LLM call: "skip" (short bill-like document
+	the rules fully cover, issuer included), "shrink" (rules supply amounts, dates and
+	addresses) or "full". length is the whole document's, not the text the rules saw.
+	"""
+	if not pre:
+		return "full"
+	if (pre["confidence"] >= RULE_EXTRACTION_SKIP_CONFIDENCE and pre["document_class"] in rule_extraction.RULE_ONLY_CLASSES
+			and pre["issuer"] and length <= RULE_EXTRACTION_SKIP_MAX_CHARS):
+		return "skip"
+	if pre["confidence"] >= RULE_EXTRACTION_SHRINK_CONFIDENCE:
+		return "shrink"
+	return "full"
+
+def classify_and_extract(text: str, mode: str = EXTRACTION_MODE, sections: Optional[List[Dict[str, Any]]] = None, on_stage: Optional[Callable[[str], None]] = None, length: Optional[int] = None) -> Tuple[Dict[str, Any], Optional[Dict[str, Any]]]:
+	"""
+	Classification ({"doc_type", "issuer"}) and extracted fields for a document, in one of:
+	  sectioned  - map-reduce: single-pass extraction of each token-bounded section (see
+	               chunking.SectionBuilder) in parallel, merged by merge_extractions
+	  single     - one gpt-4o call on the leading text returns both
+	  parallel   - classify and extract concurrently
+	  sequential - classify, then extract (two round trips)
+	In sectioned and single mode the classifier runs only if extraction fails.
+	Rule-based pre-extraction runs first, over every section in sectioned mode, and may skip
+	or shrink the LLM call (rule_decision). length is the full document's character count
+	when text is only its leading part.
+	In sequential mode on_stage("extraction") is called once classification is done.
+	The wall time is recorded per mode as papertrail_extraction_duration_seconds.
+	"""
+	started = time.perf_counter()
+	pre = None
+	if RULE_EXTRACTION_ENABLED:
+		# A shrunk call leaves amounts, dates and addresses to the rules, so they must see
+		# every section the LLM does, not just the leading text
+		rule_text = "\n".join(s["text"] for s in sections) if mode == "sectioned" and sections else text
+		with metrics.track("rule_extraction"):
+			pre = rule_extraction.pre_extract(rule_text)
+	decision = rule_decision(pre, len(text) if length is None else length)
+	metrics.RULE_EXTRACTIONS.inc(decision=decision)
+	single_schema, extract_schema, note = SINGLE_PASS_SCHEMA, EXTRACT_SCHEMA, ""
+	if decision == "shrink":
+		single_schema, extract_schema, note = _without_rule_fields(SINGLE_PASS_SCHEMA), _without_rule_fields(EXTRACT_SCHEMA), RULES_NOTE
+
+	if decision == "skip":
+		extract = rule_extraction.to_extraction(pre)
+		classify = _classification_from(extract, text)
+	elif mode == "sectioned" and sections:
+		if len(sections) > 1:
+			extract = _extract_sections(sections, single_schema, note=note)
+		else:
+			extract = _extract_tracked(sections[0]["text"], single_schema, max_chars=None, note=note)
+		classify = _classification_from(extract, text)
+	elif mode in ("single", "sectioned"):
+		extract = _extract_tracked(text, single_schema, note=note)
+		classify = _classification_from(extract, text)
+	elif mode == "parallel":
+		with ThreadPoolExecutor(max_workers=2) as pool:
+			classify_future = pool.submit(_classify_tracked, text)
+			extract_future = pool.submit(_extract_tracked, text, extract_schema, note=note)
+			classify, extract = classify_future.result(), extract_future.result()
+	else:
+		classify = _classify_tracked(text)
+		if on_stage:
+			on_stage("extraction")
+		extract = _extract_tracked(text, extract_schema, note=note)
+	if decision == "shrink" and extract:
+		rule_extraction.merge_into(extract, pre)
+		if not classify.get("issuer"):
+			classify["issuer"] = extract.get("issuer")
+	metrics.EXTRACTION_SECONDS.observe(time.perf_counter() - started, mode=mode)
+	return classify, extract
@@ -0,0 +1,158 @@
+from sqlmodel import Session, select, update, col, and_
+from app.models import ProcessingJob
+from app.config import JOB_LEASE_SECONDS, JOB_MAX_ATTEMPTS, JOB_RETRY_BASE_SECONDS, JOB_RETRY_MAX_SECONDS
+from datetime import datetime, timedelta
+from typing import List, Optional
+import random
+
+ACTIVE_STATUSES = ("queued", "running")
+
+def enqueue_document(session: Session, document_id: str, user_id: str, force: bool = False) -> ProcessingJob:
+    """
+    Queue a processing job for a document.
+    If the document already has a queued or running job, that job is returned instead
+    (a queued one is upgraded to a full rebuild when force is set).
+    force=True asks the worker to rebuild everything instead of re-processing incrementally.
+    """
+    existing = session.exec(select(ProcessingJob).where(
+        ProcessingJob.document_id == document_id,
+        col(ProcessingJob.status).in_(ACTIVE_STATUSES)
+    )).first()
+    if existing:
+        if force and existing.status == "queued" and not existing.force:
+            existing.force = True
+            session.add(existing)
+            session.commit()
+            session.refresh(existing)
+        return existing
+
+    job = ProcessingJob(document_id=document_id, user_id=user_id, max_attempts=JOB_MAX_ATTEMPTS, force=force)
+    session.add(job)
+    session.commit()
+    session.refresh(job)
+    return job
+
+def get_latest_job(session: Session, document_id: str) -> Optional[ProcessingJob]:
+    return session.exec(
+        select(ProcessingJob)
+        .where(ProcessingJob.document_id == document_id)
+        .order_by(col(ProcessingJob.id).desc())
+    ).first()
+
+def _claimable(now: datetime):
+    return and_(ProcessingJob.status == "queued", ProcessingJob.next_run_at <= now)
+
+def _expired(now: datetime):
+    # Running jobs whose worker stopped renewing its lease
+    return and_(ProcessingJob.status == "running", ProcessingJob.lease_expires_at < now)
+
+def release_expired(session: Session) -> List[ProcessingJob]:
+    """
+    Return jobs whose worker died to the queue, with the same backoff and attempt cap as fail().
+    A document that kills its worker (OOM, a crashing parser) would otherwise be reclaimed forever.
+    Returns the jobs that ran out of attempts and are now failed.
+    """
+    now = datetime.utcnow()
+    expired = session.exec(select(ProcessingJob).where(_expired(now))).all()
+    exhausted = []
+    for job in expired:
+        error = f"Worker {job.lease_owner} stopped renewing its lease (attempt {job.attempts})"
+        values = {"last_error": error, "lease_owner": None, "lease_expires_at": None, "updated_at": now}
+        if job.attempts >= job.max_attempts:
+            values.update(status="failed")
+        else:
+            values.update(status="queued", next_run_at=now + timedelta(seconds=retry_delay(job.attempts)))
+        # Conditional on the lease still being expired, so concurrent workers release each job once
+        result = session.exec(
+            update(ProcessingJob)
+            .where(ProcessingJob.id == job.id, ProcessingJob.lease_owner == job.lease_owner, _expired(now))
+            .values(**values)
+        )
+        session.commit()
+        if result.rowcount == 1 and values["status"] == "failed":
+            session.refresh(job)
+            exhausted.append(job)
+    return exhausted
+
+def claim_next(session: Session, worker_id: str, lease_seconds: int = JOB_LEASE_SECONDS) -> Optional[ProcessingJob]:
+    """
+    Atomically claim the next due job for this worker.
+    Uses a conditional UPDATE per candidate, so concurrent workers never claim the same job.
+    """
+    now = datetime.utcnow()
+    candidates = session.exec(
+        select(ProcessingJob.id).where(_claimable(now)).order_by(ProcessingJob.next_run_at).limit(10)
+    ).all()
+
+    for job_id in candidates:
+        result = session.exec(
+            update(ProcessingJob)
+            .where(ProcessingJob.id == job_id, _claimable(now))
+            .values(
+                status="running",
+                lease_owner=worker_id,
+                lease_expires_at=now + timedelta(seconds=lease_seconds),
+                attempts=ProcessingJob.attempts + 1,
+                updated_at=now,
+            )
+        )
+        session.commit()
+        if result.rowcount == 1:
+            job = session.get(ProcessingJob, job_id)
+            session.refresh(job)
+            return job
+    return None
+
+def heartbeat(session: Session, job_id: int, worker_id: str, stage: Optional[str] = None, progress: Optional[float] = None, lease_seconds: int = JOB_LEASE_SECONDS) -> bool:
+    """
+    Extend the lease and record progress. Returns False if the lease was lost.
+    """
+    now = datetime.utcnow()
+    values = {"lease_expires_at": now + timedelta(seconds=lease_seconds), "updated_at": now}
+    if stage is not None:
+        values["stage"] = stage
+    if progress is not None:
+        values["progress"] = progress
+    result = session.exec(
+        update(ProcessingJob)
+        .where(ProcessingJob.id == job_id, ProcessingJob.lease_owner == worker_id, ProcessingJob.status == "running")
+        .values(**values)
+    )
+    session.commit()
+    return result.rowcount == 1
+
+def complete(session: Session, job_id: int, worker_id: str):
+    now = datetime.utcnow()
+    session.exec(
+        update(ProcessingJob)
+        .where(ProcessingJob.id == job_id, ProcessingJob.lease_owner == worker_id)
+        .values(status="succeeded", stage="done", progress=1.0, lease_owner=None, lease_expires_at=None, last_error=None, updated_at=now)
+    )
+    session.commit()
+
+def retry_delay(attempts: int) -> float:
+    """
+    Exponential backoff with jitter: base * 2^(attempts-1), capped.
+    """
+    delay = min(JOB_RETRY_BASE_SECONDS * (2 ** max(attempts - 1, 0)), JOB_RETRY_MAX_SECONDS)
+    return delay * random.uniform(0.8, 1.2)
+
+def fail(session: Session, job: ProcessingJob, worker_id: str, error: str) -> bool:
+    """
+    Record a failed attempt. Reschedules with backoff if attempts remain.
+    Returns True if the job will be retried.
+    """
+    now = datetime.utcnow()
+    will_retry = job.attempts < job.max_attempts
+    values = {"last_error": error, "lease_owner": None, "lease_expires_at": None, "updated_at": now}
+    if will_retry:
+        values.update(status="queued", next_run_at=now + timedelta(seconds=retry_delay(job.attempts)))
+    else:
+        values.update(status="failed")
+    session.exec(
+        update(ProcessingJob)
+        .where(ProcessingJob.id == job.id, ProcessingJob.lease_owner == worker_id)
+        .values(**values)
+    )
+    session.commit()
+    return will_retry
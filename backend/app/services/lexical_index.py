@@ -0,0 +1,171 @@
+import os
+import re
+import sqlite3
+import threading
+import logging
+from typing import List, Dict, Any, Optional, Iterable, Tuple
+from app.config import LEXICAL_INDEX_PATH, LEXICAL_INDEX_ENABLED
+
+# Words that carry no signal for keyword matching; dropped from queries
+STOPWORDS = frozenset(
+	"a an and are as at be by for from has have how i in is it its me my of on or our show "
+	"tell that the this to was what when where which who why with you your find about do does".split()
+)
+TERM_PATTERN = re.compile(r"[\w$€£.,/#-]+")
+# Identifiers, amounts and dates: anything mixing digits with letters or separators
+IDENTIFIER_PATTERN = re.compile(r"^(?=.*\d)[\w$€£.,/#-]{3,}$")
+
+class LexicalIndex:
+	"""
+	BM25 keyword index over chunk text, stored in a SQLite FTS5 table.
+	Kept in step with the vector store at ingest and delete, so exact terms
+	(invoice numbers, contract ids, amounts) can be found without embeddings.
+	"""
+
+	def __init__(self, path: str):
+		self.path = os.path.abspath(path)
+		self._local = threading.local()
+		os.makedirs(os.path.dirname(self.path), exist_ok=True)
+		conn = self._conn()
+		# Text lives in the FTS table; ids and filters in a plain indexed table sharing its rowid
+		conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS chunk_text USING fts5(text, tokenize='unicode61')")
+		conn.execute(
+			"CREATE TABLE IF NOT EXISTS chunk_entries ("
+			"rowid INTEGER PRIMARY KEY, chunk_id TEXT NOT NULL UNIQUE, document_id TEXT NOT NULL, user_id TEXT)"
+		)
+		conn.execute("CREATE INDEX IF NOT EXISTS idx_chunk_entries_document ON chunk_entries(document_id)")
+
+	def _conn(self) -> sqlite3.Connection:
+		conn = getattr(self._local, "conn", None)
+		if conn is None:
+			conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+			conn.execute("PRAGMA journal_mode=WAL")
+			conn.execute("PRAGMA synchronous=NORMAL")
+			self._local.conn = conn
+		return conn
+
+	def _delete_rowids(self, conn: sqlite3.Connection, rowids: List[int]):
+		conn.executemany("DELETE FROM chunk_text WHERE rowid = ?", [(r,) for r in rowids])
+		conn.executemany("DELETE FROM chunk_entries WHERE rowid = ?", [(r,) for r in rowids])
+
+	def _rowids(self, conn: sqlite3.Connection, chunk_ids: List[str]) -> List[int]:
+		rowids = []
+		for i in range(0, len(chunk_ids), 500):
+			batch = chunk_ids[i:i+500]
+			placeholders = ",".join("?" * len(batch))
+			rowids.extend(r for (r,) in conn.execute(f"SELECT rowid FROM chunk_entries WHERE chunk_id IN ({placeholders})", batch))
+		return rowids
+
+	def upsert_chunks(self, user_id: str, document_id: str, chunks: Iterable[Tuple[str, str]]):
+		"""
+		Index (chunk_id, text) pairs, replacing any previous text for those ids.
+		"""
+		chunks = list(chunks)
+		if not chunks:
+			return
+		conn = self._conn()
+		conn.execute("BEGIN")
+		try:
+			self._delete_rowids(conn, self._rowids(conn, [cid for cid, _ in chunks]))
+			for chunk_id, text in chunks:
+				cur = conn.execute("INSERT INTO chunk_entries (chunk_id, document_id, user_id) VALUES (?, ?, ?)", (chunk_id, document_id, user_id))
+				conn.execute("INSERT INTO chunk_text (rowid, text) VALUES (?, ?)", (cur.lastrowid, text))
+			conn.execute("COMMIT")
+		except Exception:
+			conn.execute("ROLLBACK")
+			raise
+
+	def delete_chunks(self, chunk_ids: List[str]):
+		if not chunk_ids:
+			return
+		conn = self._conn()
+		conn.execute("BEGIN")
+		self._delete_rowids(conn, self._rowids(conn, chunk_ids))
+		conn.execute("COMMIT")
+
+	def delete_document(self, document_id: str):
+		conn = self._conn()
+		conn.execute("BEGIN")
+		rowids = [r for (r,) in conn.execute("SELECT rowid FROM chunk_entries WHERE document_id = ?", (document_id,))]
+		self._delete_rowids(conn, rowids)
+		conn.execute("COMMIT")
+
+	def search(self, user_id: str, query: str, limit: int = 10, document_id: Optional[str] = None) -> List[Dict[str, Any]]:
+		"""
+		Best BM25 matches for the query terms (any term may match) among the user's chunks.
+		Returns [{"id", "score"}], best first; higher score is better.
+		"""
+		match = build_match_query(query)
+		if not match:
+			return []
+		sql = (
+			"SELECT e.chunk_id, bm25(chunk_text) AS rank FROM chunk_text "
+			"JOIN chunk_entries e ON e.rowid = chunk_text.rowid "
+			"WHERE chunk_text MATCH ? AND e.user_id = ?"
+		)
+		params: list = [match, user_id]
+		if document_id:
+			sql += " AND e.document_id = ?"
+			params.append(document_id)
+		sql += " ORDER BY rank LIMIT ?"
+		params.append(limit)
+		try:
+			rows = self._conn().execute(sql, params).fetchall()
+		except sqlite3.Error as e:
+			logging.warning(f"Lexical search failed for {query!r}: {e}")
+			return []
+		# FTS5's bm25() is lower-is-better
+		return [{"id": chunk_id, "score": -rank} for chunk_id, rank in rows]
+
+def query_terms(query: str) -> List[str]:
+	terms = []
+	for raw in TERM_PATTERN.findall(query):
+		term = raw.strip(".,/#-")
+		if term and term.lower() not in STOPWORDS:
+			terms.append(term)
+	return terms
+
+def build_match_query(query: str) -> str:
+	"""
+	FTS5 MATCH expression: each term as a quoted phrase (so "INV2025-001" matches the
+	token sequence inv2025, 001), combined with OR and ranked by BM25.
+	"""
+	phrases = ['"' + t.replace('"', '""') + '"' for t in query_terms(query)]
+	return " OR ".join(phrases)
+
+def is_identifier_query(query: str, max_terms: int = 3) -> bool:
+	"""
+	Short lookups of identifiers, amounts or dates ("invoice INV2025-001", "$1,200.00"),
+	which keyword search answers without an embedding.
+	"""
+	terms = query_terms(query)
+	return 0 < len(terms) <= max_terms and any(IDENTIFIER_PATTERN.match(t) for t in terms)
+
+_index: Optional[LexicalIndex] = None
+_index_lock = threading.Lock()
+
+def get_index() -> LexicalIndex:
+	global _index
+	with _index_lock:
+		if _index is None:
+			_index = LexicalIndex(LEXICAL_INDEX_PATH)
+		return _index
+
+# Module-level helpers used by the pipeline; no-ops when the index is disabled
+
+def index_chunks(user_id: str, document_id: str, chunks: Iterable[Tuple[str, str]]):
+	if LEXICAL_INDEX_ENABLED:
+		get_index().upsert_chunks(user_id, document_id, chunks)
+
+def delete_chunks(chunk_ids: List[str]):
+	if LEXICAL_INDEX_ENABLED:
+		get_index().delete_chunks(chunk_ids)
+
+def delete_document(document_id: str):
+	if LEXICAL_INDEX_ENABLED:
+		get_index().delete_document(document_id)
+
+def search(user_id: str, query: str, limit: int = 10, document_id: Optional[str] = None) -> List[Dict[str, Any]]:
+	if not LEXICAL_INDEX_ENABLED:
+		return []
+	return get_index().search(user_id, query, limit=limit, document_id=document_id)
@@ -0,0 +1,313 @@
+"""
+Single entry point for OpenAI requests.
+Every chat completion and embedding call goes through here so latency, token usage
+and failures are recorded per call site ("stage") in app.services.metrics.
+
+Sync callers (ingest pipeline, worker) share one pooled client per process. Async
+endpoints use the a* variants, which share one pooled AsyncOpenAI client per event
+loop and cap in-flight requests with a semaphore, so waiting on the model never
+holds a threadpool thread.
+
+Chat completions read through an on-disk response cache (LLM_CACHE_MODE), keyed on
+the model, messages and request parameters. Requests that do reach OpenAI are scheduled
+by llm_scheduler: rate-limit quota by priority class, Retry-After and retries.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Optional
+import anyio
+import httpx
+import openai
+from openai.types.chat import ChatCompletion
+from app.config import (
+    OPENAI_API_KEY, OPENAI_TIMEOUT_SECONDS, OPENAI_CONNECT_TIMEOUT_SECONDS,
+    OPENAI_MAX_CONNECTIONS, OPENAI_MAX_CONCURRENCY,
+    CACHE_DIR, LLM_CACHE_MODE, LLM_CACHE_TTL_SECONDS, LLM_CACHE_MAX_MB
+)
+from app.services import metrics, llm_scheduler
+from app.services.cache import DiskCache
+
+def _timeout() -> httpx.Timeout:
+    return httpx.Timeout(OPENAI_TIMEOUT_SECONDS, connect=OPENAI_CONNECT_TIMEOUT_SECONDS)
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(max_connections=OPENAI_MAX_CONNECTIONS, max_keepalive_connections=OPENAI_MAX_CONNECTIONS)
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client() -> openai.OpenAI:
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = openai.OpenAI(
+                api_key=OPENAI_API_KEY,
+                timeout=_timeout(),
+                # Retries (and Retry-After) are handled by llm_scheduler, shared across processes
+                max_retries=0,
+                http_client=openai.DefaultHttpxClient(limits=_limits(), timeout=_timeout()),
+            )
+        return _client
+
+# (loop, client, semaphore); both are bound to the loop they were created on
+_async_state = None
+
+def _get_async_state():
+    global _async_state
+    loop = asyncio.get_running_loop()
+    if _async_state is None or _async_state[0] is not loop:
+        client = openai.AsyncOpenAI(
+            api_key=OPENAI_API_KEY,
+            timeout=_timeout(),
+            max_retries=0,
+            http_client=openai.DefaultAsyncHttpxClient(limits=_limits(), timeout=_timeout()),
+        )
+        _async_state = (loop, client, asyncio.Semaphore(OPENAI_MAX_CONCURRENCY))
+    return _async_state[1], _async_state[2]
+
+async def aclose():
+    """
+    Close the async client's connection pool (called on app shutdown).
+    """
+    global _async_state
+    if _async_state is not None:
+        state, _async_state = _async_state, None
+        await state[1].close()
+
+class LLMCacheMiss(RuntimeError):
+    """
+    Raised in replay mode when a request has no cached response.
+    """
+
+_cache: Optional[DiskCache] = None
+_cache_lock = threading.Lock()
+
+def _get_cache() -> Optional[DiskCache]:
+    global _cache
+    if LLM_CACHE_MODE not in ("readwrite", "replay"):
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = DiskCache(os.path.join(CACHE_DIR, "llm.sqlite"), max_bytes=LLM_CACHE_MAX_MB * 1024 * 1024)
+        return _cache
+
+metrics.register_cache("llm", _get_cache)
+
+def cache_key(kwargs: dict, stream: bool = False) -> str:
+    """
+    sha256 over the model, messages and remaining request parameters.
+    Streamed and non-streamed responses are stored separately.
+    """
+    params = {k: v for k, v in kwargs.items() if k not in ("model", "messages")}
+    payload = json.dumps(
+        {"model": kwargs.get("model"), "messages": kwargs.get("messages"), "params": params, "stream": stream},
+        sort_keys=True, default=str
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def _cache_get(stage: str, key: str):
+    """
+    Cached payload for key, or None. In replay mode entries never expire and a miss raises.
+    """
+    cache = _get_cache()
+    if cache is None:
+        return None
+    blob = cache.get(key)
+    entry = json.loads(blob) if blob is not None else None
+    if entry is not None and LLM_CACHE_MODE != "replay" and time.time() - entry["stored_at"] > LLM_CACHE_TTL_SECONDS:
+        entry = None
+    metrics.CACHE_LOOKUPS.inc(cache="llm", result="hit" if entry is not None else "miss")
+    if entry is None:
+        if LLM_CACHE_MODE == "replay":
+            raise LLMCacheMiss(f"No cached response for {stage} request {key[:12]} (LLM_CACHE_MODE=replay)")
+        return None
+    return entry["response"]
+
+def _cache_set(key: str, response):
+    cache = _get_cache()
+    if cache is not None and LLM_CACHE_MODE == "readwrite":
+        cache.set(key, json.dumps({"stored_at": time.time(), "response": response}).encode("utf-8"))
+
+def _record_cached(stage: str, model: str):
+    metrics.LLM_REQUESTS.inc(model=model, stage=stage, status="cached")
+
+def _record(stage: str, model: str, started: float, usage, status: str):
+    metrics.LLM_SECONDS.observe(time.perf_counter() - started, model=model, stage=stage)
+    metrics.LLM_REQUESTS.inc(model=model, stage=stage, status=status)
+    if usage is not None:
+        metrics.LLM_TOKENS.inc(getattr(usage, "prompt_tokens", 0) or 0, model=model, stage=stage, kind="prompt")
+        metrics.LLM_TOKENS.inc(getattr(usage, "completion_tokens", 0) or 0, model=model, stage=stage, kind="completion")
+
+def _attempt(stage: str, model: str, create, stream: bool = False):
+    """
+    One request; recorded here unless it is a stream, which is recorded when it ends.
+    """
+    started = time.perf_counter()
+    try:
+        resp = create()
+    except Exception:
+        _record(stage, model, started, None, "error")
+        raise
+    if not stream:
+        _record(stage, model, started, getattr(resp, "usage", None), "ok")
+    return resp
+
+async def _aattempt(stage: str, model: str, create, stream: bool = False):
+    started = time.perf_counter()
+    try:
+        resp = await create()
+    except Exception:
+        _record(stage, model, started, None, "error")
+        raise
+    if not stream:
+        _record(stage, model, started, getattr(resp, "usage", None), "ok")
+    return resp
+
+def chat_completion(stage: str, **kwargs):
+    """
+    client.chat.completions.create(**kwargs), instrumented under `stage` and scheduled
+    against the model's rate limits with the stage's priority.
+    """
+    model = kwargs.get("model", "")
+    key = cache_key(kwargs)
+    cached = _cache_get(stage, key)
+    if cached is not None:
+        _record_cached(stage, model)
+        return ChatCompletion.model_validate(cached)
+    tokens = llm_scheduler.estimate_tokens(kwargs)
+    resp, charged = llm_scheduler.run(stage, model, tokens, lambda: _attempt(stage, model, lambda: get_client().chat.completions.create(**kwargs)))
+    llm_scheduler.settle(model, charged, getattr(resp, "usage", None))
+    _cache_set(key, resp.model_dump(mode="json"))
+    return resp
+
+def stream_chat_completion(stage: str, **kwargs):
+    """
+    Streaming client.chat.completions.create(**kwargs): yields answer text deltas as they
+    arrive. Recorded under `stage` when the stream ends, with token usage from the final
+    chunk; a stream the caller abandons early is recorded as "cancelled".
+    A cached answer is replayed as a single delta; only completed streams are cached.
+    """
+    model = kwargs.get("model", "")
+    key = cache_key(kwargs, stream=True)
+    cached = _cache_get(stage, key)
+    if cached is not None:
+        _record_cached(stage, model)
+        if cached:
+            yield cached
+        return
+    tokens = llm_scheduler.estimate_tokens(kwargs)
+    # Rate limits and retries apply to opening the stream; nothing has been yielded yet
+    stream, charged = llm_scheduler.run(stage, model, tokens, lambda: _attempt(
+        stage, model, lambda: get_client().chat.completions.create(stream=True, stream_options={"include_usage": True}, **kwargs), stream=True
+    ))
+    started = time.perf_counter()
+    usage, status = None, "cancelled"
+    parts = []
+    try:
+        # The context manager closes the HTTP response if the consumer stops early
+        with stream:
+            for chunk in stream:
+                if getattr(chunk, "usage", None) is not None:
+                    usage = chunk.usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+                    yield chunk.choices[0].delta.content
+        status = "ok"
+    except Exception:
+        status = "error"
+        raise
+    finally:
+        _record(stage, model, started, usage, status)
+        llm_scheduler.settle(model, charged, usage)
+    _cache_set(key, "".join(parts))
+
+def create_embeddings(stage: str, **kwargs):
+    """
+    client.embeddings.create(**kwargs), instrumented under `stage` and scheduled
+    against the model's rate limits with the stage's priority.
+    """
+    model = kwargs.get("model", "")
+    tokens = llm_scheduler.estimate_tokens(kwargs)
+    resp, charged = llm_scheduler.run(stage, model, tokens, lambda: _attempt(stage, model, lambda: get_client().embeddings.create(**kwargs)))
+    llm_scheduler.settle(model, charged, getattr(resp, "usage", None))
+    return resp
+
+async def achat_completion(stage: str, **kwargs):
+    """
+    Async chat_completion. Waits for rate-limit quota, then for a concurrency slot; neither
+    wait is counted as request latency.
+    """
+    model = kwargs.get("model", "")
+    key = cache_key(kwargs)
+    # SQLite I/O stays off the event loop
+    cached = await anyio.to_thread.run_sync(_cache_get, stage, key)
+    if cached is not None:
+        _record_cached(stage, model)
+        return ChatCompletion.model_validate(cached)
+    client, semaphore = _get_async_state()
+    tokens = llm_scheduler.estimate_tokens(kwargs)
+
+    async def attempt():
+        async with semaphore:
+            return await _aattempt(stage, model, lambda: client.chat.completions.create(**kwargs))
+
+    resp, charged = await llm_scheduler.arun(stage, model, tokens, attempt)
+    await anyio.to_thread.run_sync(llm_scheduler.settle, model, charged, getattr(resp, "usage", None))
+    await anyio.to_thread.run_sync(_cache_set, key, resp.model_dump(mode="json"))
+    return resp
+
+async def astream_chat_completion(stage: str, **kwargs):
+    """
+    Async stream_chat_completion. Like achat_completion it waits for quota before taking a
+    concurrency slot, then holds the slot until the stream ends.
+    A cached answer is replayed as a single delta; only completed streams are cached.
+    """
+    model = kwargs.get("model", "")
+    key = cache_key(kwargs, stream=True)
+    cached = await anyio.to_thread.run_sync(_cache_get, stage, key)
+    if cached is not None:
+        _record_cached(stage, model)
+        if cached:
+            yield cached
+        return
+    client, semaphore = _get_async_state()
+    tokens = llm_scheduler.estimate_tokens(kwargs)
+
+    async def attempt():
+        # The slot is released when the stream ends, or here if opening it fails
+        await semaphore.acquire()
+        try:
+            return await _aattempt(
+                stage, model, lambda: client.chat.completions.create(stream=True, stream_options={"include_usage": True}, **kwargs), stream=True
+            )
+        except BaseException:
+            semaphore.release()
+            raise
+
+    stream, charged = await llm_scheduler.arun(stage, model, tokens, attempt)
+    started = time.perf_counter()
+    usage, status = None, "cancelled"
+    parts = []
+    try:
+        async with stream:
+            async for chunk in stream:
+                if getattr(chunk, "usage", None) is not None:
+                    usage = chunk.usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+                    yield chunk.choices[0].delta.content
+        status = "ok"
+    except Exception:
+        status = "error"
+        raise
+    finally:
+        semaphore.release()
+        _record(stage, model, started, usage, status)
+        # Runs even when the consumer is cancelled, and keeps SQLite off the event loop
+        with anyio.CancelScope(shield=True):
+            await anyio.to_thread.run_sync(llm_scheduler.settle, model, charged, usage)
+    await anyio.to_thread.run_sync(_cache_set, key, "".join(parts))
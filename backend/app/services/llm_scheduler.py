@@ -0,0 +1,318 @@
+"""
+Rate-limit-aware scheduling for OpenAI calls.
+
+Every request made through app.services.llm first takes quota from per-model token
+buckets (requests and tokens per minute, OPENAI_RATE_LIMITS). The buckets live in a
+small SQLite file, so the API and all worker processes on a host draw from the same
+quota. Calls belong to a priority class derived from their stage:
+
+    interactive   chat, arena                 may use the whole quota
+    normal        audit, patterns             may not use the last LLM_RESERVE_NORMAL
+    background    extraction, ingest embeds   may not use the last LLM_RESERVE_BACKGROUND
+
+so bulk ingestion saturates what is left while chat always finds headroom. A 429 pauses
+the model for every process until its Retry-After has passed, then the call is retried.
+"""
+import asyncio
+import email.utils
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+import anyio
+import openai
+from app.config import (
+    OPENAI_RATE_LIMITS, OPENAI_RATE_LIMIT_STATE, OPENAI_RATE_LIMIT_RETRIES, OPENAI_MAX_RETRIES,
+    LLM_RESERVE_NORMAL, LLM_RESERVE_BACKGROUND
+)
+from app.services import metrics
+from app.services.tokens import count_tokens
+
+INTERACTIVE, NORMAL, BACKGROUND = "interactive", "normal", "background"
+
+STAGE_PRIORITY = {
+    "chat": INTERACTIVE,
+    "chat_stream": INTERACTIVE,
+    "arena_open": INTERACTIVE,
+    "arena_turn": INTERACTIVE,
+    "query_embedding": INTERACTIVE,
+    "audit": NORMAL,
+    "patterns": NORMAL,
+    "pattern_scan": NORMAL,
+    "classify": BACKGROUND,
+    "extract": BACKGROUND,
+    "embedding": BACKGROUND,
+}
+
+RESERVE = {INTERACTIVE: 0.0, NORMAL: LLM_RESERVE_NORMAL, BACKGROUND: LLM_RESERVE_BACKGROUND}
+# After a 429, lower classes stay paused for this multiple of Retry-After, so interactive
+# calls get the freed quota first
+PAUSE_FACTOR = {INTERACTIVE: 1.0, NORMAL: 2.0, BACKGROUND: 3.0}
+# Calls nobody is waiting on keep retrying 429s longer than chat, which should fail fast
+RETRY_FACTOR = {INTERACTIVE: 1, NORMAL: 4, BACKGROUND: 4}
+
+# Completion tokens assumed for a request without max_tokens, until its usage is known
+DEFAULT_COMPLETION_TOKENS = 500
+# Longest single sleep while waiting for quota, so waiters notice refunds and pauses
+MAX_POLL_SECONDS = 1.0
+# Backoff for 429s without Retry-After and for transient errors
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 30.0
+
+def priority_for(stage: str) -> str:
+    return STAGE_PRIORITY.get(stage, NORMAL)
+
+def parse_limits(spec: str) -> Dict[str, Tuple[int, int]]:
+    """
+    "gpt-4o=500:30000,text-embedding-3-small=3000:1000000" -> {model: (rpm, tpm)}
+    """
+    limits = {}
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        try:
+            model, values = item.split("=", 1)
+            rpm, tpm = values.split(":", 1)
+            limits[model.strip()] = (int(rpm), int(tpm))
+        except ValueError:
+            logging.warning(f"Ignoring malformed OPENAI_RATE_LIMITS entry: {item!r}")
+    return limits
+
+def estimate_tokens(kwargs: Dict[str, Any]) -> int:
+    """
+    Tokens a request will be charged before its usage is known: prompt text plus the
+    completion allowance (max_tokens, or DEFAULT_COMPLETION_TOKENS).
+    """
+    if "input" in kwargs:
+        inputs = kwargs["input"] if isinstance(kwargs["input"], list) else [kwargs["input"]]
+        return sum(count_tokens(str(text)) for text in inputs)
+    prompt = 0
+    for message in kwargs.get("messages") or []:
+        content = message.get("content") if isinstance(message, dict) else None
+        if isinstance(content, list):
+            content = " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+        prompt += 4 + count_tokens(content or "")
+    return prompt + (kwargs.get("max_tokens") or kwargs.get("max_completion_tokens") or DEFAULT_COMPLETION_TOKENS)
+
+class RateLimiter:
+    """
+    Requests-per-minute and tokens-per-minute buckets per model, plus a per-model pause
+    set from Retry-After, stored in SQLite so every process on the host shares them.
+    Buckets refill continuously at limit/60 per second up to one minute's worth.
+    """
+
+    def __init__(self, path: str, limits: Dict[str, Tuple[int, int]]):
+        self.path = os.path.abspath(path)
+        self.limits = limits
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, level REAL NOT NULL, updated REAL NOT NULL)"
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def try_acquire(self, model: str, tokens: int, priority: str) -> Tuple[float, float]:
+        """
+        Take one request and `tokens` tokens for model if the priority class may.
+        Returns (0, tokens charged) when granted, otherwise (seconds to wait, 0). The charge
+        is capped for requests larger than the class may ever hold, so settle against it.
+        """
+        limit = self.limits.get(model)
+        names = [f"{model}:pause", f"{model}:requests", f"{model}:tokens"]
+        conn = self._conn()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = {
+                    name: (level, updated) for name, level, updated in
+                    conn.execute("SELECT name, level, updated FROM buckets WHERE name IN (?, ?, ?)", names)
+                }
+                now = time.time()
+                paused_until, paused_at = rows.get(names[0], (0.0, 0.0))
+                paused_until = paused_at + (paused_until - paused_at) * PAUSE_FACTOR.get(priority, 1.0)
+                if paused_until > now:
+                    return paused_until - now, 0.0
+                if limit is None:
+                    return 0.0, 0.0
+                reserve = RESERVE.get(priority, 0.0)
+                wait = 0.0
+                levels = []
+                # A request larger than the class may ever hold still runs once the bucket is that full
+                charged = min(tokens, limit[1] * (1 - reserve))
+                for name, capacity, cost in ((names[1], limit[0], 1), (names[2], limit[1], charged)):
+                    level, updated = rows.get(name, (capacity, now))
+                    level = min(capacity, level + (now - updated) * capacity / 60)
+                    floor = capacity * reserve
+                    if level - cost < floor:
+                        wait = max(wait, (cost + floor - level) * 60 / capacity)
+                    levels.append((name, level - cost))
+                if wait > 0:
+                    return wait, 0.0
+                conn.executemany(
+                    "INSERT OR REPLACE INTO buckets (name, level, updated) VALUES (?, ?, ?)",
+                    [(name, level, now) for name, level in levels]
+                )
+                return 0.0, charged
+            finally:
+                conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            # Fail open: OpenAI still enforces the real limit
+            logging.warning(f"Rate limiter unavailable ({self.path}): {e}")
+            return 0.0, 0.0
+
+    def adjust_tokens(self, model: str, delta: float):
+        """
+        Return (delta > 0) or charge (delta < 0) tokens once a request's real usage is known.
+        """
+        limit = self.limits.get(model)
+        if limit is None or not delta:
+            return
+        try:
+            self._conn().execute(
+                "UPDATE buckets SET level = MIN(?, level + ?) WHERE name = ?", (limit[1], delta, f"{model}:tokens")
+            )
+        except sqlite3.Error as e:
+            logging.warning(f"Rate limiter unavailable ({self.path}): {e}")
+
+    def pause(self, model: str, seconds: float):
+        """
+        Hold calls to model, in every process, for `seconds` (longer for lower priority
+        classes). OpenAI's quota is evidently spent, so the local buckets are emptied too.
+        """
+        now = time.time()
+        try:
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                paused_until, paused_at = conn.execute(
+                    "SELECT level, updated FROM buckets WHERE name = ?", (f"{model}:pause",)
+                ).fetchone() or (0.0, 0.0)
+                if now + seconds > paused_until:
+                    paused_until, paused_at = now + seconds, now
+                conn.executemany(
+                    "INSERT OR REPLACE INTO buckets (name, level, updated) VALUES (?, ?, ?)",
+                    [(f"{model}:pause", paused_until, paused_at), (f"{model}:requests", 0.0, paused_until), (f"{model}:tokens", 0.0, paused_until)]
+                    if model in self.limits else [(f"{model}:pause", paused_until, paused_at)]
+                )
+            finally:
+                conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            logging.warning(f"Rate limiter unavailable ({self.path}): {e}")
+
+_limiter: Optional[RateLimiter] = None
+_limiter_lock = threading.Lock()
+
+def get_limiter() -> RateLimiter:
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = RateLimiter(OPENAI_RATE_LIMIT_STATE, parse_limits(OPENAI_RATE_LIMITS))
+        return _limiter
+
+def settle(model: str, charged: float, usage):
+    """
+    Correct the token bucket from what try_acquire charged to the usage OpenAI reported.
+    """
+    actual = getattr(usage, "total_tokens", None) if usage is not None else None
+    if actual is not None:
+        get_limiter().adjust_tokens(model, charged - actual)
+
+def _retry_after(error: openai.APIStatusError) -> Optional[float]:
+    headers = error.response.headers if error.response is not None else {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            value = headers["retry-after"]
+            try:
+                return float(value)
+            except ValueError:
+                return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        pass
+    return None
+
+def _backoff(attempt: int) -> float:
+    return min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt) * random.uniform(0.8, 1.2)
+
+def _transient(error: Exception) -> bool:
+    if isinstance(error, openai.APIConnectionError):
+        return True
+    return isinstance(error, openai.APIStatusError) and (error.status_code in (408, 409) or error.status_code >= 500)
+
+def _on_error(error: Exception, model: str, priority: str, charged: float, limited: int, failed: int) -> Optional[Tuple[float, int, int]]:
+    """
+    Decide whether a failed attempt is retried, refunding its charged tokens. Returns
+    (delay, limited, failed) with the updated attempt counts, or None to give up.
+    """
+    limiter = get_limiter()
+    limiter.adjust_tokens(model, charged)
+    if isinstance(error, openai.RateLimitError):
+        # An exhausted account quota (billing) will not recover by waiting
+        if getattr(error, "code", None) == "insufficient_quota" or limited >= OPENAI_RATE_LIMIT_RETRIES * RETRY_FACTOR.get(priority, 1):
+            return None
+        metrics.LLM_RATE_LIMITED.inc(model=model, priority=priority)
+        delay = _retry_after(error)
+        delay = _backoff(limited) if delay is None else delay
+        limiter.pause(model, delay)
+        return 0.0, limited + 1, failed
+    if _transient(error) and failed < OPENAI_MAX_RETRIES:
+        return _backoff(failed), limited, failed + 1
+    return None
+
+def run(stage: str, model: str, tokens: int, attempt: Callable[[], Any], priority: Optional[str] = None):
+    """
+    Run attempt() once quota for model is available, retrying 429s (after Retry-After,
+    shared with other processes) and transient errors. Blocks the calling thread.
+    Returns (result, tokens charged); pass the charge to settle() once usage is known.
+    """
+    priority = priority or priority_for(stage)
+    limiter = get_limiter()
+    limited = failed = 0
+    while True:
+        started = time.perf_counter()
+        while (granted := limiter.try_acquire(model, tokens, priority))[0] > 0:
+            time.sleep(min(granted[0], MAX_POLL_SECONDS))
+        charged = granted[1]
+        metrics.LLM_QUEUE_SECONDS.observe(time.perf_counter() - started, priority=priority)
+        try:
+            return attempt(), charged
+        except Exception as e:
+            retry = _on_error(e, model, priority, charged, limited, failed)
+            if retry is None:
+                raise
+            delay, limited, failed = retry
+            time.sleep(delay)
+
+async def arun(stage: str, model: str, tokens: int, attempt: Callable[[], Any], priority: Optional[str] = None):
+    """
+    Async run(): attempt is a coroutine function; waits sleep on the event loop and the
+    SQLite bookkeeping runs in a worker thread.
+    """
+    priority = priority or priority_for(stage)
+    limiter = get_limiter()
+    limited = failed = 0
+    while True:
+        started = time.perf_counter()
+        while (granted := await anyio.to_thread.run_sync(limiter.try_acquire, model, tokens, priority))[0] > 0:
+            await asyncio.sleep(min(granted[0], MAX_POLL_SECONDS))
+        charged = granted[1]
+        metrics.LLM_QUEUE_SECONDS.observe(time.perf_counter() - started, priority=priority)
+        try:
+            return await attempt(), charged
+        except Exception as e:
+            retry = await anyio.to_thread.run_sync(_on_error, e, model, priority, charged, limited, failed)
+            if retry is None:
+                raise
+            delay, limited, failed = retry
+            await asyncio.sleep(delay)
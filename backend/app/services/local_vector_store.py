@@ -0,0 +1,415 @@
+"""
+In-process vector index with the same contract as pinecone_store.
+
+Vectors live in a memory-mapped float32 matrix (vectors.f32), one row per vector,
+L2-normalised so a dot product is the cosine score. Ids and metadata are kept in a
+small SQLite file next to it; the metadata fields used for filtering are mirrored
+in NumPy columns. Several processes can share one index: writers serialise on a
+lock file and readers pick up changes incrementally through a sequence number.
+
+Once the index holds LOCAL_VECTOR_ANN_MIN_VECTORS vectors, queries switch from an
+exact scan to an IVF index (k-means centroids; only the LOCAL_VECTOR_ANN_NPROBE
+closest lists are scanned).
+"""
+import fcntl
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional, Tuple, Callable
+import numpy as np
+from app.config import VECTOR_INDEX_DIR, LOCAL_VECTOR_ANN_MIN_VECTORS, LOCAL_VECTOR_ANN_NPROBE
+
+INITIAL_CAPACITY = 1024
+# Metadata fields mirrored as integer-coded columns for fast filtering
+INDEXED_FIELDS = ("document_id", "user_id")
+ANN_TRAIN_SAMPLE = 20000
+ANN_KMEANS_ITERATIONS = 10
+# Retrain the IVF centroids once the index has grown this many times over since training
+ANN_RETRAIN_GROWTH = 4
+
+def _normalize(values: np.ndarray) -> np.ndarray:
+	norms = np.linalg.norm(values, axis=-1, keepdims=True)
+	norms[norms == 0] = 1.0
+	return values / norms
+
+class LocalVectorIndex:
+	def __init__(self, path: str):
+		self.path = os.path.abspath(path)
+		os.makedirs(self.path, exist_ok=True)
+		self._matrix_path = os.path.join(self.path, "vectors.f32")
+		self._centroids_path = os.path.join(self.path, "centroids.f32")
+		self._lock_path = os.path.join(self.path, "write.lock")
+		self._lock = threading.RLock()
+
+		self._db = sqlite3.connect(os.path.join(self.path, "meta.sqlite"), timeout=30, isolation_level=None, check_same_thread=False)
+		self._db.execute("PRAGMA journal_mode=WAL")
+		self._db.execute(
+			"CREATE TABLE IF NOT EXISTS vectors ("
+			"row INTEGER PRIMARY KEY, id TEXT NOT NULL, metadata TEXT NOT NULL, "
+			"deleted INTEGER NOT NULL DEFAULT 0, cluster INTEGER NOT NULL DEFAULT -1, seq INTEGER NOT NULL)"
+		)
+		self._db.execute("CREATE INDEX IF NOT EXISTS idx_vectors_seq ON vectors(seq)")
+		self._db.execute("CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+		self.dim = 0
+		self.capacity = 0
+		self.rows = 0
+		self.matrix: Optional[np.memmap] = None
+		self.ids: List[Optional[str]] = []
+		self.metadata: List[Optional[Dict[str, Any]]] = []
+		self.row_of: Dict[str, int] = {}
+		self.alive = np.zeros(0, dtype=bool)
+		self.clusters = np.zeros(0, dtype=np.int32)
+		self.columns = {f: np.zeros(0, dtype=np.int32) for f in INDEXED_FIELDS}
+		self.codes: Dict[str, Dict[Any, int]] = {f: {} for f in INDEXED_FIELDS}
+		self.centroids: Optional[np.ndarray] = None
+		self._seq = 0
+		self._ann_version = None
+
+	# --- persistence ---
+
+	def _info(self) -> Dict[str, str]:
+		return dict(self._db.execute("SELECT key, value FROM info").fetchall())
+
+	def _set_info(self, **values):
+		self._db.executemany("INSERT OR REPLACE INTO info (key, value) VALUES (?, ?)", [(k, str(v)) for k, v in values.items()])
+
+	def _resize(self, capacity: int):
+		"""
+		Grow the in-memory columns and remap the matrix file to `capacity` rows.
+		"""
+		grow = capacity - self.capacity
+		if grow <= 0:
+			return
+		self.alive = np.concatenate([self.alive, np.zeros(grow, dtype=bool)])
+		self.clusters = np.concatenate([self.clusters, np.full(grow, -1, dtype=np.int32)])
+		for f in INDEXED_FIELDS:
+			self.columns[f] = np.concatenate([self.columns[f], np.full(grow, -1, dtype=np.int32)])
+		self.ids.extend([None] * grow)
+		self.metadata.extend([None] * grow)
+		self.capacity = capacity
+		self.matrix = np.memmap(self._matrix_path, dtype=np.float32, mode="r+", shape=(capacity, self.dim))
+
+	def _ensure_capacity(self, rows: int):
+		if rows <= self.capacity:
+			return
+		capacity = max(rows, self.capacity * 2, INITIAL_CAPACITY)
+		with open(self._matrix_path, "ab") as f:
+			f.truncate(capacity * self.dim * 4)
+		self._set_info(capacity=capacity)
+		self._resize(capacity)
+
+	def _code(self, field: str, value: Any) -> int:
+		codes = self.codes[field]
+		if value not in codes:
+			codes[value] = len(codes)
+		return codes[value]
+
+	def _refresh(self):
+		"""
+		Apply changes made since the last refresh (by this or another process).
+		"""
+		info = self._info()
+		seq = int(info.get("seq", 0))
+		if not info.get("dim"):
+			return
+		if not self.dim:
+			self.dim = int(info["dim"])
+		if int(info.get("capacity", 0)) > self.capacity:
+			self._resize(int(info["capacity"]))
+		if info.get("ann_version") != self._ann_version:
+			self._ann_version = info.get("ann_version")
+			self.centroids = np.fromfile(self._centroids_path, dtype=np.float32).reshape(-1, self.dim) if self._ann_version else None
+		if seq == self._seq:
+			return
+
+		changed = self._db.execute(
+			"SELECT row, id, metadata, deleted, cluster FROM vectors WHERE seq > ?", (self._seq,)
+		).fetchall()
+		for row, vid, meta_json, deleted, cluster in changed:
+			old_id = self.ids[row]
+			if old_id is not None and old_id != vid and self.row_of.get(old_id) == row:
+				del self.row_of[old_id]
+			meta = json.loads(meta_json)
+			self.ids[row] = vid
+			self.metadata[row] = meta
+			self.row_of[vid] = row
+			self.alive[row] = not deleted
+			self.clusters[row] = cluster
+			for f in INDEXED_FIELDS:
+				self.columns[f][row] = self._code(f, meta.get(f))
+		self.rows = int(info.get("rows", 0))
+		self._seq = seq
+
+	@contextmanager
+	def _write_lock(self):
+		with self._lock, open(self._lock_path, "a+") as lock_file:
+			fcntl.flock(lock_file, fcntl.LOCK_EX)
+			try:
+				self._refresh()
+				yield
+			finally:
+				fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+	# --- writes ---
+
+	def upsert(self, vectors: List[Tuple[str, List[float], Dict[str, Any]]]):
+		"""
+		Insert or overwrite vectors given as (id, values, metadata).
+		"""
+		if not vectors:
+			return
+		with self._write_lock():
+			dim = len(vectors[0][1])
+			if not self.dim:
+				self.dim = dim
+				self._set_info(dim=dim)
+			elif dim != self.dim:
+				raise ValueError(f"Vector dimension {dim} does not match index dimension {self.dim}")
+
+			batch_ids = {v[0] for v in vectors}
+			# Rows of deleted vectors are reused before the matrix grows
+			free = [int(r) for r in np.flatnonzero(~self.alive[:self.rows]) if self.ids[r] not in batch_ids]
+			next_row = self.rows
+			assigned: Dict[str, int] = {}
+			for vid, _, _ in vectors:
+				if vid in assigned:
+					continue
+				row = self.row_of.get(vid)
+				if row is None:
+					if free:
+						row = free.pop()
+					else:
+						row = next_row
+						next_row += 1
+				assigned[vid] = row
+
+			self._ensure_capacity(next_row)
+			rows = np.array([assigned[v[0]] for v in vectors], dtype=np.int64)
+			values = _normalize(np.asarray([v[1] for v in vectors], dtype=np.float32))
+			self.matrix[rows] = values
+			self.matrix.flush()
+			clusters = self._assign(values) if self.centroids is not None else np.full(len(vectors), -1)
+
+			seq = self._seq + 1
+			self._db.execute("BEGIN")
+			self._db.executemany(
+				"INSERT OR REPLACE INTO vectors (row, id, metadata, deleted, cluster, seq) VALUES (?, ?, ?, 0, ?, ?)",
+				[(int(row), vid, json.dumps(meta or {}), int(c), seq) for row, (vid, _, meta), c in zip(rows, vectors, clusters)]
+			)
+			self._set_info(seq=seq, rows=max(next_row, self.rows))
+			self._db.execute("COMMIT")
+			self._refresh()
+			self._maybe_train()
+
+	def delete(self, ids: List[str]) -> int:
+		with self._write_lock():
+			rows = [self.row_of[i] for i in ids if i in self.row_of and self.alive[self.row_of[i]]]
+			return self._delete_rows(rows)
+
+	def delete_where(self, filter: Dict[str, Any]) -> int:
+		with self._write_lock():
+			return self._delete_rows([int(r) for r in np.flatnonzero(self._filter_mask(filter))])
+
+	def update_metadata(self, ids: List[str], metadata: Dict[str, Any]) -> int:
+		"""
+		Merge `metadata` into the metadata of existing vectors.
+		"""
+		with self._write_lock():
+			rows = [self.row_of[i] for i in ids if i in self.row_of and self.alive[self.row_of[i]]]
+			if not rows:
+				return 0
+			seq = self._seq + 1
+			self._db.execute("BEGIN")
+			self._db.executemany(
+				"UPDATE vectors SET metadata = ?, seq = ? WHERE row = ?",
+				[(json.dumps({**self.metadata[r], **metadata}), seq, r) for r in rows]
+			)
+			self._set_info(seq=seq)
+			self._db.execute("COMMIT")
+			self._refresh()
+			return len(rows)
+
+	def _delete_rows(self, rows: List[int]) -> int:
+		if not rows:
+			return 0
+		seq = self._seq + 1
+		self._db.execute("BEGIN")
+		self._db.executemany("UPDATE vectors SET deleted = 1, seq = ? WHERE row = ?", [(seq, r) for r in rows])
+		self._set_info(seq=seq)
+		self._db.execute("COMMIT")
+		self._refresh()
+		return len(rows)
+
+	# --- approximate search ---
+
+	def _assign(self, values: np.ndarray) -> np.ndarray:
+		return np.argmax(values @ self.centroids.T, axis=1).astype(np.int32)
+
+	def _maybe_train(self):
+		"""
+		(Re)build the IVF index once the corpus is large enough, or has grown enough since training.
+		"""
+		alive_rows = np.flatnonzero(self.alive[:self.rows])
+		n = len(alive_rows)
+		if LOCAL_VECTOR_ANN_MIN_VECTORS <= 0 or n < LOCAL_VECTOR_ANN_MIN_VECTORS:
+			return
+		trained_on = int(self._info().get("ann_trained_on", 0))
+		if self.centroids is not None and n < trained_on * ANN_RETRAIN_GROWTH:
+			return
+
+		rng = np.random.default_rng(0)
+		sample = np.sort(rng.choice(alive_rows, size=min(n, ANN_TRAIN_SAMPLE), replace=False))
+		data = np.asarray(self.matrix[sample])
+		nlist = int(min(4096, max(16, np.sqrt(n))))
+		centroids = data[rng.choice(len(data), size=min(nlist, len(data)), replace=False)].copy()
+		# Spherical k-means: vectors and centroids are unit length, similarity is the dot product
+		for _ in range(ANN_KMEANS_ITERATIONS):
+			labels = np.argmax(data @ centroids.T, axis=1)
+			for c in range(len(centroids)):
+				members = data[labels == c]
+				if len(members):
+					centroids[c] = members.mean(axis=0)
+			centroids = _normalize(centroids).astype(np.float32)
+		self.centroids = centroids
+
+		clusters = np.empty(n, dtype=np.int32)
+		for i in range(0, n, 65536):
+			clusters[i:i + 65536] = self._assign(np.asarray(self.matrix[alive_rows[i:i + 65536]]))
+		centroids.tofile(self._centroids_path)
+
+		seq = self._seq + 1
+		self._db.execute("BEGIN")
+		self._db.executemany("UPDATE vectors SET cluster = ?, seq = ? WHERE row = ?", [(int(c), seq, int(r)) for c, r in zip(clusters, alive_rows)])
+		self._set_info(seq=seq, ann_trained_on=n, ann_version=seq)
+		self._db.execute("COMMIT")
+		self._refresh()
+		print(f"Local vector index: trained IVF with {len(centroids)} lists on {n} vectors")
+
+	# --- reads ---
+
+	def _filter_mask(self, filter: Optional[Dict[str, Any]]) -> np.ndarray:
+		"""
+		Rows that are alive and match a Pinecone-style filter ({field: value},
+		{field: {"$eq": value}} or {field: {"$in": [...]}}, combined with AND).
+		"""
+		mask = self.alive[:self.rows].copy()
+		for field, cond in (filter or {}).items():
+			if isinstance(cond, dict):
+				if "$eq" in cond:
+					values = [cond["$eq"]]
+				elif "$in" in cond:
+					values = list(cond["$in"])
+				else:
+					raise ValueError(f"Unsupported filter operator for {field}: {cond}")
+			else:
+				values = [cond]
+			if field in self.columns:
+				codes = [self.codes[field][v] for v in values if v in self.codes[field]]
+				mask &= np.isin(self.columns[field][:self.rows], codes)
+			else:
+				mask &= np.fromiter(
+					((m or {}).get(field) in values for m in self.metadata[:self.rows]),
+					dtype=bool, count=self.rows
+				)
+		return mask
+
+	def query(self, embedding: List[float], top_k: int = 10, filter: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+		with self._lock:
+			self._refresh()
+			if not self.rows or top_k <= 0:
+				return []
+			matrix, rows, ids, metadata = self.matrix, self.rows, self.ids, self.metadata
+			mask = self._filter_mask(filter)
+			centroids, clusters = self.centroids, self.clusters[:rows].copy()
+
+		q = _normalize(np.asarray(embedding, dtype=np.float32))
+		if centroids is not None and mask.sum() >= LOCAL_VECTOR_ANN_MIN_VECTORS:
+			nprobe = min(LOCAL_VECTOR_ANN_NPROBE, len(centroids))
+			probe = np.argpartition(-(centroids @ q), nprobe - 1)[:nprobe]
+			approx = mask & (np.isin(clusters, probe) | (clusters < 0))
+			# Too few candidates in the probed lists: fall back to an exact scan
+			if approx.sum() >= top_k:
+				mask = approx
+
+		candidates = np.flatnonzero(mask)
+		if not len(candidates):
+			return []
+		if len(candidates) > rows // 2:
+			# Mostly unfiltered: one contiguous matmul beats gathering rows
+			scores = np.asarray(matrix[:rows]) @ q
+			scores = scores[candidates]
+		else:
+			scores = np.asarray(matrix[candidates]) @ q
+
+		k = min(top_k, len(candidates))
+		top = np.argpartition(-scores, k - 1)[:k]
+		top = top[np.argsort(-scores[top])]
+		return [
+			{"id": ids[candidates[i]], "score": float(scores[i]), "metadata": metadata[candidates[i]]}
+			for i in top
+		]
+
+	def count(self) -> int:
+		with self._lock:
+			self._refresh()
+			return int(self.alive[:self.rows].sum())
+
+_index: Optional[LocalVectorIndex] = None
+_index_lock = threading.Lock()
+
+def get_index() -> LocalVectorIndex:
+	global _index
+	with _index_lock:
+		if _index is None:
+			_index = LocalVectorIndex(VECTOR_INDEX_DIR)
+		return _index
+
+def _result(ids: list, fn: Callable[[], Any]) -> Dict[str, Any]:
+	try:
+		fn()
+		return {"ids": ids, "ok": True, "attempts": 1, "error": None}
+	except Exception as e:
+		print(f"Local vector index write failed: {e}")
+		return {"ids": ids, "ok": False, "attempts": 1, "error": str(e)}
+
+def upsert_vectors(vectors: list) -> List[Dict[str, Any]]:
+	"""
+	Upsert a list of vectors. Each vector: (id, values, metadata)
+	Returns per-batch results like pinecone_store (a single batch here).
+	"""
+	return [_result([v[0] for v in vectors], lambda: get_index().upsert(vectors))]
+
+def delete_vectors(ids: list) -> List[Dict[str, Any]]:
+	"""
+	Delete vectors by a list of IDs.
+	"""
+	return [_result(list(ids), lambda: get_index().delete(ids))]
+
+def update_metadata(ids: list, metadata: Dict[str, Any]) -> List[Dict[str, Any]]:
+	"""
+	Merge `metadata` into existing vectors' metadata.
+	"""
+	return [_result(list(ids), lambda: get_index().update_metadata(ids, metadata))]
+
+def delete_vectors_by_filter(filter: Dict[str, Any]) -> Dict[str, Any]:
+	"""
+	Delete all vectors whose metadata matches the filter.
+	"""
+	result = _result([], lambda: get_index().delete_where(filter))
+	del result["ids"]
+	return result
+
+def delete_vectors_by_document(document_id: str) -> Dict[str, Any]:
+	return delete_vectors_by_filter({"document_id": document_id})
+
+def query_similar_vectors(embedding: list, top_k: int = 10, document_id: str = None, filter: Optional[Dict[str, Any]] = None):
+	"""
+	Nearest vectors by cosine similarity, as Pinecone-style matches (id, score, metadata).
+	"""
+	filter = dict(filter or {})
+	if document_id:
+		filter["document_id"] = document_id
+	return get_index().query(embedding, top_k=top_k, filter=filter)
@@ -0,0 +1,318 @@
+"""
+Minimal in-process metrics (counters and histograms) rendered in Prometheus text format.
+
+Worker processes write snapshots of their metrics to METRICS_DIR; the API merges
+those snapshots with its own when /api/metrics is scraped, so ingest timings from
+`python -m app.worker` show up alongside request-path metrics. Workers delete their
+snapshot on exit, and snapshots of dead or silent workers are left out.
+"""
+import glob
+import json
+import os
+import socket
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Tuple, Iterable, Iterator, Callable, List, Any, TypeVar
+from app.config import METRICS_DIR, METRICS_SNAPSHOT_MAX_AGE_SECONDS
+
+T = TypeVar("T")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+_registry_lock = threading.Lock()
+_registry: Dict[str, "_Metric"] = {}
+_caches: Dict[str, Callable[[], Any]] = {}
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry[name] = self
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"|".join(k): v for k, v in self._values.items()}
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[Tuple, Dict[str, Any]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            i = bisect_left(self.buckets, value)
+            if i < len(self.buckets):
+                entry["buckets"][i] += 1
+            entry["sum"] += value
+            entry["count"] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"|".join(k): {"buckets": list(v["buckets"]), "sum": v["sum"], "count": v["count"]} for k, v in self._values.items()}
+
+def register_cache(name: str, get_cache: Callable[[], Any]):
+    """
+    Report the size of a cache (anything with a DiskCache/TTLCache-style stats()) at scrape time.
+    get_cache returns the cache, or None when it is disabled.
+    """
+    _caches[name] = get_cache
+
+# --- Shared metrics ---
+
+STAGE_SECONDS = Histogram("papertrail_stage_duration_seconds", "Time spent in each ingest pipeline stage (exclusive of nested stages).", ("stage",))
+STAGE_ITEMS = Counter("papertrail_stage_items_total", "Items produced by each ingest pipeline stage (pages, chunks, vectors, ...).", ("stage",))
+STAGE_FAILURES = Counter("papertrail_stage_failures_total", "Failures raised inside each ingest pipeline stage.", ("stage",))
+DOCUMENTS_PROCESSED = Counter("papertrail_documents_processed_total", "Documents processed by outcome.", ("status",))
+VECTOR_BATCHES = Counter("papertrail_vector_batches_total", "Vector store write batches by operation and outcome.", ("op", "status"))
+VECTOR_RETRIES = Counter("papertrail_vector_retries_total", "Retried vector store requests by operation.", ("op",))
+RETRIEVALS = Counter("papertrail_retrievals_total", "Chat retrievals by mode (hybrid, vector, lexical-only).", ("mode",))
+RERANK_CHUNKS = Counter("papertrail_rerank_chunks_total", "Retrieved chunks after reranking by outcome (kept/duplicate/cut).", ("outcome",))
+CACHE_EVICTIONS = Counter("papertrail_cache_evictions_total", "In-memory cache evictions by cache and reason (size/expired).", ("cache", "reason"))
+CACHE_LOOKUPS = Counter("papertrail_cache_lookups_total", "Cache lookups by cache and result (hit/miss).", ("cache", "result"))
+LLM_REQUESTS = Counter("papertrail_llm_requests_total", "OpenAI requests by model, call site and outcome.", ("model", "stage", "status"))
+LLM_TOKENS = Counter("papertrail_llm_tokens_total", "OpenAI tokens consumed by model, call site and kind (prompt/completion).", ("model", "stage", "kind"))
+LLM_SECONDS = Histogram("papertrail_llm_request_duration_seconds", "OpenAI request latency by model and call site.", ("model", "stage"))
+LLM_QUEUE_SECONDS = Histogram("papertrail_llm_queue_seconds", "Time an OpenAI call waited for rate-limit quota, by priority class.", ("priority",))
+LLM_RATE_LIMITED = Counter("papertrail_llm_rate_limited_total", "429 responses from OpenAI by model and priority class.", ("model", "priority"))
+RULE_EXTRACTIONS = Counter("papertrail_rule_extractions_total", "Documents by what rule-based pre-extraction did to the LLM call (skip/shrink/full).", ("decision",))
+EXTRACTION_SECONDS = Histogram("papertrail_extraction_duration_seconds", "Wall time to classify and extract one document, by EXTRACTION_MODE.", ("mode",))
+CHAT_TTFB_SECONDS = Histogram("papertrail_chat_time_to_first_byte_seconds", "Streaming chat: request start to the first event (citations) being sent.")
+CHAT_TTFT_SECONDS = Histogram("papertrail_chat_time_to_first_token_seconds", "Streaming chat: request start to the first answer token being sent.")
+
+_local = threading.local()
+
+def _stack() -> List[List[float]]:
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+def _finish_frame(stack: List[List[float]], frame: List[float], started: float) -> float:
+    elapsed = time.perf_counter() - started
+    stack.pop()
+    if stack:
+        # Charge our time to the enclosing stage so it reports exclusive time
+        stack[-1][0] += elapsed
+    return elapsed - frame[0]
+
+@contextmanager
+def track(stage: str, items: int = 0):
+    """
+    Time a block as one observation of `stage`. Time spent in stages nested inside the
+    block (on the same thread) is excluded, so generator pipelines report per-stage cost.
+    """
+    stack = _stack()
+    frame = [0.0]
+    stack.append(frame)
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_FAILURES.inc(stage=stage)
+        raise
+    finally:
+        STAGE_SECONDS.observe(_finish_frame(stack, frame, started), stage=stage)
+        if items:
+            STAGE_ITEMS.inc(items, stage=stage)
+
+def track_iter(stage: str, iterable: Iterable[T]) -> Iterator[T]:
+    """
+    Wrap a (lazy) iterable so the time taken to produce each item is recorded under `stage`.
+    """
+    it = iter(iterable)
+    while True:
+        stack = _stack()
+        frame = [0.0]
+        stack.append(frame)
+        started = time.perf_counter()
+        try:
+            item = next(it)
+        except StopIteration:
+            _finish_frame(stack, frame, started)
+            return
+        except Exception:
+            _finish_frame(stack, frame, started)
+            STAGE_FAILURES.inc(stage=stage)
+            raise
+        STAGE_SECONDS.observe(_finish_frame(stack, frame, started), stage=stage)
+        STAGE_ITEMS.inc(stage=stage)
+        yield item
+
+# --- Snapshots and rendering ---
+
+def snapshot() -> Dict[str, Any]:
+    with _registry_lock:
+        metrics = list(_registry.values())
+    return {m.name: {"type": m.type, "help": m.help, "labelnames": list(m.labelnames),
+                     "buckets": list(getattr(m, "buckets", ())), "values": m.snapshot()} for m in metrics}
+
+def _snapshot_path(pid: int) -> str:
+    return os.path.join(METRICS_DIR, f"worker-{socket.gethostname()}-{pid}.json")
+
+def write_snapshot():
+    """
+    Persist this process's metrics for the API to merge. Called by worker processes.
+    """
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    path = _snapshot_path(os.getpid())
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(snapshot(), f)
+    os.replace(tmp, path)
+
+def remove_snapshot():
+    """
+    Delete this process's snapshot on exit, so its counters are not merged forever.
+    """
+    try:
+        os.remove(_snapshot_path(os.getpid()))
+    except FileNotFoundError:
+        pass
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def _live_snapshots() -> List[str]:
+    """
+    Snapshot files of other live workers. Files from dead processes on this host or not
+    rewritten within METRICS_SNAPSHOT_MAX_AGE_SECONDS (e.g. another host's crashed worker)
+    are skipped.
+    """
+    host = socket.gethostname()
+    own = os.path.basename(_snapshot_path(os.getpid()))
+    now = time.time()
+    paths = []
+    for path in glob.glob(os.path.join(METRICS_DIR, "worker-*.json")):
+        name = os.path.basename(path)
+        if name == own:
+            continue
+        try:
+            if now - os.path.getmtime(path) > METRICS_SNAPSHOT_MAX_AGE_SECONDS:
+                continue
+        except OSError:
+            continue
+        snapshot_host, _, pid = name[len("worker-"):-len(".json")].rpartition("-")
+        # PIDs only mean something on the host that wrote the snapshot
+        if snapshot_host == host and pid.isdigit() and not _pid_alive(int(pid)):
+            continue
+        paths.append(path)
+    return paths
+
+def _merge(into: Dict[str, Any], other: Dict[str, Any]):
+    for name, m in other.items():
+        target = into.setdefault(name, {**m, "values": {}})
+        for key, value in m["values"].items():
+            if m["type"] == "counter":
+                target["values"][key] = target["values"].get(key, 0.0) + value
+            else:
+                cur = target["values"].get(key)
+                if cur is None:
+                    target["values"][key] = {"buckets": list(value["buckets"]), "sum": value["sum"], "count": value["count"]}
+                else:
+                    cur["buckets"] = [a + b for a, b in zip(cur["buckets"], value["buckets"])]
+                    cur["sum"] += value["sum"]
+                    cur["count"] += value["count"]
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(pairs: Iterable[Tuple[str, str]]) -> str:
+    pairs = [(k, v) for k, v in pairs]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(str(v))}"' for k, v in pairs) + "}"
+
+def _fmt(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+def render(include_workers: bool = True) -> str:
+    """
+    Render all metrics (this process, worker snapshots and cache sizes) in Prometheus text format.
+    """
+    merged: Dict[str, Any] = {}
+    _merge(merged, snapshot())
+    if include_workers and os.path.isdir(METRICS_DIR):
+        for path in _live_snapshots():
+            try:
+                with open(path) as f:
+                    _merge(merged, json.load(f))
+            except (OSError, ValueError):
+                continue
+
+    lines = []
+    for name in sorted(merged):
+        m = merged[name]
+        lines.append(f"# HELP {name} {m['help']}")
+        lines.append(f"# TYPE {name} {m['type']}")
+        for key in sorted(m["values"]):
+            value = m["values"][key]
+            labels = list(zip(m["labelnames"], key.split("|"))) if m["labelnames"] else []
+            if m["type"] == "counter":
+                lines.append(f"{name}{_labels(labels)} {_fmt(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(m["buckets"], value["buckets"]):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels(labels + [('le', _fmt(bound))])} {cumulative}")
+            lines.append(f"{name}_bucket{_labels(labels + [('le', '+Inf')])} {value['count']}")
+            lines.append(f"{name}_sum{_labels(labels)} {_fmt(value['sum'])}")
+            lines.append(f"{name}_count{_labels(labels)} {value['count']}")
+
+    gauges = {"entries": [], "bytes": [], "max_bytes": [], "max_entries": []}
+    for cache_name, get_cache in sorted(_caches.items()):
+        try:
+            cache = get_cache()
+            stats = cache.stats() if cache else None
+        except Exception as e:
+            print(f"Metrics: failed to read {cache_name} cache stats: {e}")
+            continue
+        if stats:
+            for field in gauges:
+                if field in stats:
+                    gauges[field].append((cache_name, stats[field]))
+    for field, samples in gauges.items():
+        if not samples:
+            continue
+        name = f"papertrail_cache_{field}"
+        lines.append(f"# HELP {name} Cache {field.replace('_', ' ')} per cache.")
+        lines.append(f"# TYPE {name} gauge")
+        for cache_name, value in samples:
+            lines.append(f"{name}{_labels([('cache', cache_name)])} {_fmt(value)}")
+    return "\n".join(lines) + "\n"
@@ -1,6 +1,19 @@
-
+import hashlib
 import logging
-from typing import Optional
+import math
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, List, Dict, Any, Tuple
+from app.config import CACHE_DIR, OCR_DPI, OCR_WORKERS, OCR_CACHE_ENABLED, OCR_CACHE_MAX_MB
+from app.services import metrics
+from app.services.cache import DiskCache
+from app.services.pdf import render_page_images
+
+_cache: Optional[DiskCache] = None
+_stats_lock = threading.Lock()
+_stats = {"pages": 0, "cache_hits": 0, "seconds": 0.0}
 
 def ocr_image(image) -> Optional[str]:
 	"""
@@ -17,3 +30,114 @@ def ocr_image(image) -> Optional[str]:
 	except Exception as e:
 		logging.error(f"OCR failed: {e}")
 		return None
+
+def _get_cache() -> Optional[DiskCache]:
+	global _cache
+	if not OCR_CACHE_ENABLED:
+		return None
+	if _cache is None:
+		_cache = DiskCache(os.path.join(CACHE_DIR, "ocr.sqlite"), max_bytes=OCR_CACHE_MAX_MB * 1024 * 1024)
+	return _cache
+
+metrics.register_cache("ocr", _get_cache)
+
+def _init_pool_worker():
+	# A forked worker must not reuse the parent's SQLite handle; open its own on first use
+	global _cache
+	_cache = None
+
+def image_hash(image) -> str:
+	"""
+	Hash of the rendered page pixels (mode, size and raw bytes).
+	"""
+	h = hashlib.sha256()
+	h.update(f"{image.mode}:{image.size[0]}x{image.size[1]}:".encode("utf-8"))
+	h.update(image.tobytes())
+	return h.hexdigest()
+
+def ocr_image_cached(image) -> Tuple[Optional[str], bool]:
+	"""
+	OCR an image, reading through the OCR cache keyed by the image hash.
+	Returns (text, cache_hit).
+	"""
+	cache = _get_cache()
+	key = f"ocr:{image_hash(image)}"
+	if cache:
+		blob = cache.get(key)
+		if blob is not None:
+			return blob.decode("utf-8"), True
+	text = ocr_image(image)
+	# Don't cache failures (e.g. tesseract missing) so they are retried next time
+	if cache and text is not None:
+		cache.set(key, text.encode("utf-8"))
+	return text, False
+
+def _ocr_pdf_pages(pdf_path: str, page_numbers: List[int], dpi: int) -> List[Tuple[int, Optional[str], bool]]:
+	"""
+	Render and OCR a contiguous range of pages, opening the PDF once. Runs inside pool workers.
+	"""
+	results = []
+	for page_number, img in render_page_images(pdf_path, page_numbers, dpi=dpi):
+		text, hit = ocr_image_cached(img)
+		results.append((page_number, text, hit))
+	return results
+
+def _record(pages: int, hits: int, seconds: float):
+	with _stats_lock:
+		_stats["pages"] += pages
+		_stats["cache_hits"] += hits
+		_stats["seconds"] += seconds
+	# Lookups happen in pool workers, so the parent records them from the results
+	if OCR_CACHE_ENABLED:
+		metrics.CACHE_LOOKUPS.inc(hits, cache="ocr", result="hit")
+		metrics.CACHE_LOOKUPS.inc(pages - hits, cache="ocr", result="miss")
+
+def ocr_pdf_pages(pdf_path: str, page_numbers: List[int], dpi: int = OCR_DPI, max_workers: int = OCR_WORKERS) -> Dict[int, str]:
+	"""
+	OCR the given pages (1-based) of a PDF.
+	Pages are split into one contiguous range per worker of a bounded process pool, so each
+	worker parses the PDF once; pages whose rendered image was seen before are served from
+	the OCR cache without running Tesseract.
+	Returns {page_number: text} for pages where OCR produced text.
+	"""
+	if not page_numbers:
+		return {}
+	started = time.perf_counter()
+	workers = max(1, min(max_workers, len(page_numbers)))
+	per_worker = math.ceil(len(page_numbers) / workers)
+	groups = [page_numbers[i:i + per_worker] for i in range(0, len(page_numbers), per_worker)]
+
+	results = []
+	if len(groups) == 1:
+		results.extend(_ocr_pdf_pages(pdf_path, groups[0], dpi))
+	else:
+		with ProcessPoolExecutor(max_workers=len(groups), initializer=_init_pool_worker) as pool:
+			futures = [pool.submit(_ocr_pdf_pages, pdf_path, group, dpi) for group in groups]
+			for future in futures:
+				results.extend(future.result())
+
+	_record(len(results), sum(1 for _, _, hit in results if hit), time.perf_counter() - started)
+	return {page_number: text for page_number, text, _ in results if text}
+
+def ocr_image_file(path: str) -> Optional[str]:
+	"""
+	OCR a standalone image upload (PNG/JPG), reading through the OCR cache.
+	"""
+	try:
+		from PIL import Image
+	except ImportError:
+		return None
+	started = time.perf_counter()
+	with Image.open(path) as img:
+		text, hit = ocr_image_cached(img)
+	_record(1, 1 if hit else 0, time.perf_counter() - started)
+	return text
+
+def get_ocr_stats() -> Dict[str, Any]:
+	"""
+	Throughput of the OCR stage in this process.
+	"""
+	with _stats_lock:
+		stats = dict(_stats)
+	stats["pages_per_sec"] = round(stats["pages"] / stats["seconds"], 3) if stats["seconds"] else 0.0
+	return stats
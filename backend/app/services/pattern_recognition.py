@@ -2,12 +2,9 @@ from sqlmodel import Session, select
 from app.models import GraphNode, GraphEdge, Document
 from app.schemas import PatternReport, PatternMatch, PatternDefinition
 from typing import List, Dict, Any
-import openai
-from app.config import OPENAI_API_KEY
+from app.services import llm
 import json
 
-openai.api_key = OPENAI_API_KEY
-
 # Pre-defined patterns (RICO styling)
 
 def _get_graph_context_summary(session: Session, user) -> Dict[str, Any]:
@@ -86,7 +83,8 @@ def _generate_dynamic_patterns(context_summary: Dict[str, Any]) -> List[PatternD
     """
     
     try:
-        response = openai.chat.completions.create(
+        response = llm.chat_completion(
+            "patterns",
             model="gpt-4o",
             messages=[
                 {"role": "system", "content": "You are a pattern generation engine."},
@@ -174,7 +172,8 @@ def detect_patterns(session: Session, user, pattern_id: str = None) -> PatternRe
         """
 
         try:
-            response = openai.chat.completions.create(
+            response = llm.chat_completion(
+                "pattern_scan",
                 model="gpt-4o",
                 messages=[
                     {"role": "system", "content": "You are a forensic accountant and intelligence analyst AI."},
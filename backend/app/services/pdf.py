@@ -1,37 +1,121 @@
-
 import fitz  # PyMuPDF
-from typing import List, Dict, Any
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import List, Dict, Any, Iterator, Iterable, Tuple, Optional
+from app.config import PDF_PARALLEL_MIN_PAGES, PDF_WORKERS, PDF_STREAM_RANGE_PAGES
 import logging
 
-def extract_pdf_text_per_page(pdf_path: str) -> List[Dict[str, Any]]:
+def _page_record(page, page_number: int) -> Dict[str, Any]:
+	bbox = page.rect
+	return {
+		"page_number": page_number,
+		"text": page.get_text("text"),
+		"bbox": [bbox.x0, bbox.y0, bbox.x1, bbox.y1],
+	}
+
+def _extract_page_range(pdf_path: str, start: int, end: int) -> List[Dict[str, Any]]:
+	"""
+	Extract pages [start, end) (0-based) with a single open of the file.
+	Runs inside pool workers for large documents.
+	"""
+	with fitz.open(pdf_path) as doc:
+		return [_page_record(doc[i], i + 1) for i in range(start, end)]
+
+def page_count(pdf_path: str) -> int:
+	with fitz.open(pdf_path) as doc:
+		return len(doc)
+
+def iter_pdf_pages(pdf_path: str, range_pages: int = PDF_STREAM_RANGE_PAGES, parallel_min_pages: int = PDF_PARALLEL_MIN_PAGES, max_workers: int = PDF_WORKERS) -> Iterator[Dict[str, Any]]:
+	"""
+	Yield {page_number, text, bbox} for each page of a PDF, in order.
+	Large documents are split into ranges of `range_pages` pages extracted in parallel
+	across a process pool; each worker opens the file once per range. Only a bounded
+	window of ranges is in flight, so memory stays flat regardless of page count.
+	If the pool fails, the remaining ranges are extracted serially.
+	"""
+	with fitz.open(pdf_path) as doc:
+		total = len(doc)
+		if total < parallel_min_pages or max_workers <= 1:
+			for i in range(total):
+				yield _page_record(doc[i], i + 1)
+			return
+
+	ranges = iter([(start, min(start + range_pages, total)) for start in range(0, total, range_pages)])
+	with ProcessPoolExecutor(max_workers=max_workers) as pool:
+		pending = deque((r, pool.submit(_extract_page_range, pdf_path, *r)) for r in islice(ranges, max_workers * 2))
+		while pending:
+			page_range, future = pending.popleft()
+			nxt = None
+			try:
+				pages = future.result()
+				nxt = next(ranges, None)
+				if nxt:
+					pending.append((nxt, pool.submit(_extract_page_range, pdf_path, *nxt)))
+			except Exception as e:
+				# e.g. BrokenProcessPool when a child is killed: finish the remaining ranges serially
+				logging.warning(f"Parallel PDF extraction failed ({e}); falling back to serial extraction.")
+				pool.shutdown(wait=False, cancel_futures=True)
+				if nxt:
+					# Only the submit failed; this range's pages are already extracted
+					yield from pages
+					remaining = [r for r, _ in pending] + [nxt]
+				else:
+					remaining = [page_range] + [r for r, _ in pending]
+				remaining += list(ranges)
+				for start, end in remaining:
+					yield from _extract_page_range(pdf_path, start, end)
+				return
+			yield from pages
+
+def extract_pdf_text_per_page(pdf_path: str, parallel_min_pages: int = PDF_PARALLEL_MIN_PAGES, max_workers: int = PDF_WORKERS) -> List[Dict[str, Any]]:
 	"""
 	Extract text from each page of a PDF using PyMuPDF.
 	Returns a list of dicts: [{page_number, text, bbox}]
+	Prefer iter_pdf_pages() for long documents.
 	"""
-	doc = fitz.open(pdf_path)
-	pages = []
-	for i, page in enumerate(doc):
-		text = page.get_text("text")
-		bbox = page.rect
-		pages.append({
-			"page_number": i + 1,
-			"text": text,
-			"bbox": [bbox.x0, bbox.y0, bbox.x1, bbox.y1],
-		})
-	return pages
+	return list(iter_pdf_pages(pdf_path, parallel_min_pages=parallel_min_pages, max_workers=max_workers))
 
-def extract_page_image(pdf_path: str, page_number: int) -> Any:
+def pixmap_to_image(pix) -> Any:
 	"""
-	Extracts a PIL image of a given page (1-based).
+	Wrap a PyMuPDF pixmap's raw samples in a PIL image without a PNG encode/decode round trip.
 	Returns None if Pillow not installed.
 	"""
 	try:
 		from PIL import Image
-		import io
 	except ImportError:
 		return None
-	doc = fitz.open(pdf_path)
-	page = doc[page_number - 1]
-	pix = page.get_pixmap()
-	img_bytes = pix.tobytes("png")
-	return Image.open(io.BytesIO(img_bytes))
+	if pix.alpha:
+		mode = "RGBA"
+	elif pix.n == 1:
+		mode = "L"
+	else:
+		mode = "RGB"
+	if pix.n - pix.alpha not in (1, 3):
+		# CMYK and other colorspaces: convert before wrapping
+		pix = fitz.Pixmap(fitz.csRGB, pix)
+		mode = "RGBA" if pix.alpha else "RGB"
+	return Image.frombytes(mode, (pix.width, pix.height), pix.samples)
+
+def render_page_images(pdf_path: str, page_numbers: Iterable[int], dpi: Optional[int] = None) -> Iterator[Tuple[int, Any]]:
+	"""
+	Render the given pages (1-based) to PIL images, opening the PDF only once.
+	Yields (page_number, image). Yields nothing if Pillow not installed.
+	"""
+	with fitz.open(pdf_path) as doc:
+		for page_number in page_numbers:
+			pix = doc[page_number - 1].get_pixmap(dpi=dpi)
+			img = pixmap_to_image(pix)
+			if img is None:
+				return
+			yield page_number, img
+
+def extract_page_image(pdf_path: str, page_number: int, dpi: Optional[int] = None) -> Any:
+	"""
+	Extracts a PIL image of a given page (1-based).
+	Returns None if Pillow not installed.
+	Prefer render_page_images() when rendering several pages of one file.
+	"""
+	for _, img in render_page_images(pdf_path, [page_number], dpi=dpi):
+		return img
+	return None
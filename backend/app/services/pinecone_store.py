@@ -1,52 +1,158 @@
-# Pinecone vector store logic
-# To be implemented
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional, List, Callable
+from app.config import (
+	PINECONE_API_KEY, PINECONE_INDEX_NAME, PINECONE_UPSERT_BATCH_SIZE, PINECONE_UPSERT_MAX_BYTES,
+	PINECONE_CONCURRENCY, PINECONE_MAX_RETRIES, PINECONE_RETRY_BASE_SECONDS, PINECONE_TIMEOUT_SECONDS, PINECONE_POOL_MAXSIZE
+)
+from app.services import metrics
 
-import os
-from pinecone import Pinecone
-from app.config import PINECONE_API_KEY, PINECONE_INDEX_NAME
+NAMESPACE = "papertrail"
 
-pc = Pinecone(api_key=PINECONE_API_KEY)
-index = pc.Index(os.environ.get("PINECONE_INDEX_NAME", "papertrailai"))
+_index = None
+_index_lock = threading.Lock()
 
-NAMESPACE = "papertrail"
+def get_index():
+	"""
+	The Pinecone index handle, created on first use so importing this module needs no network.
+	"""
+	global _index
+	with _index_lock:
+		if _index is None:
+			from pinecone import Pinecone
+			pc = Pinecone(api_key=PINECONE_API_KEY, timeout=PINECONE_TIMEOUT_SECONDS, connection_pool_maxsize=PINECONE_POOL_MAXSIZE)
+			_index = pc.Index(PINECONE_INDEX_NAME)
+		return _index
+
+def _network_errors() -> tuple:
+	errors = (ConnectionError, TimeoutError)
+	try:
+		import urllib3
+		errors += (urllib3.exceptions.HTTPError,)
+	except ImportError:
+		pass
+	return errors
+
+def _retryable(e: Exception) -> bool:
+	# Throttling, server errors and network failures are worth retrying; anything else
+	# (other 4xx, programming errors) fails at once
+	status = getattr(e, "status", None)
+	if isinstance(status, int):
+		return status == 429 or status >= 500
+	return isinstance(e, _network_errors())
+
+def _with_retries(op: str, fn: Callable[[], Any], max_retries: int = PINECONE_MAX_RETRIES) -> Dict[str, Any]:
+	"""
+	Run one Pinecone request with exponential backoff and jitter.
+	Returns {"ok", "attempts", "error"} instead of raising.
+	"""
+	attempt = 0
+	while True:
+		attempt += 1
+		try:
+			fn()
+			metrics.VECTOR_BATCHES.inc(op=op, status="ok")
+			return {"ok": True, "attempts": attempt, "error": None}
+		except Exception as e:
+			if attempt > max_retries or not _retryable(e):
+				metrics.VECTOR_BATCHES.inc(op=op, status="error")
+				print(f"Pinecone {op} failed after {attempt} attempt(s): {e}")
+				return {"ok": False, "attempts": attempt, "error": str(e)}
+			metrics.VECTOR_RETRIES.inc(op=op)
+			delay = PINECONE_RETRY_BASE_SECONDS * (2 ** (attempt - 1))
+			time.sleep(delay * random.uniform(0.5, 1.5))
+
+def _vector_bytes(vector) -> int:
+	# Rough request size: values are sent as JSON numbers, plus id and metadata
+	vid, values, metadata = vector
+	return len(vid) + 20 * len(values) + len(json.dumps(metadata or {})) + 32
+
+def _split_batches(vectors: list, max_vectors: int, max_bytes: int) -> List[list]:
+	batches = []
+	current, current_bytes = [], 0
+	for v in vectors:
+		n = _vector_bytes(v)
+		if current and (len(current) >= max_vectors or current_bytes + n > max_bytes):
+			batches.append(current)
+			current, current_bytes = [], 0
+		current.append(v)
+		current_bytes += n
+	if current:
+		batches.append(current)
+	return batches
 
-def upsert_vectors(vectors: list):
+def _run_batches(op: str, batches: List[list], send: Callable[[list], None], concurrency: int) -> List[Dict[str, Any]]:
+	"""
+	Send batches concurrently; one result per batch, in input order, with the batch ids.
+	"""
+	def run(batch):
+		result = _with_retries(op, lambda: send(batch))
+		result["ids"] = [v if isinstance(v, str) else v[0] for v in batch]
+		return result
+
+	if len(batches) <= 1 or concurrency <= 1:
+		return [run(b) for b in batches]
+	with ThreadPoolExecutor(max_workers=min(concurrency, len(batches))) as pool:
+		return list(pool.map(run, batches))
+
+def upsert_vectors(vectors: list, batch_size: int = PINECONE_UPSERT_BATCH_SIZE, max_bytes: int = PINECONE_UPSERT_MAX_BYTES, concurrency: int = PINECONE_CONCURRENCY) -> List[Dict[str, Any]]:
 	"""
 	Upsert a list of vectors to Pinecone. Each vector: (id, values, metadata)
+	Vectors are split into batches bounded by count and estimated request size, sent in
+	parallel and retried with backoff. Returns one result per batch:
+	{"ids", "ok", "attempts", "error"}. Failed batches do not raise.
 	"""
-	index.upsert(vectors=vectors, namespace=NAMESPACE)
+	index = get_index()
+	batches = _split_batches(vectors, batch_size, max_bytes)
+	return _run_batches("upsert", batches, lambda b: index.upsert(vectors=b, namespace=NAMESPACE), concurrency)
 
-def delete_vectors(ids: list):
+def delete_vectors(ids: list, concurrency: int = PINECONE_CONCURRENCY) -> List[Dict[str, Any]]:
 	"""
-	Delete vectors by a list of IDs.
+	Delete vectors by a list of IDs. Returns one result per batch, like upsert_vectors.
 	"""
-	try:
-		# Pinecone delete by IDs
-		# Process in batches of 1000 to be safe
-		batch_size = 1000
-		for i in range(0, len(ids), batch_size):
-			batch = ids[i:i+batch_size]
-			index.delete(ids=batch, namespace=NAMESPACE)
-	except Exception as e:
-		print(f"Error deleting vectors by IDs: {e}")
+	index = get_index()
+	# Pinecone accepts at most 1000 ids per delete
+	batch_size = 1000
+	batches = [ids[i:i+batch_size] for i in range(0, len(ids), batch_size)]
+	return _run_batches("delete", batches, lambda b: index.delete(ids=b, namespace=NAMESPACE), concurrency)
+
+def update_metadata(ids: list, metadata: Dict[str, Any], concurrency: int = PINECONE_CONCURRENCY) -> List[Dict[str, Any]]:
+	"""
+	Merge `metadata` into existing vectors' metadata. Pinecone updates one vector per request,
+	so ids are grouped into batches of requests that are run in parallel.
+	"""
+	index = get_index()
+	def send(batch):
+		for vid in batch:
+			index.update(id=vid, set_metadata=metadata, namespace=NAMESPACE)
+	batch_size = 50
+	batches = [ids[i:i+batch_size] for i in range(0, len(ids), batch_size)]
+	return _run_batches("update", batches, send, concurrency)
+
+def delete_vectors_by_filter(filter: Dict[str, Any]) -> Dict[str, Any]:
+	"""
+	Delete all vectors whose metadata matches the filter.
+	Returns {"ok", "attempts", "error"}.
+	"""
+	index = get_index()
+	return _with_retries("delete_by_filter", lambda: index.delete(filter=filter, namespace=NAMESPACE))
 
-def delete_vectors_by_document(document_id: str):
+def delete_vectors_by_document(document_id: str) -> Dict[str, Any]:
 	"""
 	Delete all vectors for a document by filtering metadata.
 	"""
-	try:
-		index.delete(filter={"document_id": document_id}, namespace=NAMESPACE)
-	except Exception as e:
-		print(f"Error deleting vectors for document {document_id}: {e}")
-		# We don't raise here to allow calling logic to try ID-based deletion if needed or proceed
+	return delete_vectors_by_filter({"document_id": document_id})
 
 
-def query_similar_vectors(embedding: list, top_k: int = 10, document_id: str = None):
+def query_similar_vectors(embedding: list, top_k: int = 10, document_id: str = None, filter: Optional[Dict[str, Any]] = None):
 	"""
-	Query Pinecone for similar vectors. Optionally filter by document_id.
+	Query Pinecone for similar vectors. Optionally filter by document_id and other metadata.
 	"""
-	filter_dict = {"document_id": document_id} if document_id else {}
-	res = index.query(vector=embedding, top_k=top_k, filter=filter_dict, namespace=NAMESPACE, include_metadata=True)
+	filter_dict = dict(filter or {})
+	if document_id:
+		filter_dict["document_id"] = document_id
+	res = get_index().query(vector=embedding, top_k=top_k, filter=filter_dict, namespace=NAMESPACE, include_metadata=True)
 	return res.get("matches", [])
-# Pinecone vector store logic
-# To be implemented
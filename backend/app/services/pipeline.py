@@ -0,0 +1,138 @@
+from app.models import Document, Chunk
+from app.services import pdf, ocr, embeddings, vector_store, lexical_index, metrics
+from app.config import PIPELINE_PAGE_WINDOW, PIPELINE_CHUNK_BATCH, PIPELINE_MAX_INFLIGHT
+from sqlmodel import Session
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from itertools import islice
+from typing import Callable, Iterable, Iterator, List, Dict, Any, Optional, TypeVar
+import hashlib
+
+T = TypeVar("T")
+
+def batched(items: Iterable[T], size: int) -> Iterator[List[T]]:
+	"""
+	Group an iterable into lists of at most `size` items, lazily.
+	"""
+	it = iter(items)
+	while True:
+		batch = list(islice(it, size))
+		if not batch:
+			return
+		yield batch
+
+def iter_document_pages(doc: Document, window: int = PIPELINE_PAGE_WINDOW, on_ocr: Optional[Callable[[], None]] = None) -> Iterator[Dict[str, Any]]:
+	"""
+	Yield the pages of a document with text, in order.
+	PDF pages are read in windows; empty pages in each window are OCR'd together
+	before the window is released downstream. on_ocr() is called before each OCR run.
+	"""
+	if not doc.filename.lower().endswith(".pdf"):
+		# For images, treat as single page
+		if on_ocr:
+			on_ocr()
+		with metrics.track("ocr", items=1):
+			text = ocr.ocr_image_file(doc.path) or ""
+		yield {"page_number": 1, "text": text, "bbox": None}
+		return
+
+	for pages in batched(metrics.track_iter("pdf_text", pdf.iter_pdf_pages(doc.path)), window):
+		empty_pages = [p["page_number"] for p in pages if not p["text"].strip()]
+		if empty_pages:
+			if on_ocr:
+				on_ocr()
+			with metrics.track("ocr", items=len(empty_pages)):
+				ocr_texts = ocr.ocr_pdf_pages(doc.path, empty_pages)
+			for p in pages:
+				if p["page_number"] in ocr_texts:
+					p["text"] = ocr_texts[p["page_number"]]
+		yield from pages
+
+def content_hash(text: str) -> str:
+	return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def chunk_vector_id(document_id: str, chunk: Dict[str, Any]) -> str:
+	return f"{document_id}:{chunk['page']}:{chunk['chunk_index']}"
+
+def _embed_and_upsert(base_metadata: Dict[str, Any], batch: List[Dict[str, Any]]) -> List[str]:
+	"""
+	Embed and upsert a batch of chunks. Returns the ids of chunks whose vectors failed to upsert.
+	"""
+	with metrics.track("embedding", items=len(batch)):
+		batch_embeddings = embeddings.get_embeddings_batch([c["text"] for c in batch])
+	vectors = []
+	for c, emb in zip(batch, batch_embeddings):
+		vectors.append((c["id"], emb, {
+			**base_metadata,
+			"page": c["page"],
+			"page_end": c.get("page_end", c["page"]),
+			"chunk_index": c["chunk_index"],
+			"text_preview": c["text_preview"]
+		}))
+	with metrics.track("vector_upsert", items=len(vectors)):
+		results = vector_store.upsert_vectors(vectors)
+	return vector_store.failed_ids(results)
+
+def index_chunks(session: Session, doc: Document, chunks: Iterable[Dict[str, Any]], existing_hashes: Optional[Dict[str, str]] = None, batch_size: int = PIPELINE_CHUNK_BATCH, max_inflight: int = PIPELINE_MAX_INFLIGHT, on_batch: Optional[Callable[[], None]] = None) -> Dict[str, Any]:
+	"""
+	Embed, upsert and persist a stream of chunks.
+	Chunks are grouped into batches; at most `max_inflight` batches are being embedded
+	and upserted at once while upstream extraction and chunking continue. Chunk rows
+	are written once their batch is indexed.
+
+	existing_hashes maps chunk id -> content hash from a previous run; chunks whose
+	hash is unchanged are skipped entirely. Returns counts and the set of chunk ids seen,
+	so the caller can remove chunks that no longer exist.
+
+	Chunks whose vector upsert failed are not written (their previous row, if any, keeps
+	its old hash), so the next run retries exactly those. They are listed in "failed_ids".
+	on_batch() is called as each batch is sent for embedding.
+	"""
+	existing_hashes = existing_hashes or {}
+	stats = {"embedded": 0, "unchanged": 0, "failed_ids": [], "seen_ids": set()}
+	inflight = deque()
+	# Plain values: batches run on other threads and must not touch the ORM object.
+	# user_id is the tenant key every vector query filters on.
+	base_metadata = {"document_id": doc.id, "user_id": doc.user_id, "filename": doc.filename}
+
+	def changed_chunks():
+		for c in chunks:
+			c["id"] = chunk_vector_id(doc.id, c)
+			c["content_hash"] = content_hash(c["text"])
+			stats["seen_ids"].add(c["id"])
+			if existing_hashes.get(c["id"]) == c["content_hash"]:
+				stats["unchanged"] += 1
+				continue
+			yield c
+
+	def finish(batch, future):
+		failed = set(future.result())
+		stats["failed_ids"].extend(c["id"] for c in batch if c["id"] in failed)
+		indexed = [c for c in batch if c["id"] not in failed]
+		# Before the rows are committed, so a failure here is retried like a failed upsert
+		lexical_index.index_chunks(base_metadata["user_id"], base_metadata["document_id"], [(c["id"], c["text"]) for c in indexed])
+		for c in indexed:
+			# merge: a chunk id from the previous run may now hold different text
+			session.merge(Chunk(
+				id=c["id"],
+				document_id=doc.id,
+				page=c["page"],
+				chunk_index=c["chunk_index"],
+				text=c["text"],
+				content_hash=c["content_hash"],
+				created_at=datetime.utcnow()
+			))
+		session.commit()
+		stats["embedded"] += len(batch) - len(failed)
+
+	with ThreadPoolExecutor(max_workers=max(1, max_inflight)) as pool:
+		for batch in batched(changed_chunks(), batch_size):
+			if len(inflight) >= max_inflight:
+				finish(*inflight.popleft())
+			if on_batch:
+				on_batch()
+			inflight.append((batch, pool.submit(_embed_and_upsert, base_metadata, batch)))
+		while inflight:
+			finish(*inflight.popleft())
+	return stats
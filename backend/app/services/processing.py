@@ -0,0 +1,346 @@
+from app.models import Document, Chunk, DocumentPage, Deadline, User, ActionItem
+from app.db import engine
+from sqlmodel import Session, select
+from app.services import pdf, chunking, vector_store, lexical_index, corpus, pipeline, extraction, graph, metrics
+from app.config import EXTRACTION_TEXT_CHARS, PIPELINE_PAGE_WINDOW, EXTRACTION_MODE, EXTRACTION_SECTION_TOKENS, EXTRACTION_MAX_SECTIONS
+from datetime import date
+from typing import Callable, Optional, Dict, Any, List
+import hashlib
+import json
+
+# Pipeline stages in execution order, with the overall progress reached when each starts
+STAGES = [
+	# Ingest: text, OCR, chunking, embedding and upsert stream page by page and overlap, so
+	# these report the most recently started kind of work, with progress following pages read
+	("extract_text", 0.0),
+	("ocr", 0.0),
+	("embedding", 0.0),
+	("classification", 0.5),
+	("extraction", 0.6),
+	("actions", 0.85),
+	("graph", 0.9),
+]
+STAGE_PROGRESS = dict(STAGES)
+
+def _ingest(session: Session, doc: Document, force: bool, on_stage: Optional[Callable[[str, float], None]]) -> Dict[str, Any]:
+	"""
+	Stream pages -> chunks -> embeddings -> vector upserts with bounded batches in flight,
+	diffing against the previous run by content hash so only changed chunks are re-embedded.
+	Only the text needed for classification/extraction is kept in memory: the leading
+	text, plus (in sectioned mode) up to EXTRACTION_MAX_SECTIONS token-bounded sections.
+	"""
+	existing_hashes = {} if force else dict(session.exec(
+		select(Chunk.id, Chunk.content_hash).where(Chunk.document_id == doc.id)
+	).all())
+	old_page_hashes = dict(session.exec(
+		select(DocumentPage.page, DocumentPage.content_hash).where(DocumentPage.document_id == doc.id)
+	).all())
+	if force:
+		# Chunk ids are stable, so re-indexing overwrites most vectors even if this delete fails
+		if not vector_store.delete_vectors_by_document(doc.id)["ok"]:
+			print(f"Warning: could not clear vectors for {doc.id} before a forced rebuild")
+		lexical_index.delete_document(doc.id)
+		session.query(Chunk).filter(Chunk.document_id == doc.id).delete()
+	session.query(DocumentPage).filter(DocumentPage.document_id == doc.id).delete()
+	session.commit()
+
+	total_pages = pdf.page_count(doc.path) if doc.filename.lower().endswith(".pdf") else 1
+	text_hasher = hashlib.sha256()
+	leading_text = []
+	leading_chars = 0
+	total_chars = 0
+	sections = chunking.SectionBuilder(EXTRACTION_SECTION_TOKENS, EXTRACTION_MAX_SECTIONS) if EXTRACTION_MODE == "sectioned" else None
+	changed_pages = 0
+	pages_read = 0
+	current = {"stage": "extract_text"}
+
+	def report(name: str):
+		# Each call writes a heartbeat, so report on a change of sub-stage or once per page window
+		if on_stage:
+			current["stage"] = name
+			on_stage(name, STAGE_PROGRESS["classification"] * pages_read / max(total_pages, 1))
+
+	def sub_stage(name: str):
+		if name != current["stage"]:
+			report(name)
+
+	def tracked_pages():
+		nonlocal leading_chars, total_chars, changed_pages, pages_read
+		for p in pipeline.iter_document_pages(doc, on_ocr=lambda: sub_stage("ocr")):
+			pages_read = p["page_number"]
+			page_hash = pipeline.content_hash(p["text"])
+			if old_page_hashes.get(p["page_number"]) != page_hash:
+				changed_pages += 1
+			session.add(DocumentPage(document_id=doc.id, page=p["page_number"], content_hash=page_hash, char_count=len(p["text"])))
+			text_hasher.update(p["text"].encode("utf-8"))
+			text_hasher.update(b"\n")
+			total_chars += len(p["text"]) + 1
+			if leading_chars < EXTRACTION_TEXT_CHARS:
+				leading_text.append(p["text"])
+				leading_chars += len(p["text"]) + 1
+			if sections:
+				sections.add_page(p["page_number"], p["text"])
+			if p["page_number"] % PIPELINE_PAGE_WINDOW == 0:
+				report(current["stage"])
+			yield p
+
+	chunks = metrics.track_iter("chunking", chunking.iter_chunks(tracked_pages(), doc.id, doc.filename))
+	stats = pipeline.index_chunks(session, doc, chunks, existing_hashes=existing_hashes, on_batch=lambda: sub_stage("embedding"))
+
+	# Chunks from the previous run that no longer exist. Rows whose vector delete failed
+	# are kept so the next run retries the delete.
+	stale_ids = [cid for cid in existing_hashes if cid not in stats["seen_ids"]]
+	if stale_ids:
+		undeleted = set(vector_store.failed_ids(vector_store.delete_vectors(stale_ids)))
+		removable = [cid for cid in stale_ids if cid not in undeleted]
+		if removable:
+			lexical_index.delete_chunks(removable)
+			session.query(Chunk).filter(Chunk.id.in_(removable)).delete(synchronize_session=False)
+		if undeleted:
+			print(f"Warning: {len(undeleted)} stale vectors for {doc.id} could not be deleted; will retry on next run")
+	session.commit()
+
+	print(
+		f"Ingested {doc.id}: {total_pages} pages ({changed_pages} changed), "
+		f"{stats['embedded']} chunks embedded, {stats['unchanged']} unchanged, {len(stale_ids)} removed"
+	)
+	_check_indexed(doc, stats)
+	if sections and sections.truncated:
+		print(f"Warning: {doc.id} is longer than {EXTRACTION_MAX_SECTIONS} extraction sections; the rest is not extracted")
+	return {
+		"text": "\n".join(leading_text),
+		"sections": sections.finish() if sections else None,
+		"chars": max(total_chars - 1, 0),
+		"text_hash": text_hasher.hexdigest()
+	}
+
+def _check_indexed(doc: Document, stats: Dict[str, Any]):
+	"""
+	Fail the run if some chunks could not be written to the vector store, rather than
+	leaving the index silently behind the database. Indexed chunks are already
+	committed, so a retry only re-sends the failed ones.
+	"""
+	failed = stats["failed_ids"]
+	if failed:
+		total = stats["embedded"] + len(failed)
+		raise RuntimeError(f"{len(failed)} of {total} chunks failed to index for {doc.id} (e.g. {failed[0]})")
+
+def _extract(session: Session, doc: Document, all_text: str, stage: Callable[[str], None], sections: Optional[List[Dict[str, Any]]] = None, length: Optional[int] = None):
+	"""
+	Classify and extract fields with the LLM, then regenerate deadlines, actions and graph.
+	"""
+	session.query(Deadline).filter(Deadline.document_id == doc.id).delete()
+	session.query(ActionItem).filter(ActionItem.document_id == doc.id).delete()
+	session.commit()
+
+	stage("classification" if EXTRACTION_MODE == "sequential" else "extraction")
+	classify, extract = extraction.classify_and_extract(all_text, sections=sections, on_stage=stage, length=length)
+
+	doc.doc_type = classify.get("doc_type")
+	doc.issuer = classify.get("issuer")
+	doc.extracted_json = json.dumps(extract) if extract else None
+	doc.status = "extracted" if extract else "error"
+	doc.error_message = None if extract else "Extraction failed"
+
+	# Deadlines
+	if extract and extract.get("deadlines"):
+		for d in extract["deadlines"]:
+			due_date_val = d["due_date"]
+			try:
+				due_date_obj = date.fromisoformat(due_date_val)
+			except Exception:
+				due_date_obj = None
+
+			if due_date_obj is None:
+				continue
+
+			deadline = Deadline(
+				document_id=doc.id,
+				label=d.get("action", "Deadline"),
+				due_date=due_date_obj,
+				severity=d["severity"],
+				action=d.get("action")
+			)
+			session.add(deadline)
+
+	# Primary due date
+	if extract and extract.get("deadlines"):
+		due_date_str = extract["deadlines"][0]["due_date"]
+		try:
+			doc.primary_due_date = date.fromisoformat(due_date_str)
+		except Exception:
+			doc.primary_due_date = None
+
+	session.add(doc)
+	session.commit()
+	session.refresh(doc)
+
+	# Generate smart actions (pending actions)
+	stage("actions")
+	try:
+		from app.services.agents import generate_actions_for_document
+		with metrics.track("actions"):
+			generate_actions_for_document(session, doc)
+	except Exception as e:
+		print(f"Action generation warning: {e}")
+
+	# Trigger graph rebuild to include new nodes/edges
+	stage("graph")
+	try:
+		# Fetch user to pass to rebuild_graph
+		user = session.get(User, doc.user_id)
+		if user:
+			with metrics.track("graph_rebuild"):
+				graph.rebuild_graph(session, user)
+		else:
+			print(f"Graph rebuild skipped: User {doc.user_id} not found")
+	except Exception as e:
+		print(f"Graph rebuild warning: {e}")
+
+def _find_duplicate(session: Session, doc: Document) -> Optional[Document]:
+	"""
+	An earlier, successfully processed upload of the same file by the same user.
+	"""
+	if not doc.file_sha256:
+		return None
+	return session.exec(select(Document).where(
+		Document.user_id == doc.user_id,
+		Document.file_sha256 == doc.file_sha256,
+		Document.id != doc.id,
+		Document.status == "extracted",
+		Document.extracted_json != None
+	).order_by(Document.created_at)).first()
+
+def _clone_from_duplicate(session: Session, doc: Document, source: Document, stage: Callable[[str], None]):
+	"""
+	Copy chunks, vectors, extraction results and deadlines from an identical earlier upload
+	instead of re-running OCR and LLM extraction. Vectors are re-created under the new
+	document's ids; their embeddings come from the embedding cache since the chunk texts match.
+	"""
+	vector_store.delete_vectors_by_document(doc.id)
+	lexical_index.delete_document(doc.id)
+	for model in (Chunk, DocumentPage, Deadline, ActionItem):
+		session.query(model).filter(model.document_id == doc.id).delete()
+	session.commit()
+
+	for page in session.exec(select(DocumentPage).where(DocumentPage.document_id == source.id)).all():
+		session.add(DocumentPage(document_id=doc.id, page=page.page, content_hash=page.content_hash, char_count=page.char_count))
+
+	source_chunks = session.exec(
+		select(Chunk.page, Chunk.chunk_index, Chunk.text)
+		.where(Chunk.document_id == source.id)
+		.order_by(Chunk.page, Chunk.chunk_index)
+	)
+	chunks = ({"page": page, "chunk_index": idx, "text": text, "text_preview": text[:120]} for page, idx, text in source_chunks)
+	stats = pipeline.index_chunks(session, doc, chunks)
+	_check_indexed(doc, stats)
+
+	doc.doc_type = source.doc_type
+	doc.issuer = source.issuer
+	doc.primary_due_date = source.primary_due_date
+	doc.extracted_json = source.extracted_json
+	doc.text_hash = source.text_hash
+	doc.status = "extracted"
+	doc.error_message = None
+	for d in session.exec(select(Deadline).where(Deadline.document_id == source.id)).all():
+		session.add(Deadline(document_id=doc.id, label=d.label, due_date=d.due_date, severity=d.severity, action=d.action))
+	session.add(doc)
+	session.commit()
+	session.refresh(doc)
+	print(f"Cloned {stats['embedded']} chunks and extraction for {doc.id} from duplicate upload {source.id}")
+
+	stage("actions")
+	try:
+		from app.services.agents import generate_actions_for_document
+		with metrics.track("actions"):
+			generate_actions_for_document(session, doc)
+	except Exception as e:
+		print(f"Action generation warning: {e}")
+
+	stage("graph")
+	try:
+		user = session.get(User, doc.user_id)
+		if user:
+			with metrics.track("graph_rebuild"):
+				graph.rebuild_graph(session, user)
+	except Exception as e:
+		print(f"Graph rebuild warning: {e}")
+
+def process_document(document_id: str, on_stage: Optional[Callable[[str, float], None]] = None, force: bool = False):
+	"""
+	Run the full processing pipeline for a document:
+	- Extract text (PDF/OCR), chunk, embed and upsert as one streaming pass
+	- Classification
+	- Extraction
+	- Deadlines & Graph
+
+	Re-processing is incremental: only chunks whose content hash changed are re-embedded,
+	and LLM extraction is skipped when the full text hash matches the previous run.
+	A first-time upload of a file this user already processed is cloned from that document.
+	Pass force=True to rebuild everything.
+
+	on_stage(stage, progress) is called as each stage starts.
+	Raises on failure so the caller can decide whether to retry; the document
+	status is left for the caller to update.
+	"""
+	def stage(name: str):
+		if on_stage:
+			on_stage(name, STAGE_PROGRESS[name])
+
+	with Session(engine) as session:
+		doc = session.get(Document, document_id)
+		if not doc:
+			return
+
+		# Same file uploaded before by this user: reuse its results (only on first processing)
+		if not force and not doc.extracted_json:
+			source = _find_duplicate(session, doc)
+			if source:
+				_clone_from_duplicate(session, doc, source, stage)
+				corpus.bump_version(session, doc.user_id)
+				metrics.DOCUMENTS_PROCESSED.inc(status="cloned")
+				print(f"Processing completed for {document_id}")
+				return
+
+		stage("extract_text")
+		ingested = _ingest(session, doc, force, on_stage)
+
+		if not force and doc.extracted_json and doc.text_hash == ingested["text_hash"]:
+			print(f"Text unchanged for {document_id}; skipping extraction")
+			doc.status = "extracted"
+			doc.error_message = None
+			session.add(doc)
+			session.commit()
+			metrics.DOCUMENTS_PROCESSED.inc(status="unchanged")
+		else:
+			_extract(session, doc, ingested["text"], stage, sections=ingested["sections"], length=ingested["chars"])
+			doc.text_hash = ingested["text_hash"] if doc.extracted_json else None
+			session.add(doc)
+			session.commit()
+			metrics.DOCUMENTS_PROCESSED.inc(status=doc.status)
+
+		corpus.bump_version(session, doc.user_id)
+		print(f"Processing completed for {document_id}")
+
+def mark_document_error(document_id: str, message: str):
+	metrics.DOCUMENTS_PROCESSED.inc(status="failed")
+	with Session(engine) as session:
+		doc = session.get(Document, document_id)
+		if doc:
+			doc.status = "error"
+			doc.error_message = message
+			session.add(doc)
+			session.commit()
+			# A failed run may still have changed some chunks
+			corpus.bump_version(session, doc.user_id)
+
+def process_document_safe(document_id: str, force: bool = False):
+	"""
+	Run the pipeline in-process, recording any failure on the document.
+	Used by the BackgroundTasks processing backend.
+	"""
+	try:
+		process_document(document_id, force=force)
+	except Exception as e:
+		print(f"Error processing document {document_id}: {e}")
+		mark_document_error(document_id, str(e))
@@ -1,49 +1,137 @@
 
 from app.services.embeddings import get_embedding
-from app.services.pinecone_store import query_similar_vectors
-from sqlmodel import Session
+from app.services.vector_store import query_similar_vectors
+from sqlmodel import Session, select, col
 from app.models import Chunk, Document
-import openai
-from app.config import OPENAI_API_KEY
-from typing import List, Dict, Any, Optional
+from app.services import llm, lexical_index, corpus, metrics, context_packer
+from app.services.cache import TTLCache
+from app.config import HYBRID_RRF_K, HYBRID_LEXICAL_ONLY, RETRIEVAL_CACHE_ENABLED, RETRIEVAL_CACHE_MAX_ENTRIES, RETRIEVAL_CACHE_TTL_SECONDS, RETRIEVAL_MAX_THREADS
+from typing import List, Dict, Any, Optional, Tuple, AsyncIterator
+import json
+import anyio
+import anyio.to_thread
 
-openai.api_key = OPENAI_API_KEY
+_retrieval_cache = TTLCache("retrieval", RETRIEVAL_CACHE_MAX_ENTRIES, RETRIEVAL_CACHE_TTL_SECONDS)
+metrics.register_cache("retrieval", lambda: _retrieval_cache if RETRIEVAL_CACHE_ENABLED else None)
+_retrieval_limiter = anyio.CapacityLimiter(RETRIEVAL_MAX_THREADS)
 
-def retrieve_chunks(session: Session, query: str, top_k: int = 10, document_id: Optional[str] = None) -> List[Dict[str, Any]]:
-    embedding = get_embedding(query)
-    matches = query_similar_vectors(embedding, top_k=top_k, document_id=document_id)
-    chunk_ids = [m["id"] for m in matches]
+def normalize_query(query: str) -> str:
+    return " ".join(query.lower().split()).rstrip("?!. ")
+
+def get_retrieval_cache_stats() -> Dict[str, Any]:
+    return _retrieval_cache.stats() if RETRIEVAL_CACHE_ENABLED else {"enabled": False}
+
+def _fuse(rankings: List[List[str]], k: int = HYBRID_RRF_K) -> List[str]:
+    """
+    Reciprocal rank fusion: score(id) = sum over rankings of 1 / (k + rank).
+    """
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, cid in enumerate(ranking, start=1):
+            scores[cid] = scores.get(cid, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
+
+def retrieve_chunks(session: Session, query: str, user_id: str, top_k: int = 10, document_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Top-k chunks for a query from the given user's documents, served from the retrieval
+    cache when the same (normalized) query was answered against the same corpus version.
+    Processing or deleting a document bumps the user's corpus version, so cached results
+    never outlive a change to the documents.
+    """
+    if not RETRIEVAL_CACHE_ENABLED:
+        return _search_chunks(session, query, user_id, top_k, document_id)
+    key = (user_id, normalize_query(query), document_id, top_k, corpus.get_version(session, user_id))
+    cached = _retrieval_cache.get(key)
+    if cached is not None:
+        return [dict(c) for c in cached]
+    results = _search_chunks(session, query, user_id, top_k, document_id)
+    _retrieval_cache.set(key, [dict(r) for r in results])
+    return results
+
+async def aretrieve_chunks(session: Session, query: str, user_id: str, top_k: int = 10, document_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    retrieve_chunks for async endpoints. The embedding lookup, vector query and SQL block,
+    so they run under their own thread limit (RETRIEVAL_MAX_THREADS) instead of taking
+    slots from the default threadpool that sync endpoints and dependencies share.
+    The session is closed afterwards, returning its DB connection to the pool rather than
+    holding it while the caller awaits the model.
+    """
+    def run():
+        try:
+            return retrieve_chunks(session, query, user_id, top_k, document_id)
+        finally:
+            session.close()
+    return await anyio.to_thread.run_sync(run, limiter=_retrieval_limiter)
+
+def _search_chunks(session: Session, query: str, user_id: str, top_k: int, document_id: Optional[str]) -> List[Dict[str, Any]]:
+    """
+    Top-k chunks for a query from the given user's documents.
+    Keyword (BM25) and vector candidates are fused with reciprocal rank fusion, so exact
+    terms like invoice numbers are found even when embeddings miss them. Short identifier
+    lookups that the keyword index answers skip the embedding call entirely.
+    The user filter is applied inside both searches, so ranking and top_k only
+    ever consider that tenant's chunks.
+    """
+    lexical_ids = [m["id"] for m in lexical_index.search(user_id, query, limit=top_k, document_id=document_id)]
+    if HYBRID_LEXICAL_ONLY and lexical_ids and lexical_index.is_identifier_query(query):
+        mode = "lexical"
+        ranked = lexical_ids
+    else:
+        embedding = get_embedding(query)
+        matches = query_similar_vectors(embedding, top_k=top_k, document_id=document_id, filter={"user_id": user_id})
+        vector_ids = [m["id"] for m in matches]
+        mode = "hybrid" if lexical_ids else "vector"
+        ranked = _fuse([vector_ids, lexical_ids]) if lexical_ids else vector_ids
+    metrics.RETRIEVALS.inc(mode=mode)
     
-    # Check for valid documents join to avoid "ghost" chunks if SQL wasn't cleaned up or if Pinecone is out of sync
-    chunks = session.query(Chunk).join(Document)\
-        .filter(Chunk.id.in_(chunk_ids))\
-        .filter(Document.status != 'deleted')\
-        .all()
+    # Check for valid documents join to avoid "ghost" chunks if SQL wasn't cleaned up or if Pinecone is out of sync.
+    # One query, projecting only the columns we return (no Document rows / extracted_json, no lazy loads).
+    rows = session.exec(
+        select(Chunk.id, Chunk.text, Chunk.page, Chunk.chunk_index, Chunk.document_id, Document.filename)
+        .join(Document, Document.id == Chunk.document_id)
+        .where(col(Chunk.id).in_(ranked))
+        .where(Document.user_id == user_id)
+        .where(Document.status != 'deleted')
+    ).all() if ranked else []
     
-    chunk_map = {c.id: c for c in chunks}
+    row_map = {r[0]: r for r in rows}
     results = []
-    for m in matches:
-        cid = m["id"]
-        meta = m.get("metadata", {})
-        chunk = chunk_map.get(cid)
-        # Use filename from DB if possible to be source-of-truth, else metadata
-        if chunk:
-            doc_filename = chunk.document.filename if chunk.document else meta.get("filename")
+    for cid in ranked:
+        row = row_map.get(cid)
+        if row:
+            _, text, page, chunk_index, doc_id, filename = row
             results.append({
                 "chunk_id": cid,
-                "document_id": meta.get("document_id"),
-                "filename": doc_filename,
-                "page": meta.get("page"),
-                "chunk_index": meta.get("chunk_index"),
-                "text": chunk.text,
+                "document_id": doc_id,
+                "filename": filename,
+                "page": page,
+                "chunk_index": chunk_index,
+                "text": text,
             })
+            if len(results) >= top_k:
+                break
     return results
 
-def chat_with_context(query: str, retrieved_chunks: List[Dict[str, Any]], image_url: Optional[str] = None, history: Optional[List[Dict[str, str]]] = None) -> Dict[str, Any]:
-    context = "\n\n".join([
-        f"[doc:{c['document_id']} page:{c['page']} chunk:{c['chunk_index']}] {c['text']}"
-        for c in retrieved_chunks
-    ])
+SYSTEM_PROMPT = (
+    "You are PaperTrail AI, an intelligent document assistant. "
+    "Use the provided context to answer the user's question accurately and concisely. "
+    "If the answer is not in the context, state that you don't know based on the documents provided. "
+    "Always cite sources using the format [doc:document_id page:page chunk:chunk_index] when referencing specific information. "
+)
+JSON_INSTRUCTIONS = (
+    "Respond ONLY in valid JSON format as a single JSON object. The keys should be 'answer' (string) and 'citations' (array of objects if any additional info needed, but mainly use text citations). "
+    "Ideally just use the 'answer' key for the main response text."
+)
+# Streamed answers are shown as they arrive, so they must be plain text rather than a JSON object
+STREAM_INSTRUCTIONS = "Respond with the answer text only (Markdown allowed), not JSON."
+
+def build_chat_messages(query: str, retrieved_chunks: List[Dict[str, Any]], image_url: Optional[str] = None, history: Optional[List[Dict[str, str]]] = None, stream: bool = False) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Prompt messages and ground-truth citations for a chat turn.
+    With stream=True the model is asked for plain text instead of a JSON object.
+    """
+    # Chunks that don't fit the token budget are left out of the context and the citations
+    context, packed_chunks = context_packer.pack_context(retrieved_chunks)
     
     citations = [
         {
@@ -52,19 +140,14 @@ def chat_with_context(query: str, retrieved_chunks: List[Dict[str, Any]], image_
             "page": c["page"],
             "chunk_id": c["chunk_id"]
         }
-        for c in retrieved_chunks
+        for c in packed_chunks
     ]
+    # Near-duplicates dropped by the rerank stage carry the same text, so they stay cited
+    citations += [d for c in packed_chunks for d in c.get("duplicates", [])]
 
     system_message = {
         "role": "system",
-        "content": (
-            "You are PaperTrail AI, an intelligent document assistant. "
-            "Use the provided context to answer the user's question accurately and concisely. "
-            "If the answer is not in the context, state that you don't know based on the documents provided. "
-            "Always cite sources using the format [doc:document_id page:page chunk:chunk_index] when referencing specific information. "
-            "Respond ONLY in valid JSON format as a single JSON object. The keys should be 'answer' (string) and 'citations' (array of objects if any additional info needed, but mainly use text citations). "
-            "Ideally just use the 'answer' key for the main response text."
-        )
+        "content": SYSTEM_PROMPT + (STREAM_INSTRUCTIONS if stream else JSON_INSTRUCTIONS)
     }
 
     messages = [system_message]
@@ -78,8 +161,9 @@ def chat_with_context(query: str, retrieved_chunks: List[Dict[str, Any]], image_
                 messages.append({"role": role, "content": msg.get("content", "")})
 
     # Add current user query with context
+    answer_format = "" if stream else "\n\nPlease provide your answer in JSON format."
     user_content = [
-        {"type": "text", "text": f"Context from documents:\n{context}\n\nUser Question: {query}\n\nPlease provide your answer in JSON format."}
+        {"type": "text", "text": f"Context from documents:\n{context}\n\nUser Question: {query}{answer_format}"}
     ]
 
     if image_url:
@@ -89,35 +173,58 @@ def chat_with_context(query: str, retrieved_chunks: List[Dict[str, Any]], image_
         })
 
     messages.append({"role": "user", "content": user_content})
+    return messages, citations
+
+async def astream_chat(messages: List[Dict[str, Any]]) -> AsyncIterator[str]:
+    """
+    Answer text deltas from GPT-4o as they are generated.
+    """
+    async for text in llm.astream_chat_completion("chat_stream", model="gpt-4o", messages=messages, temperature=0.3):
+        yield text
 
+def _chat_request(messages: List[Dict[str, Any]]) -> Dict[str, Any]:
     # Use GPT-4o for better performance
-    model = "gpt-4o"
+    return dict(
+        model="gpt-4o",
+        messages=messages,
+        response_format={"type": "json_object"},
+        temperature=0.3 # Lower temperature for more factual answers
+    )
+
+def _parse_answer(resp, citations: List[Dict[str, Any]]) -> Dict[str, Any]:
+    # Clean up response if needed
+    content = resp.choices[0].message.content
+    if not content:
+        return {"answer": "Error: Empty response from AI.", "citations": []}
 
     try:
-        resp = openai.chat.completions.create(
-            model=model,
-            messages=messages,
-            response_format={"type": "json_object"},
-            temperature=0.3 # Lower temperature for more factual answers
-        )
-        
-        # Clean up response if needed
-        content = resp.choices[0].message.content
-        if not content:
-            return {"answer": "Error: Empty response from AI.", "citations": []}
-
-        import json
-        try:
-            parsed = json.loads(content)
-            answer_text = parsed.get("answer", content)
-            # We can also parse citations from JSON if the model returns them structured, 
-            # but we already have ground-truth citations from retrieval. 
-            # We'll just return the answer text and the retrieval citations.
-            return {"answer": answer_text, "citations": citations}
-        except json.JSONDecodeError:
-            # Fallback if model didn't return valid JSON
-            return {"answer": content, "citations": citations}
-            
+        parsed = json.loads(content)
+        answer_text = parsed.get("answer", content)
+        # We can also parse citations from JSON if the model returns them structured, 
+        # but we already have ground-truth citations from retrieval. 
+        # We'll just return the answer text and the retrieval citations.
+        return {"answer": answer_text, "citations": citations}
+    except json.JSONDecodeError:
+        # Fallback if model didn't return valid JSON
+        return {"answer": content, "citations": citations}
+
+def chat_with_context(query: str, retrieved_chunks: List[Dict[str, Any]], image_url: Optional[str] = None, history: Optional[List[Dict[str, str]]] = None) -> Dict[str, Any]:
+    messages, citations = build_chat_messages(query, retrieved_chunks, image_url=image_url, history=history)
+    try:
+        resp = llm.chat_completion("chat", **_chat_request(messages))
+        return _parse_answer(resp, citations)
+    except Exception as e:
+        print(f"OpenAI API Error: {e}")
+        return {"answer": f"I encountered an error processing your request: {str(e)}", "citations": []}
+
+async def achat_with_context(query: str, retrieved_chunks: List[Dict[str, Any]], image_url: Optional[str] = None, history: Optional[List[Dict[str, str]]] = None) -> Dict[str, Any]:
+    """
+    chat_with_context for async endpoints: the model call awaits on the shared async client.
+    """
+    messages, citations = build_chat_messages(query, retrieved_chunks, image_url=image_url, history=history)
+    try:
+        resp = await llm.achat_completion("chat", **_chat_request(messages))
+        return _parse_answer(resp, citations)
     except Exception as e:
         print(f"OpenAI API Error: {e}")
         return {"answer": f"I encountered an error processing your request: {str(e)}", "citations": []}
@@ -0,0 +1,110 @@
+import re
+import math
+from typing import List, Dict, Any, Optional, Set, Tuple
+from app.services import metrics
+from app.services.lexical_index import STOPWORDS
+from app.config import RERANK_ENABLED, RERANK_MAX_CHUNKS, RERANK_MMR_LAMBDA, RERANK_DUPLICATE_THRESHOLD
+
+WORD_PATTERN = re.compile(r"\w+")
+# Weight of the retrieval rank vs. query-term coverage in the rerank score
+RANK_WEIGHT = 0.5
+SHINGLE_SIZE = 3
+
+def _words(text: str) -> List[str]:
+    return WORD_PATTERN.findall(text.lower())
+
+def _shingles(words: List[str]) -> Set[Tuple[str, ...]]:
+    if len(words) < SHINGLE_SIZE:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+def jaccard(a: Set, b: Set) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+def _relevance(query_words: Set[str], chunk_words: List[Set[str]]) -> List[float]:
+    """
+    Score each candidate by its retrieval rank and by how much of the query it covers.
+    Query terms are IDF-weighted over the candidate set, so a chunk containing the rare
+    term (an invoice number, a party name) beats one that only repeats common words.
+    """
+    n = len(chunk_words)
+    idf = {}
+    for term in query_words:
+        df = sum(1 for words in chunk_words if term in words)
+        idf[term] = math.log(1 + n / (1 + df))
+    total = sum(idf.values())
+    scores = []
+    for rank, words in enumerate(chunk_words):
+        prior = 1.0 - rank / n
+        coverage = sum(w for t, w in idf.items() if t in words) / total if total else 0.0
+        scores.append(RANK_WEIGHT * prior + (1 - RANK_WEIGHT) * coverage)
+    return scores
+
+def _citation(chunk: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "document_id": chunk["document_id"],
+        "filename": chunk["filename"],
+        "page": chunk["page"],
+        "chunk_id": chunk["chunk_id"]
+    }
+
+def rerank_chunks(query: str, chunks: List[Dict[str, Any]], max_chunks: Optional[int] = None,
+                  mmr_lambda: float = RERANK_MMR_LAMBDA, duplicate_threshold: float = RERANK_DUPLICATE_THRESHOLD) -> List[Dict[str, Any]]:
+    """
+    Reorder retrieved chunks by relevance and pick a diverse subset with maximal marginal
+    relevance: each step takes the chunk maximising
+        lambda * relevance - (1 - lambda) * max similarity to the chunks already picked.
+    Candidates whose text (word 3-gram Jaccard) nearly repeats a picked chunk are dropped;
+    their citations are kept on the picked chunk under "duplicates", since the model sees
+    the same text. Returns new dicts; the input (possibly cached) is not modified.
+    """
+    if not RERANK_ENABLED or not chunks:
+        return chunks
+    max_chunks = max_chunks or RERANK_MAX_CHUNKS
+    with metrics.track("rerank", items=len(chunks)):
+        words = [_words(c["text"]) for c in chunks]
+        word_sets = [set(w) for w in words]
+        shingles = [_shingles(w) for w in words]
+        relevance = _relevance({w for w in _words(query) if w not in STOPWORDS}, word_sets)
+
+        picked: List[int] = []
+        duplicates: Dict[int, List[Dict[str, Any]]] = {}
+        remaining = list(range(len(chunks)))
+        while remaining and len(picked) < max_chunks:
+            best, best_score, best_sim = None, None, 0.0
+            for i in remaining:
+                sim = max((jaccard(shingles[i], shingles[j]) for j in picked), default=0.0)
+                score = mmr_lambda * relevance[i] - (1 - mmr_lambda) * sim
+                if best_score is None or score > best_score:
+                    best, best_score, best_sim = i, score, sim
+            remaining.remove(best)
+            if best_sim >= duplicate_threshold:
+                twin = max(picked, key=lambda j: jaccard(shingles[best], shingles[j]))
+                duplicates.setdefault(twin, []).append(_citation(chunks[best]))
+                continue
+            picked.append(best)
+
+        # Anything left unpicked that repeats a picked chunk still counts as cited
+        cut = 0
+        for i in remaining:
+            sims = [(jaccard(shingles[i], shingles[j]), j) for j in picked]
+            sim, twin = max(sims) if sims else (0.0, None)
+            if twin is not None and sim >= duplicate_threshold:
+                duplicates.setdefault(twin, []).append(_citation(chunks[i]))
+            else:
+                cut += 1
+
+        results = []
+        for i in picked:
+            chunk = dict(chunks[i])
+            chunk["rerank_score"] = round(relevance[i], 4)
+            if i in duplicates:
+                chunk["duplicates"] = duplicates[i]
+            results.append(chunk)
+
+    metrics.RERANK_CHUNKS.inc(len(picked), outcome="kept")
+    metrics.RERANK_CHUNKS.inc(sum(len(d) for d in duplicates.values()), outcome="duplicate")
+    metrics.RERANK_CHUNKS.inc(cut, outcome="cut")
+    return results
@@ -0,0 +1,414 @@
+"""
+Deterministic pre-extraction: compiled regexes and keyword dictionaries that pull
+amounts, dates, addresses, identifiers, the issuer and a coarse document class out of
+plain text in about half a millisecond per page.
+
+extraction.classify_and_extract runs this before the LLM. Short bills, invoices and
+receipts that score at least RULE_EXTRACTION_SKIP_CONFIDENCE are stored from the rules
+alone; documents above RULE_EXTRACTION_SHRINK_CONFIDENCE get an LLM call that no longer
+asks for the fields the rules already found.
+"""
+import re
+from bisect import bisect_left
+from datetime import date
+from typing import Dict, Any, List, Optional, Tuple
+
+MONTHS = {
+	"jan": 1, "feb": 2, "mar": 3, "apr": 4, "may": 5, "jun": 6,
+	"jul": 7, "aug": 8, "sep": 9, "oct": 10, "nov": 11, "dec": 12
+}
+MONTH_PATTERN = r"(?:jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|may|june?|july?|aug(?:ust)?|sep(?:t(?:ember)?)?|oct(?:ober)?|nov(?:ember)?|dec(?:ember)?)"
+
+# Tried in order; numeric dates are read US-style (month first)
+DATE_PATTERNS = [
+	re.compile(rf"\b(?P<month>{MONTH_PATTERN})\.?\s+(?P<day>\d{{1,2}})(?:st|nd|rd|th)?,?\s+(?P<year>(?:19|20)\d{{2}})\b", re.IGNORECASE),
+	re.compile(rf"\b(?P<day>\d{{1,2}})(?:st|nd|rd|th)?\s+(?P<month>{MONTH_PATTERN})\.?,?\s+(?P<year>(?:19|20)\d{{2}})\b", re.IGNORECASE),
+	re.compile(r"\b(?P<year>(?:19|20)\d{2})-(?P<month>\d{1,2})-(?P<day>\d{1,2})\b"),
+	re.compile(r"\b(?P<month>\d{1,2})/(?P<day>\d{1,2})/(?P<year>(?:19|20)?\d{2})\b"),
+]
+
+NUMBER = r"\d{1,3}(?:,\d{3})+(?:\.\d{1,2})?|\d+(?:\.\d{1,2})?"
+AMOUNT_PATTERNS = [
+	re.compile(rf"(?P<currency>[$€£]|\b(?:USD|EUR|GBP|CAD|AUD)\s?)(?P<number>{NUMBER})\b"),
+	re.compile(rf"\b(?P<number>{NUMBER})\s?(?P<currency>USD|EUR|GBP|CAD|AUD|dollars)\b", re.IGNORECASE),
+]
+CURRENCIES = {"$": "USD", "€": "EUR", "£": "GBP", "dollars": "USD"}
+
+ID_TYPES = {
+	"invoice": "Invoice Number", "account": "Account Number", "acct": "Account Number",
+	"policy": "Policy Number", "member": "Member ID", "customer": "Customer Number",
+	"order": "Order Number", "receipt": "Receipt Number", "reference": "Reference Number",
+	"ref": "Reference Number", "claim": "Claim Number", "case": "Case Number",
+	"confirmation": "Confirmation Number", "patient": "Patient ID", "tracking": "Tracking Number",
+	"transaction": "Transaction ID"
+}
+ID_PATTERN = re.compile(
+	rf"\b(?P<label>{'|'.join(ID_TYPES)})\.?\s*(?:number|num\.?|no\.?|id|#)\s*[:#]?\s*"
+	r"(?P<value>(?=[A-Z0-9\-/]*\d)[A-Z0-9][A-Z0-9\-/]{2,})",
+	re.IGNORECASE
+)
+# USCIS receipt numbers: three-letter service center code and ten digits
+USCIS_RECEIPT_PATTERN = re.compile(r"\b(?:EAC|WAC|LIN|SRC|NBC|MSC|IOE|YSC)\d{10}\b")
+
+STREET_SUFFIXES = r"(?:street|st|avenue|ave|road|rd|lane|ln|boulevard|blvd|drive|dr|court|ct|way|place|pl|parkway|pkwy|highway|hwy|circle|cir|terrace|ter)"
+STREET_PATTERN = re.compile(rf"\b\d{{1,6}}\s+(?:[A-Za-z0-9.'-]+\s+){{0,4}}{STREET_SUFFIXES}\.?(?:,?\s+(?:suite|ste|apt|unit|#)\.?\s*[\w-]+)?", re.IGNORECASE)
+CITY_LINE_PATTERN = re.compile(r"^[A-Za-z][A-Za-z .'-]+,\s*[A-Z]{2}\s+\d{5}(?:-\d{4})?$")
+INLINE_CITY_PATTERN = re.compile(r"^,?\s*[A-Za-z][A-Za-z .'-]+,\s*[A-Z]{2}\s+\d{5}(?:-\d{4})?")
+
+# Keyword evidence per classifier class (same vocabulary as extraction.DOC_CLASSES)
+CLASS_KEYWORDS = {
+	"bill": ["invoice", "amount due", "balance due", "total due", "bill to", "billing period", "statement date",
+			 "account number", "receipt", "subtotal", "payment due", "due date", "kwh", "utility", "service period"],
+	"rent": ["lease", "landlord", "tenant", "monthly rent", "security deposit", "premises"],
+	"insurance": ["policy number", "premium", "insured", "coverage", "deductible", "policyholder", "claim number"],
+	"IRS": ["internal revenue service", "irs", "form 1040", "w-2", "1099", "tax year", "taxpayer"],
+	"immigration": ["uscis", "visa", "green card", "i-797", "receipt notice", "petition", "beneficiary", "a-number"],
+	"medical": ["patient", "diagnosis", "physician", "clinic", "hospital", "prescription", "cpt", "explanation of benefits"],
+}
+KEYWORD_CLASSES: Dict[str, List[str]] = {}
+for _cls, _keywords in CLASS_KEYWORDS.items():
+	for _keyword in _keywords:
+		KEYWORD_CLASSES.setdefault(_keyword.lower(), []).append(_cls)
+# One pass over the lowercased text for every class (longest keywords first)
+KEYWORD_PATTERN = re.compile(r"\b(?:" + "|".join(re.escape(k) for k in sorted(KEYWORD_CLASSES, key=len, reverse=True)) + r")\b")
+# Distinct keywords needed for full class evidence
+CLASS_EVIDENCE_HITS = 3
+CLASS_CATEGORIES = {"bill": "Personal Finance", "rent": "Housing", "insurance": "Insurance", "IRS": "Taxes", "immigration": "Immigration", "medical": "Healthcare"}
+
+# Document titles, most specific first
+TITLE_TYPES = [("utility bill", "Utility Bill"), ("invoice", "Invoice"), ("receipt", "Receipt"), ("statement", "Statement"), ("bill", "Bill")]
+TITLE_WORDS = {"invoice", "receipt", "statement", "bill", "tax", "utility", "original", "copy", "page", "of"}
+ORG_WORDS = {
+	"inc", "llc", "ltd", "corp", "corporation", "co", "company", "services", "service", "bank", "insurance", "utilities",
+	"energy", "electric", "water", "gas", "telecom", "wireless", "hospital", "clinic", "medical", "university", "group",
+	"partners", "associates", "store", "market", "pharmacy"
+}
+# Lowercase words allowed inside an organization name ("Bank of America")
+NAME_CONNECTORS = {"of", "and", "the", "for", "de", "&"}
+ISSUER_LABEL_PATTERN = re.compile(r"^(?:from|issued by|vendor|seller|merchant|payee|remit to|billed by)\s*:\s*(?P<name>.+)$", re.IGNORECASE | re.MULTILINE)
+BILL_TO_PATTERN = re.compile(r"^(?:bill(?:ed)? to|sold to|customer)\s*:\s*(?P<name>.*)$", re.IGNORECASE | re.MULTILINE)
+
+TOTAL_WORDS = ("total", "amount due", "balance due", "amount payable", "payment due")
+DUE_WORDS = ("due", "deadline", "pay by", "payable by", "expires", "expiration")
+
+# Characters looked back from a value for its label
+LABEL_WINDOW = 120
+
+# Confidence weights for bill-like documents; they add up to 1
+WEIGHTS = {"class": 0.3, "total": 0.25, "issuer": 0.15, "date": 0.15, "identifier": 0.15}
+# Rule-only extraction is offered for these classes (the rest need the model's judgement)
+RULE_ONLY_CLASSES = {"bill"}
+# Fields the rules supply, so a shrunk LLM call leaves them out
+RULE_FIELDS = ["amounts", "dates", "addresses"]
+
+def _label_before(text: str, start: int) -> Optional[str]:
+	"""
+	Text leading up to a match on its line (or the line above, when the value stands
+	alone the way table layouts put it), cut to its last clause and last few words.
+	Looks back at most LABEL_WINDOW characters, so long lines stay linear.
+	"""
+	window = max(0, start - LABEL_WINDOW)
+	line_start = max(text.rfind("\n", window, start) + 1, window)
+	before = text[line_start:start].strip(" \t-*•")
+	if not before and line_start > window:
+		prev_end = line_start - 1
+		prev_start = text.rfind("\n", max(0, prev_end - LABEL_WINDOW), prev_end) + 1
+		previous = text[prev_start:prev_end].strip(" \t-*•")
+		if not previous or len(previous) > 80 or any(p.search(previous) for p in AMOUNT_PATTERNS):
+			return None
+		before = previous
+	before = re.split(r"[.;!?]\s", before)[-1]
+	words = before.strip(" :#-(").split()
+	label = " ".join(words[-8:]).strip(" :#-(")
+	return label or None
+
+def _claim(taken: List[Tuple[int, int]], start: int, end: int) -> bool:
+	"""
+	Record [start, end) in the sorted span list unless it overlaps a span already there
+	(an earlier, more specific pattern matched the same text).
+	"""
+	i = bisect_left(taken, (start, end))
+	if (i > 0 and taken[i - 1][1] > start) or (i < len(taken) and taken[i][0] < end):
+		return False
+	taken.insert(i, (start, end))
+	return True
+
+def _normalize_year(year: str) -> int:
+	y = int(year)
+	return y + 2000 if y < 100 else y
+
+def find_dates(text: str) -> List[Dict[str, Any]]:
+	"""
+	[{"label", "date": "YYYY-MM-DD"}] in order of appearance, one per distinct (label, date).
+	"""
+	found: List[Tuple[int, Dict[str, Any]]] = []
+	taken: List[Tuple[int, int]] = []
+	for pattern in DATE_PATTERNS:
+		for m in pattern.finditer(text):
+			month = m.group("month")
+			month = int(month) if month.isdigit() else MONTHS[month[:3].lower()]
+			try:
+				value = date(_normalize_year(m.group("year")), month, int(m.group("day")))
+			except ValueError:
+				continue
+			if not _claim(taken, m.start(), m.end()):
+				continue
+			found.append((m.start(), {"label": _label_before(text, m.start()) or "Date", "date": value.isoformat()}))
+	seen, dates = set(), []
+	for _, d in sorted(found, key=lambda x: x[0]):
+		key = (d["label"].lower(), d["date"])
+		if key not in seen:
+			seen.add(key)
+			dates.append(d)
+	return dates
+
+def find_amounts(text: str) -> List[Dict[str, Any]]:
+	"""
+	[{"label", "value", "currency"}] with the document total (if labelled) first, then in
+	order of appearance; one per distinct (label, value, currency).
+	"""
+	found: List[Tuple[int, Dict[str, Any]]] = []
+	taken: List[Tuple[int, int]] = []
+	for pattern in AMOUNT_PATTERNS:
+		for m in pattern.finditer(text):
+			if not _claim(taken, m.start(), m.end()):
+				continue
+			currency = m.group("currency").strip()
+			found.append((m.start(), {
+				"label": _label_before(text, m.start()),
+				"value": float(m.group("number").replace(",", "")),
+				"currency": CURRENCIES.get(currency.lower() if currency.isalpha() else currency, currency.upper())
+			}))
+	seen, amounts = set(), []
+	for _, a in sorted(found, key=lambda x: x[0]):
+		key = ((a["label"] or "").lower(), a["value"], a["currency"])
+		if key not in seen:
+			seen.add(key)
+			amounts.append(a)
+	total = next((a for a in reversed(amounts) if is_total(a)), None)
+	if total is not None:
+		amounts.remove(total)
+		amounts.insert(0, total)
+	return amounts
+
+def is_total(amount: Dict[str, Any]) -> bool:
+	label = (amount.get("label") or "").lower()
+	return any(w in label for w in TOTAL_WORDS) and "subtotal" not in label
+
+def find_identifiers(text: str) -> List[Dict[str, Any]]:
+	"""
+	Labelled reference numbers as custom entities: [{"name": value, "type", "description"}].
+	"""
+	ids, seen = [], set()
+	for m in ID_PATTERN.finditer(text):
+		value = m.group("value").rstrip(".-/")
+		if value.upper() not in seen:
+			seen.add(value.upper())
+			ids.append({"name": value, "type": ID_TYPES[m.group("label").lower()], "description": None})
+	for m in USCIS_RECEIPT_PATTERN.finditer(text):
+		if m.group(0) not in seen:
+			seen.add(m.group(0))
+			ids.append({"name": m.group(0), "type": "Receipt Number", "description": None})
+	return ids
+
+def find_addresses(text: str) -> List[Dict[str, Any]]:
+	"""
+	US street addresses, joined with a "City, ST 12345" that follows on the same or next line.
+	Only streets completed by such a city line are kept, which keeps precision high.
+	"""
+	addresses, seen = [], set()
+	lines = text.split("\n")
+	line_offset = 0
+	for i, line in enumerate(lines):
+		line_offset += len(lines[i - 1]) + 1 if i else 0
+		for m in STREET_PATTERN.finditer(line):
+			street = m.group(0).strip()
+			rest = line[m.end():]
+			city = None
+			inline = INLINE_CITY_PATTERN.match(rest)
+			if inline:
+				city = inline.group(0).strip(" ,")
+			elif not rest.strip() and i + 1 < len(lines) and CITY_LINE_PATTERN.match(lines[i + 1].strip()):
+				city = lines[i + 1].strip()
+			if not city:
+				continue
+			address = f"{street}, {city}"
+			if address.lower() not in seen:
+				seen.add(address.lower())
+				label = _label_before(text, line_offset + m.start())
+				addresses.append({"label": label if label and label.endswith(("To", "to", "Address", "address")) else None, "address": address})
+	return addresses
+
+def classify(text: str) -> Tuple[str, float]:
+	"""
+	(class, evidence 0-1) from distinct keyword hits; "other" when no class has two.
+	"""
+	hits: Dict[str, set] = {}
+	for keyword in set(KEYWORD_PATTERN.findall(text.lower())):
+		for cls in KEYWORD_CLASSES[keyword]:
+			hits.setdefault(cls, set()).add(keyword)
+	best, best_hits = "other", 0
+	for cls in CLASS_KEYWORDS:
+		if len(hits.get(cls, ())) > best_hits:
+			best, best_hits = cls, len(hits[cls])
+	if best_hits < 2:
+		return "other", 0.0
+	return best, min(1.0, best_hits / CLASS_EVIDENCE_HITS)
+
+def _is_title(line: str) -> bool:
+	words = re.findall(r"[a-z]+", line.lower())
+	return bool(words) and all(w in TITLE_WORDS for w in words)
+
+def find_issuer(text: str) -> Optional[str]:
+	"""
+	An explicit "From:/Vendor:/Remit to:" line, else the first header line (before
+	"Bill To:") that reads like an organization name.
+	"""
+	m = ISSUER_LABEL_PATTERN.search(text)
+	if m and m.group("name").strip():
+		return m.group("name").strip()
+	for line in [l.strip() for l in text.split("\n") if l.strip()][:6]:
+		if BILL_TO_PATTERN.match(line):
+			break
+		words = line.split()
+		if _is_title(line) or ":" in line or len(words) > 6 or any(ch.isdigit() for ch in line):
+			continue
+		# Names are capitalized throughout; a sentence like "Services rendered in May" is not one
+		if not all(w[:1].isupper() or not w[:1].isalpha() or w in NAME_CONNECTORS for w in words):
+			continue
+		# All-caps headers are usually document titles ("LEASE AGREEMENT"), not names
+		if any(w.lower().strip(".,") in ORG_WORDS for w in words) or (len(words) > 1 and not line.isupper()):
+			return line
+	return None
+
+def find_billed_to(text: str) -> Optional[str]:
+	m = BILL_TO_PATTERN.search(text)
+	if not m:
+		return None
+	if m.group("name").strip():
+		return m.group("name").strip()
+	following = text[m.end():].lstrip("\n").split("\n", 1)[0].strip()
+	return following if following and ":" not in following else None
+
+def find_doc_type(text: str, doc_class: str) -> str:
+	head = text[:300].lower()
+	for keyword, title in TITLE_TYPES:
+		if re.search(rf"\b{keyword}\b", head):
+			return title
+	return doc_class.capitalize() if doc_class != "other" else "Document"
+
+def due_date(dates: List[Dict[str, Any]]) -> Optional[str]:
+	return next((d["date"] for d in dates if any(w in d["label"].lower() for w in DUE_WORDS)), None)
+
+def pre_extract(text: str) -> Dict[str, Any]:
+	"""
+	All rule-based fields for a document plus a confidence in [0, 1] that they are
+	enough to stand in for the LLM (see WEIGHTS). Classes outside RULE_ONLY_CLASSES
+	score no class evidence, so only bill-like documents can reach the skip threshold.
+	"""
+	doc_class, evidence = classify(text)
+	amounts = find_amounts(text)
+	dates = find_dates(text)
+	identifiers = find_identifiers(text)
+	issuer = find_issuer(text)
+	signals = {
+		"class": evidence if doc_class in RULE_ONLY_CLASSES else 0.0,
+		"total": 1.0 if amounts and is_total(amounts[0]) else 0.0,
+		"issuer": 1.0 if issuer else 0.0,
+		"date": 1.0 if dates else 0.0,
+		"identifier": 1.0 if identifiers else 0.0,
+	}
+	return {
+		"document_class": doc_class,
+		"doc_type": find_doc_type(text, doc_class),
+		"issuer": issuer,
+		"billed_to": find_billed_to(text),
+		"amounts": amounts,
+		"dates": dates,
+		"addresses": find_addresses(text),
+		"identifiers": identifiers,
+		"due_date": due_date(dates),
+		"confidence": round(sum(WEIGHTS[k] * v for k, v in signals.items()), 4),
+	}
+
+def _severity(due: Optional[str], today: Optional[date] = None) -> str:
+	if not due:
+		return "low"
+	days = (date.fromisoformat(due) - (today or date.today())).days
+	return "high" if days <= 7 else "medium" if days <= 30 else "low"
+
+def _format_amount(amount: Dict[str, Any]) -> str:
+	value = f"{amount['value']:,.2f}"
+	return f"${value}" if amount.get("currency") == "USD" else f"{value} {amount.get('currency') or ''}".strip()
+
+def to_extraction(pre: Dict[str, Any]) -> Dict[str, Any]:
+	"""
+	A complete extraction record (extraction.SINGLE_PASS_SCHEMA) built from rules alone,
+	for documents confident enough to skip the LLM. Fields the rules did not find are left
+	out of the summary, action and entity strings rather than written as None.
+	"""
+	doc_type, issuer, billed_to, due = pre["doc_type"], pre["issuer"], pre["billed_to"], pre["due_date"]
+	total = pre["amounts"][0] if pre["amounts"] and is_total(pre["amounts"][0]) else None
+	reference = pre["identifiers"][0]["name"] if pre["identifiers"] else None
+
+	subject = f"{doc_type}{' ' + reference if reference else ''}{' from ' + issuer if issuer else ''}"
+	summary = subject
+	if billed_to:
+		summary += f" to {billed_to}"
+	if total:
+		summary += f" for {_format_amount(total)}"
+	if due:
+		summary += f", due {due}"
+	bullets = [f"{a['label'] or 'Amount'}: {_format_amount(a)}" for a in pre["amounts"]]
+	bullets += [f"{d['label']}: {d['date']}" for d in pre["dates"]]
+	bullets += [f"{i['type']}: {i['name']}" for i in pre["identifiers"]]
+
+	organizations = [{"name": issuer, "type": "Issuer", "description": None}] if issuer else []
+	relationships = []
+	if billed_to:
+		organizations.append({"name": billed_to, "type": "Customer", "description": None})
+		if issuer:
+			relationships.append({"source": issuer, "target": billed_to, "relation": "BILLS", "description": reference})
+	deadlines, actions = [], []
+	if due:
+		action = f"Pay {doc_type.lower()}{' ' + reference if reference else ''}{' from ' + issuer if issuer else ''}"
+		deadlines.append({"action": action, "due_date": due, "severity": _severity(due)})
+		actions.append(f"{action}{' (' + _format_amount(total) + ')' if total else ''} by {due}")
+
+	return {
+		"document_class": pre["document_class"],
+		"doc_type": doc_type,
+		"issuer": issuer,
+		"category": CLASS_CATEGORIES.get(pre["document_class"]),
+		"tags": [pre["document_class"], doc_type.lower()],
+		"priority_score": {"high": 8, "medium": 6, "low": 4}[_severity(due)] if due else 3,
+		"people": [],
+		"organizations": organizations,
+		"roles": [],
+		"locations": [],
+		"custom_entities": list(pre["identifiers"]),
+		"relationships": relationships,
+		"addresses": pre["addresses"],
+		"amounts": pre["amounts"],
+		"dates": pre["dates"],
+		"deadlines": deadlines,
+		"detailed_summary": summary + ".",
+		"summary_bullets": bullets,
+		"recommended_actions": actions,
+		"extraction_method": "rules",
+	}
+
+def merge_into(extract: Dict[str, Any], pre: Dict[str, Any]) -> Dict[str, Any]:
+	"""
+	Set the fields a shrunk LLM call left out (RULE_FIELDS) from the rules, add the
+	identifiers as custom entities, and fall back to the rule issuer.
+	"""
+	for field in RULE_FIELDS:
+		if pre[field] or not extract.get(field):
+			extract[field] = pre[field]
+	names = {(e.get("name") or "").upper() for e in extract.get("custom_entities") or [] if isinstance(e, dict)}
+	extract["custom_entities"] = (extract.get("custom_entities") or []) + [i for i in pre["identifiers"] if i["name"].upper() not in names]
+	if not extract.get("issuer") and pre["issuer"]:
+		extract["issuer"] = pre["issuer"]
+	extract["extraction_method"] = "rules+llm"
+	return extract
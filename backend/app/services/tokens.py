@@ -0,0 +1,48 @@
+import logging
+
+# Rough chars-per-token ratio for English text, used when tiktoken is unavailable
+CHARS_PER_TOKEN = 4
+
+_encoding = None
+_encoding_loaded = False
+
+def _get_encoding():
+	"""
+	Lazily load the cl100k_base tokenizer. Returns None if tiktoken is not installed
+	or the encoding cannot be loaded (e.g. offline without a cached BPE file).
+	"""
+	global _encoding, _encoding_loaded
+	if _encoding_loaded:
+		return _encoding
+	_encoding_loaded = True
+	try:
+		import tiktoken
+		_encoding = tiktoken.get_encoding("cl100k_base")
+	except ImportError:
+		logging.warning("tiktoken not installed; falling back to character-based token estimates.")
+	except Exception as e:
+		logging.warning(f"tiktoken encoding unavailable ({e}); falling back to character-based token estimates.")
+	return _encoding
+
+def count_tokens(text: str) -> int:
+	"""
+	Count tokens in text with the local tokenizer, or estimate from length.
+	"""
+	if not text:
+		return 0
+	enc = _get_encoding()
+	if enc is not None:
+		return len(enc.encode(text, disallowed_special=()))
+	return max(1, len(text) // CHARS_PER_TOKEN)
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+	"""
+	Truncate text so that it fits within max_tokens.
+	"""
+	enc = _get_encoding()
+	if enc is not None:
+		ids = enc.encode(text, disallowed_special=())
+		if len(ids) <= max_tokens:
+			return text
+		return enc.decode(ids[:max_tokens])
+	return text[:max_tokens * CHARS_PER_TOKEN]
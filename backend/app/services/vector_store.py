@@ -0,0 +1,51 @@
+# Vector store interface
+# VECTOR_BACKEND selects the implementation: 'pinecone' (pinecone_store) or 'local' (local_vector_store).
+# Both expose the same functions; vectors are (id, values, metadata) and query results are
+# Pinecone-style matches with id, score and metadata. Writes return per-batch results
+# {"ids", "ok", "attempts", "error"} rather than raising, so callers can tell which vectors failed.
+
+import importlib
+import threading
+from typing import Dict, Any, Optional, List
+from app.config import VECTOR_BACKEND
+
+BACKENDS = {
+	"pinecone": "app.services.pinecone_store",
+	"local": "app.services.local_vector_store",
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+def get_backend():
+	global _backend
+	with _backend_lock:
+		if _backend is None:
+			if VECTOR_BACKEND not in BACKENDS:
+				raise ValueError(f"Unknown VECTOR_BACKEND '{VECTOR_BACKEND}' (expected one of: {', '.join(BACKENDS)})")
+			_backend = importlib.import_module(BACKENDS[VECTOR_BACKEND])
+		return _backend
+
+def upsert_vectors(vectors: list) -> List[Dict[str, Any]]:
+	return get_backend().upsert_vectors(vectors)
+
+def delete_vectors(ids: list) -> List[Dict[str, Any]]:
+	return get_backend().delete_vectors(ids)
+
+def delete_vectors_by_filter(filter: Dict[str, Any]) -> Dict[str, Any]:
+	return get_backend().delete_vectors_by_filter(filter)
+
+def delete_vectors_by_document(document_id: str) -> Dict[str, Any]:
+	return get_backend().delete_vectors_by_document(document_id)
+
+def update_metadata(ids: list, metadata: Dict[str, Any]) -> List[Dict[str, Any]]:
+	return get_backend().update_metadata(ids, metadata)
+
+def query_similar_vectors(embedding: list, top_k: int = 10, document_id: str = None, filter: Optional[Dict[str, Any]] = None) -> List[Any]:
+	return get_backend().query_similar_vectors(embedding, top_k=top_k, document_id=document_id, filter=filter)
+
+def failed_ids(results: List[Dict[str, Any]]) -> List[str]:
+	"""
+	Ids from the batches of a write that did not succeed.
+	"""
+	return [i for r in results if not r["ok"] for i in r["ids"]]
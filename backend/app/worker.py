@@ -0,0 +1,173 @@
+"""
+Standalone document processing worker.
+
+Usage:
+    python -m app.worker                 # WORKER_PROCESSES processes
+    python -m app.worker --processes 4
+
+Each process claims jobs from the ProcessingJob table under a lease, runs the
+processing pipeline and renews the lease while it works. Jobs whose worker dies
+are requeued with backoff once the lease expires, and fail after max_attempts.
+"""
+import argparse
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import time
+import traceback
+from sqlmodel import Session
+from app.config import WORKER_PROCESSES, WORKER_POLL_SECONDS, JOB_LEASE_SECONDS, METRICS_SNAPSHOT_MAX_AGE_SECONDS
+from app.db import engine, init_db
+from app.models import Document
+from app.services import jobs, metrics
+from app.services.processing import process_document, mark_document_error
+
+_stop = threading.Event()
+
+class LeaseLost(Exception):
+    """
+    Raised from the stage callback once another worker may have reclaimed the job.
+    """
+
+def _handle_signal(signum, frame):
+    _stop.set()
+
+def _set_document_status(document_id: str, status: str, error_message=None):
+    with Session(engine) as session:
+        doc = session.get(Document, document_id)
+        if doc:
+            doc.status = status
+            doc.error_message = error_message
+            session.add(doc)
+            session.commit()
+
+def _write_metrics():
+    # The API process serves /api/metrics; hand it this process's counters
+    try:
+        metrics.write_snapshot()
+    except Exception as e:
+        print(f"Failed to write metrics snapshot: {e}")
+
+def _run_job(job, worker_id: str):
+    state = {"stage": None, "progress": 0.0}
+    lock = threading.Lock()
+    done = threading.Event()
+    lost = threading.Event()
+
+    def beat():
+        with lock:
+            stage, progress = state["stage"], state["progress"]
+        with Session(engine) as session:
+            if not jobs.heartbeat(session, job.id, worker_id, stage=stage, progress=progress):
+                lost.set()
+
+    def on_stage(stage: str, progress: float):
+        with lock:
+            state["stage"], state["progress"] = stage, progress
+        beat()
+        # Stop writing before the worker that reclaimed the job does the same work
+        if lost.is_set():
+            raise LeaseLost(f"lost lease on job {job.id}")
+
+    def keep_alive():
+        while not done.wait(JOB_LEASE_SECONDS / 3) and not lost.is_set():
+            beat()
+            _write_metrics()
+
+    renewer = threading.Thread(target=keep_alive, daemon=True)
+    renewer.start()
+    try:
+        _set_document_status(job.document_id, "processing")
+        process_document(job.document_id, on_stage=on_stage, force=job.force)
+        done.set()
+        if lost.is_set():
+            raise LeaseLost(f"lost lease on job {job.id}")
+        with Session(engine) as session:
+            jobs.complete(session, job.id, worker_id)
+        print(f"Worker {worker_id}: job {job.id} for {job.document_id} succeeded")
+    except Exception as e:
+        done.set()
+        if lost.is_set():
+            # The job belongs to whoever reclaimed it; leave its status and the document alone
+            print(f"Worker {worker_id}: abandoned job {job.id} for {job.document_id}: {e}")
+            return
+        traceback.print_exc()
+        with Session(engine) as session:
+            will_retry = jobs.fail(session, job, worker_id, str(e))
+        if will_retry:
+            _set_document_status(job.document_id, "processing", f"Attempt {job.attempts} failed, retrying: {e}")
+        else:
+            mark_document_error(job.document_id, str(e))
+        print(f"Worker {worker_id}: job {job.id} for {job.document_id} failed (retry={will_retry}): {e}")
+    finally:
+        done.set()
+        _write_metrics()
+
+def run_worker(poll_seconds: float = WORKER_POLL_SECONDS):
+    """
+    Claim and run jobs until SIGINT/SIGTERM.
+    """
+    # Connections inherited from the parent process must not be shared
+    engine.dispose()
+    signal.signal(signal.SIGTERM, _handle_signal)
+    signal.signal(signal.SIGINT, _handle_signal)
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    print(f"Worker {worker_id} started")
+    try:
+        _poll(worker_id, poll_seconds)
+    finally:
+        metrics.remove_snapshot()
+    print(f"Worker {worker_id} stopped")
+
+def _poll(worker_id: str, poll_seconds: float):
+    snapshot_written = None
+    while not _stop.is_set():
+        try:
+            with Session(engine) as session:
+                for lost in jobs.release_expired(session):
+                    mark_document_error(lost.document_id, lost.last_error)
+                    print(f"Worker {worker_id}: job {lost.id} for {lost.document_id} failed: {lost.last_error}")
+                job = jobs.claim_next(session, worker_id)
+        except Exception as e:
+            print(f"Worker {worker_id}: failed to claim job: {e}")
+            job = None
+
+        if job is None:
+            # Keep an idle worker's snapshot fresh so /api/metrics does not drop it as stale
+            if snapshot_written is None or time.monotonic() - snapshot_written > METRICS_SNAPSHOT_MAX_AGE_SECONDS / 3:
+                _write_metrics()
+                snapshot_written = time.monotonic()
+            _stop.wait(poll_seconds)
+            continue
+        _run_job(job, worker_id)
+        snapshot_written = time.monotonic()
+
+def main():
+    parser = argparse.ArgumentParser(description="PaperTrail AI document processing worker")
+    parser.add_argument("--processes", type=int, default=WORKER_PROCESSES, help="Number of worker processes")
+    parser.add_argument("--poll-interval", type=float, default=WORKER_POLL_SECONDS, help="Seconds to wait when the queue is empty")
+    args = parser.parse_args()
+
+    init_db()
+    if args.processes <= 1:
+        run_worker(args.poll_interval)
+        return
+
+    procs = [multiprocessing.Process(target=run_worker, args=(args.poll_interval,)) for _ in range(args.processes)]
+    for p in procs:
+        p.start()
+
+    def shutdown(signum, frame):
+        for p in procs:
+            if p.is_alive():
+                p.terminate()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    for p in procs:
+        p.join()
+
+if __name__ == "__main__":
+    main()
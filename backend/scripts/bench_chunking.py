@@ -0,0 +1,83 @@
+"""
+Compare the legacy character chunker with the token-aware chunker.
+
+Usage (from the backend directory):
+    python scripts/bench_chunking.py                       # demo_documents/*.pdf
+    python scripts/bench_chunking.py path/to/a.pdf b.pdf
+    python scripts/bench_chunking.py --synthetic-pages 500 # add a generated long document
+
+Reports chunks per document, average tokens per chunk, total tokens sent for
+embedding (overlap included) and chunking throughput in chars/sec.
+"""
+import argparse
+import glob
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services import chunking, pdf
+from app.services.tokens import count_tokens
+
+DEMO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../demo_documents")
+
+def synthetic_pages(n: int):
+    rnd = random.Random(42)
+    words = "payment invoice tenant landlord deadline agreement party notice renewal amount services term".split()
+    pages = []
+    for i in range(n):
+        # Mix of near-empty pages (cover sheets, signature pages) and dense text
+        sentences = rnd.choice([1, 2, 25, 40])
+        text = " ".join(
+            " ".join(rnd.choice(words) for _ in range(rnd.randint(8, 25))).capitalize() + "."
+            for _ in range(sentences)
+        )
+        pages.append({"page_number": i + 1, "text": text})
+    return pages
+
+def run(name, pages, strategy, repeat):
+    chars = sum(len(p["text"]) for p in pages)
+    started = time.perf_counter()
+    for _ in range(repeat):
+        chunks = list(chunking.iter_chunks(pages, "bench", name, strategy=strategy))
+    elapsed = (time.perf_counter() - started) / repeat
+    tokens = [count_tokens(c["text"]) for c in chunks]
+    return {
+        "chunks": len(chunks),
+        "avg_tokens": sum(tokens) / len(tokens) if tokens else 0,
+        "embed_tokens": sum(tokens),
+        "chars_per_sec": chars / elapsed if elapsed else float("inf"),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="*", help="PDF files (default: demo_documents/*.pdf)")
+    parser.add_argument("--synthetic-pages", type=int, default=0, help="Also benchmark a generated document with this many pages")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    docs = []
+    for path in args.paths or sorted(glob.glob(os.path.join(DEMO_DIR, "*.pdf"))):
+        docs.append((os.path.basename(path), pdf.extract_pdf_text_per_page(path)))
+    if args.synthetic_pages:
+        docs.append((f"synthetic-{args.synthetic_pages}p", synthetic_pages(args.synthetic_pages)))
+
+    header = f"{'document':<40} {'strategy':<8} {'chunks':>7} {'avg tok':>8} {'embed tok':>10} {'chars/sec':>12}"
+    print(header)
+    print("-" * len(header))
+    totals = {"chars": [0, 0], "tokens": [0, 0]}
+    for name, pages in docs:
+        for strategy in ("chars", "tokens"):
+            r = run(name, pages, strategy, args.repeat)
+            totals[strategy][0] += r["chunks"]
+            totals[strategy][1] += r["embed_tokens"]
+            print(f"{name[:40]:<40} {strategy:<8} {r['chunks']:>7} {r['avg_tokens']:>8.1f} {r['embed_tokens']:>10} {r['chars_per_sec']:>12,.0f}")
+    print("-" * len(header))
+    for strategy in ("chars", "tokens"):
+        n_chunks, n_tokens = totals[strategy]
+        print(f"{'TOTAL':<40} {strategy:<8} {n_chunks:>7} {'':>8} {n_tokens:>10}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Measure interactive chat latency while background extraction saturates the OpenAI quota.
+
+Usage (from the backend directory):
+    # 1. A fake OpenAI API that answers 429 + Retry-After beyond 120 requests per minute
+    python scripts/load_test_chat.py mock --port 8901 --latency 0.2 --rpm 120
+
+    # 2. Without local scheduling: every call races for the quota
+    OPENAI_BASE_URL=http://127.0.0.1:8901/v1 OPENAI_API_KEY=test python scripts/bench_llm_priorities.py
+
+    # 3. With the scheduler's buckets matching the mock's limit
+    OPENAI_BASE_URL=http://127.0.0.1:8901/v1 OPENAI_API_KEY=test OPENAI_RATE_LIMITS=gpt-4o=120:10000000 \\
+        python scripts/bench_llm_priorities.py
+
+Background threads call the model as fast as they can under the "extract" stage while
+an interactive loop sends one "chat" request every --interval seconds. Reports chat
+latency percentiles and failures, background throughput and the 429s received.
+The response cache is disabled and the rate-limit state goes to a temporary file.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ["LLM_CACHE_MODE"] = "off"
+os.environ.setdefault("OPENAI_RATE_LIMIT_STATE", os.path.join(tempfile.mkdtemp(), "openai.sqlite"))
+
+from app.services import llm, metrics
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+def request(text: str):
+    # Unique prompts, so nothing could be served from a cache
+    return {"model": "gpt-4o", "messages": [{"role": "user", "content": f"{text} {uuid.uuid4().hex}"}], "max_tokens": 50}
+
+def background(stop: threading.Event, done: list, failed: list):
+    while not stop.is_set():
+        try:
+            llm.chat_completion("extract", **request("Extract the fields of this document."))
+            done.append(1)
+        except Exception:
+            failed.append(1)
+
+async def interactive(seconds: float, interval: float):
+    latencies, errors = [], []
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        try:
+            await llm.achat_completion("chat", **request("What is the monthly rent?"))
+            latencies.append(time.perf_counter() - started)
+        except Exception as e:
+            errors.append(e)
+        await asyncio.sleep(max(0.0, interval - (time.perf_counter() - started)))
+    await llm.aclose()
+    return latencies, errors
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=30)
+    parser.add_argument("--threads", type=int, default=8, help="Background extraction threads")
+    parser.add_argument("--interval", type=float, default=2.0, help="Seconds between chat requests")
+    args = parser.parse_args()
+
+    stop = threading.Event()
+    done, failed = [], []
+    threads = [threading.Thread(target=background, args=(stop, done, failed), daemon=True) for _ in range(args.threads)]
+    for t in threads:
+        t.start()
+    # Let the background load drain the quota first
+    time.sleep(2)
+    latencies, errors = asyncio.run(interactive(args.seconds, args.interval))
+    stop.set()
+    for t in threads:
+        t.join()
+
+    limited = metrics.LLM_RATE_LIMITED.snapshot()
+    print(f"OPENAI_RATE_LIMITS={os.getenv('OPENAI_RATE_LIMITS', '') or '(none)'}")
+    print(f"Chat        {len(latencies)} ok, {len(errors)} failed  p50 {percentile(latencies, 50):.2f}s  p95 {percentile(latencies, 95):.2f}s  max {max(latencies, default=0):.2f}s")
+    print(f"Background  {len(done)} ok, {len(failed)} failed  ({len(done) / (args.seconds + 2):.1f}/s)")
+    print(f"429s        " + (", ".join(f"{k}: {int(v)}" for k, v in sorted(limited.items())) or "none"))
+    for e in errors[:3]:
+        print(f"  chat error: {type(e).__name__}: {e}")
+
+if __name__ == "__main__":
+    main()
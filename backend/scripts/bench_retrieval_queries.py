@@ -0,0 +1,124 @@
+"""
+Count SQL statements and time the database side of rag retrieval.
+
+Usage (from the backend directory):
+    python scripts/bench_retrieval_queries.py
+    python scripts/bench_retrieval_queries.py --documents 200 --repeat 20
+
+Builds a throwaway SQLite database with synthetic documents (each with a large
+extracted_json), replaces the vector search with a fixed ranking so only the
+database access is measured, and compares the old ORM access pattern
+(Chunk rows + lazy chunk.document) with the projected query used by
+rag.retrieve_chunks at top_k = 10, 50 and 100.
+
+Exits non-zero if the projected path issues more than one statement per retrieval.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import warnings
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Measure the SQL path only: no keyword index, no result cache
+os.environ["LEXICAL_INDEX_ENABLED"] = "false"
+os.environ["RETRIEVAL_CACHE_ENABLED"] = "false"
+
+from sqlalchemy import event
+from sqlalchemy.dialects.mysql import LONGTEXT
+from sqlalchemy.ext.compiler import compiles
+from sqlmodel import SQLModel, Session, create_engine
+from app.models import Document, Chunk
+from app.services import rag
+
+@compiles(LONGTEXT, "sqlite")
+def _longtext_sqlite(element, compiler, **kw):
+    return "TEXT"
+
+USER_ID = "bench-user"
+
+def build_db(path: str, n_docs: int, chunks_per_doc: int):
+    engine = create_engine(f"sqlite:///{path}")
+    SQLModel.metadata.create_all(engine)
+    rnd = random.Random(7)
+    big_json = json.dumps({"detailed_summary": "x" * 20000, "people": ["A"] * 200})
+    chunk_ids = []
+    with Session(engine) as session:
+        for d in range(n_docs):
+            doc_id = f"doc{d}"
+            session.add(Document(id=doc_id, filename=f"file{d}.pdf", path=f"/tmp/{doc_id}.pdf", created_at=datetime.utcnow(),
+                                 user_id=USER_ID, status="extracted", extracted_json=big_json))
+            for c in range(chunks_per_doc):
+                cid = f"{doc_id}:{c + 1}:0"
+                chunk_ids.append(cid)
+                session.add(Chunk(id=cid, document_id=doc_id, page=c + 1, chunk_index=0, created_at=datetime.utcnow(),
+                                  text=" ".join(rnd.choice(["rent", "invoice", "due", "payment", "tenant"]) for _ in range(120))))
+        session.commit()
+    return engine, chunk_ids
+
+def legacy_retrieve(session: Session, chunk_ids):
+    warnings.filterwarnings("ignore", category=DeprecationWarning)
+    # The previous access pattern: full Chunk rows, then a lazy Document load per chunk
+    chunks = session.query(Chunk).join(Document)\
+        .filter(Chunk.id.in_(chunk_ids))\
+        .filter(Document.user_id == USER_ID)\
+        .filter(Document.status != 'deleted')\
+        .all()
+    return [{"chunk_id": c.id, "filename": c.document.filename, "text": c.text} for c in chunks]
+
+def measure(engine, fn, repeat: int):
+    counter = {"n": 0}
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        counter["n"] += 1
+
+    event.listen(engine, "before_cursor_execute", count)
+    try:
+        started = time.perf_counter()
+        for _ in range(repeat):
+            # Fresh session each time, like a request, so nothing is served from the identity map
+            with Session(engine) as session:
+                fn(session)
+        elapsed = (time.perf_counter() - started) / repeat
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+    return counter["n"] / repeat, elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=150)
+    parser.add_argument("--chunks-per-doc", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine, chunk_ids = build_db(os.path.join(tmp, "bench.db"), args.documents, args.chunks_per_doc)
+        rnd = random.Random(11)
+
+        header = f"{'top_k':>6} {'path':<10} {'queries':>8} {'ms/retrieval':>13}"
+        print(header)
+        print("-" * len(header))
+        ok = True
+        for top_k in (10, 50, 100):
+            # Spread hits across documents, as a real ranking would
+            ranked = rnd.sample(chunk_ids, min(top_k, len(chunk_ids)))
+            rag.get_embedding = lambda q: [0.0]
+            rag.query_similar_vectors = lambda embedding, top_k, document_id=None, filter=None: [{"id": cid, "metadata": {}} for cid in ranked]
+
+            legacy_q, legacy_t = measure(engine, lambda s: legacy_retrieve(s, ranked), args.repeat)
+            new_q, new_t = measure(engine, lambda s: rag.retrieve_chunks(s, "rent due", USER_ID, top_k=top_k), args.repeat)
+            print(f"{top_k:>6} {'legacy':<10} {legacy_q:>8.0f} {legacy_t * 1000:>13.2f}")
+            print(f"{top_k:>6} {'projected':<10} {new_q:>8.0f} {new_t * 1000:>13.2f}")
+            if new_q > 1:
+                ok = False
+                print(f"FAIL: projected retrieval issued {new_q:.0f} statements at top_k={top_k} (expected 1)")
+
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+import os
+import sys
+from sqlmodel import Session, select
+
+# Add parent directory to path so we can import config if needed
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.db import engine
+from app.models import Document, Chunk
+from app.services import lexical_index
+
+def build():
+    """
+    (Re)build the keyword index from the Chunk table.
+    New and re-processed documents are indexed during ingest; run this once for
+    documents processed before hybrid retrieval existed. Safe to run repeatedly.
+    """
+    total = 0
+    with Session(engine) as session:
+        docs = session.exec(select(Document.id, Document.user_id).where(Document.status != "deleted")).all()
+        print(f"Indexing chunks for {len(docs)} documents...")
+        for doc_id, user_id in docs:
+            rows = session.exec(select(Chunk.id, Chunk.text).where(Chunk.document_id == doc_id)).all()
+            lexical_index.delete_document(doc_id)
+            lexical_index.index_chunks(user_id, doc_id, rows)
+            total += len(rows)
+    print(f"Indexed {total} chunks.")
+
+if __name__ == "__main__":
+    build()
@@ -0,0 +1,164 @@
+"""
+Evaluate the rerank + MMR stage: prompt tokens saved and how much the answers change.
+
+Usage (from the backend directory):
+    python scripts/eval_rerank.py                          # demo_documents/*.pdf, built-in queries
+    python scripts/eval_rerank.py --queries queries.txt    # one question per line
+    python scripts/eval_rerank.py --top-k 15 --max-chunks 10
+    python scripts/eval_rerank.py --synthetic-pages 200    # add a generated long contract
+    python scripts/eval_rerank.py --answers                # also ask gpt-4o both ways (needs OPENAI_API_KEY)
+
+Documents are chunked with the legacy character chunker (1000 chars, 150 overlap),
+indexed into a throwaway keyword index, and each query retrieves top_k chunks.
+For every query it reports the context tokens sent with and without reranking and
+the share of the baseline's cited pages that are still cited after reranking.
+With --answers it also asks the chat model with both contexts and reports the
+token-level F1 overlap between the two answers.
+"""
+import argparse
+import glob
+import os
+import random
+import re
+import sys
+import tempfile
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services import chunking, pdf, rag, rerank
+from app.services.pipeline import chunk_vector_id
+from app.services.lexical_index import LexicalIndex
+from app.services.tokens import count_tokens
+
+DEMO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../demo_documents")
+USER_ID = "eval-user"
+
+DEFAULT_QUERIES = [
+    "What is the total amount due on the invoice and when is payment due?",
+    "INV2025-001",
+    "What are the payment terms and late fees?",
+    "How can either party terminate the partnership agreement?",
+    "What confidentiality obligations do the parties have?",
+    "Which action items were assigned at the steering committee meeting and to whom?",
+    "What decisions were made about the budget?",
+    "Who signed the agreement and on what date?",
+]
+
+CLAUSES = [
+    "The Tenant shall pay the monthly rent of $2,450.00 on or before the first day of each month.",
+    "A late fee of 5% of the outstanding amount applies to payments received after the fifth day.",
+    "Either party may terminate this agreement with sixty (60) days written notice to the other party.",
+    "The Landlord is responsible for structural repairs and maintenance of common areas.",
+    "All notices must be delivered in writing to the addresses listed in Schedule A.",
+    "The security deposit will be returned within thirty days of the end of the term, less lawful deductions.",
+    "The parties agree to keep the terms of this agreement confidential except as required by law.",
+    "This agreement renews automatically for successive one-year terms unless either party gives notice.",
+    "Invoices are payable net 30 from the invoice date to the account specified by the Vendor.",
+    "Any dispute arising under this agreement shall be resolved by binding arbitration in the State of New York.",
+]
+
+def synthetic_pages(n: int):
+    # Contract-like pages built from a small pool of clauses, so chunks repeat each other the way boilerplate does
+    rnd = random.Random(42)
+    return [
+        {"page_number": i + 1, "text": " ".join(rnd.choice(CLAUSES) for _ in range(rnd.randint(6, 18)))}
+        for i in range(n)
+    ]
+
+def context_tokens(chunks):
+    return count_tokens("\n\n".join(
+        f"[doc:{c['document_id']} page:{c['page']} chunk:{c['chunk_index']}] {c['text']}" for c in chunks
+    ))
+
+def cited_pages(chunks):
+    pages = {(c["document_id"], c["page"]) for c in chunks}
+    pages |= {(d["document_id"], d["page"]) for c in chunks for d in c.get("duplicates", [])}
+    return pages
+
+def answer_f1(a: str, b: str) -> float:
+    ta, tb = re.findall(r"\w+", a.lower()), re.findall(r"\w+", b.lower())
+    if not ta or not tb:
+        return 0.0
+    common = sum(min(ta.count(t), tb.count(t)) for t in set(ta))
+    if not common:
+        return 0.0
+    precision, recall = common / len(tb), common / len(ta)
+    return 2 * precision * recall / (precision + recall)
+
+def build_index(documents, index_path):
+    index = LexicalIndex(index_path)
+    chunks_by_id = {}
+    for filename, pages in documents:
+        doc_id = os.path.splitext(filename)[0]
+        chunks = chunking.chunk_text_per_page(pages, doc_id, filename)
+        for c in chunks:
+            c["id"] = chunk_vector_id(doc_id, c)
+            chunks_by_id[c["id"]] = {
+                "chunk_id": c["id"],
+                "document_id": doc_id,
+                "filename": c["filename"],
+                "page": c["page"],
+                "chunk_index": c["chunk_index"],
+                "text": c["text"],
+            }
+        index.upsert_chunks(USER_ID, doc_id, [(c["id"], c["text"]) for c in chunks])
+    return index, chunks_by_id
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pdfs", nargs="*", help="PDF files (default: demo_documents/*.pdf)")
+    parser.add_argument("--queries", help="File with one query per line")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--max-chunks", type=int, default=None, help="Override RERANK_MAX_CHUNKS")
+    parser.add_argument("--synthetic-pages", type=int, default=0, help="Add a generated contract with this many pages")
+    parser.add_argument("--answers", action="store_true", help="Call the chat model with both contexts and compare answers")
+    args = parser.parse_args()
+
+    paths = args.pdfs or sorted(glob.glob(os.path.join(DEMO_DIR, "*.pdf")))
+    documents = [(os.path.basename(p), pdf.extract_pdf_text_per_page(p)) for p in paths]
+    if args.synthetic_pages:
+        documents.append(("synthetic_contract.pdf", synthetic_pages(args.synthetic_pages)))
+    if not documents:
+        print("No documents found.")
+        sys.exit(1)
+    queries = DEFAULT_QUERIES
+    if args.queries:
+        with open(args.queries) as f:
+            queries = [line.strip() for line in f if line.strip()]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        index, chunks_by_id = build_index(documents, os.path.join(tmp, "lexical.sqlite"))
+        print(f"Indexed {len(chunks_by_id)} chunks from {len(documents)} documents\n")
+
+        header = f"{'query':<50} {'chunks':>9} {'tokens':>13} {'saved':>6} {'cites':>6}" + (f" {'answerF1':>9}" if args.answers else "")
+        print(header)
+        print("-" * len(header))
+        total_before = total_after = 0
+        coverage, overlaps = [], []
+        for query in queries:
+            baseline = [chunks_by_id[m["id"]] for m in index.search(USER_ID, query, limit=args.top_k)]
+            if not baseline:
+                print(f"{query[:50]:<50} {'no matches':>9}")
+                continue
+            reranked = rerank.rerank_chunks(query, baseline, max_chunks=args.max_chunks)
+            before, after = context_tokens(baseline), context_tokens(reranked)
+            cites = len(cited_pages(reranked) & cited_pages(baseline)) / len(cited_pages(baseline))
+            total_before += before
+            total_after += after
+            coverage.append(cites)
+            line = f"{query[:50]:<50} {len(baseline):>4}->{len(reranked):<4} {before:>6}->{after:<6} {1 - after / before:>6.0%} {cites:>6.0%}"
+            if args.answers:
+                a = rag.chat_with_context(query, baseline)["answer"]
+                b = rag.chat_with_context(query, reranked)["answer"]
+                overlaps.append(answer_f1(a, b))
+                line += f" {overlaps[-1]:>9.2f}"
+            print(line)
+
+        if total_before:
+            print(f"\nContext tokens: {total_before} -> {total_after} ({1 - total_after / total_before:.0%} saved)")
+            print(f"Cited pages kept: {sum(coverage) / len(coverage):.0%} on average")
+        if overlaps:
+            print(f"Answer overlap (token F1): {sum(overlaps) / len(overlaps):.2f} on average")
+
+if __name__ == "__main__":
+    main()
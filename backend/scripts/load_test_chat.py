@@ -0,0 +1,194 @@
+"""
+Load test the chat endpoints with many concurrent conversations.
+
+Usage (from the backend directory):
+    # 1. Optional: a fake OpenAI API with fixed latency, so the test costs nothing
+    python scripts/load_test_chat.py mock --port 8900 --latency 3
+    python scripts/load_test_chat.py mock --port 8900 --latency 0.2 --rpm 120   # with 429s
+
+    # 2. Start the API against it (embeddings also go to the mock)
+    OPENAI_BASE_URL=http://127.0.0.1:8900/v1 OPENAI_API_KEY=test uvicorn app.main:app --port 8000
+
+    # 3. Fire 200 concurrent chats (signs up / logs in a load-test user)
+    python scripts/load_test_chat.py run --url http://127.0.0.1:8000 --chats 200
+    python scripts/load_test_chat.py run --chats 200 --stream
+
+Reports throughput, latency percentiles, errors, time to first token (with --stream)
+and /api/health latency sampled while the chats are in flight. With sync endpoints
+each chat holds one of the default 40 threadpool threads for the whole model call,
+so 200 chats finish in waves and health checks queue behind them.
+"""
+import argparse
+import asyncio
+import json
+import time
+import uuid
+
+import httpx
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+# --- mock OpenAI server ---------------------------------------------------------
+
+def serve_mock(port: int, latency: float, rpm: int = 0):
+    from fastapi import FastAPI, Request
+    from fastapi.responses import JSONResponse, StreamingResponse
+    import uvicorn
+
+    app = FastAPI()
+    answer = "The monthly rent is $2,450.00, due on the first day of each month."
+    # Requests-per-minute bucket like OpenAI's: refills continuously, 429 + Retry-After when empty
+    bucket = {"level": float(rpm), "updated": time.monotonic()}
+
+    def rate_limited():
+        if not rpm:
+            return None
+        now = time.monotonic()
+        bucket["level"] = min(rpm, bucket["level"] + (now - bucket["updated"]) * rpm / 60)
+        bucket["updated"] = now
+        if bucket["level"] >= 1:
+            bucket["level"] -= 1
+            return None
+        retry_after = (1 - bucket["level"]) * 60 / rpm
+        return JSONResponse(
+            status_code=429,
+            headers={"retry-after-ms": str(int(retry_after * 1000))},
+            content={"error": {"message": "Rate limit reached for requests", "type": "requests", "code": "rate_limit_exceeded"}}
+        )
+
+    @app.post("/v1/chat/completions")
+    async def completions(request: Request):
+        limited = rate_limited()
+        if limited is not None:
+            return limited
+        body = await request.json()
+        usage = {"prompt_tokens": 1000, "completion_tokens": 20, "total_tokens": 1020}
+        base = {"id": "chatcmpl-mock", "created": int(time.time()), "model": body.get("model", "gpt-4o")}
+        if not body.get("stream"):
+            await asyncio.sleep(latency)
+            content = json.dumps({"answer": answer}) if body.get("response_format") else answer
+            return {**base, "object": "chat.completion", "usage": usage, "choices": [
+                {"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}
+            ]}
+
+        async def events():
+            # First token after a third of the latency, the rest spread over the remainder
+            words = answer.split(" ")
+            await asyncio.sleep(latency / 3)
+            for i, word in enumerate(words):
+                delta = {"content": word + ("" if i == len(words) - 1 else " ")}
+                yield "data: " + json.dumps({**base, "object": "chat.completion.chunk", "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}) + "\n\n"
+                await asyncio.sleep(latency * 2 / 3 / len(words))
+            yield "data: " + json.dumps({**base, "object": "chat.completion.chunk", "choices": [], "usage": usage}) + "\n\n"
+            yield "data: [DONE]\n\n"
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        await asyncio.sleep(0.05)
+        return {"object": "list", "model": body.get("model"), "usage": {"prompt_tokens": 10, "total_tokens": 10},
+                "data": [{"object": "embedding", "index": i, "embedding": [0.01] * 1536} for i in range(len(inputs))]}
+
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning")
+
+# --- load generator -------------------------------------------------------------
+
+async def get_token(client: httpx.AsyncClient, email: str, password: str) -> str:
+    await client.post("/api/auth/signup", json={"email": email, "password": password, "full_name": "Load Test"})
+    resp = await client.post("/api/auth/login", data={"username": email, "password": password})
+    resp.raise_for_status()
+    return resp.json()["access_token"]
+
+async def one_chat(client: httpx.AsyncClient, headers, message: str, stream: bool):
+    started = time.perf_counter()
+    ttft = None
+    if not stream:
+        resp = await client.post("/api/chat/", json={"message": message}, headers=headers)
+        resp.raise_for_status()
+        return time.perf_counter() - started, None
+    async with client.stream("POST", "/api/chat/stream", json={"message": message}, headers=headers) as resp:
+        resp.raise_for_status()
+        async for line in resp.aiter_lines():
+            if line == "event: token" and ttft is None:
+                ttft = time.perf_counter() - started
+            elif line == "event: error":
+                raise RuntimeError("stream reported an error")
+    return time.perf_counter() - started, ttft
+
+async def probe_health(client: httpx.AsyncClient, stop: asyncio.Event, samples: list):
+    while not stop.is_set():
+        started = time.perf_counter()
+        try:
+            await client.get("/api/health")
+            samples.append(time.perf_counter() - started)
+        except httpx.HTTPError:
+            samples.append(float("inf"))
+        await asyncio.sleep(0.25)
+
+async def run(args):
+    timeout = httpx.Timeout(args.timeout)
+    limits = httpx.Limits(max_connections=args.chats + 10, max_keepalive_connections=args.chats + 10)
+    async with httpx.AsyncClient(base_url=args.url, timeout=timeout, limits=limits) as client:
+        token = args.token or await get_token(client, args.email, args.password)
+        headers = {"Authorization": f"Bearer {token}"}
+
+        stop = asyncio.Event()
+        health = []
+        prober = asyncio.create_task(probe_health(client, stop, health))
+        started = time.perf_counter()
+        results = await asyncio.gather(
+            *(one_chat(client, headers, args.message, args.stream) for _ in range(args.chats)),
+            return_exceptions=True
+        )
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await prober
+
+    ok = [r for r in results if not isinstance(r, BaseException)]
+    errors = [r for r in results if isinstance(r, BaseException)]
+    latencies = [r[0] for r in ok]
+    ttfts = [r[1] for r in ok if r[1] is not None]
+
+    print(f"Chats: {args.chats} concurrent ({'stream' if args.stream else 'blocking'}) against {args.url}")
+    print(f"Completed: {len(ok)}  errors: {len(errors)}  wall time: {elapsed:.1f}s  throughput: {len(ok) / elapsed:.1f} chats/s")
+    print(f"Latency  p50 {percentile(latencies, 50):.2f}s  p95 {percentile(latencies, 95):.2f}s  p99 {percentile(latencies, 99):.2f}s  max {max(latencies, default=0):.2f}s")
+    if ttfts:
+        print(f"TTFT     p50 {percentile(ttfts, 50):.2f}s  p95 {percentile(ttfts, 95):.2f}s")
+    if health:
+        print(f"Health   p50 {percentile(health, 50) * 1000:.0f}ms  max {max(health) * 1000:.0f}ms  ({len(health)} probes)")
+    for e in errors[:5]:
+        print(f"  error: {type(e).__name__}: {e}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    mock = sub.add_parser("mock", help="Serve a fake OpenAI API with fixed latency")
+    mock.add_argument("--port", type=int, default=8900)
+    mock.add_argument("--latency", type=float, default=3.0, help="Seconds per chat completion")
+    mock.add_argument("--rpm", type=int, default=0, help="Answer 429 beyond this many chat requests per minute (0 = unlimited)")
+
+    load = sub.add_parser("run", help="Send concurrent chats to a running API")
+    load.add_argument("--url", default="http://127.0.0.1:8000")
+    load.add_argument("--chats", type=int, default=200)
+    load.add_argument("--stream", action="store_true", help="Use /api/chat/stream")
+    load.add_argument("--message", default="What is the monthly rent and when is it due?")
+    load.add_argument("--token", help="Bearer token (default: sign up / log in a load-test user)")
+    load.add_argument("--email", default=f"loadtest-{uuid.uuid4().hex[:8]}@example.com")
+    load.add_argument("--password", default="loadtest-password")
+    load.add_argument("--timeout", type=float, default=300)
+
+    args = parser.parse_args()
+    if args.command == "mock":
+        serve_mock(args.port, args.latency, args.rpm)
+    else:
+        asyncio.run(run(args))
+
+if __name__ == "__main__":
+    main()
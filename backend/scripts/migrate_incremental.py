@@ -0,0 +1,44 @@
+import os
+import sys
+from sqlalchemy import create_engine, text
+
+# Add parent directory to path so we can import config if needed
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import DATABASE_URL
+
+def migrate():
+    engine = create_engine(DATABASE_URL)
+    
+    with engine.connect() as connection:
+        # Content hashes used to diff re-processing runs
+        try:
+            print("Adding text_hash to document table...")
+            connection.execute(text("ALTER TABLE document ADD COLUMN text_hash VARCHAR(64) NULL"))
+            print("Success.")
+        except Exception as e:
+            print(f"Skipping document table (might already exist): {e}")
+
+        try:
+            print("Adding content_hash to chunk table...")
+            connection.execute(text("ALTER TABLE chunk ADD COLUMN content_hash VARCHAR(64) NULL"))
+            print("Success.")
+        except Exception as e:
+            print(f"Skipping chunk table: {e}")
+
+        try:
+            print("Adding force to processingjob table...")
+            connection.execute(text("ALTER TABLE processingjob ADD COLUMN `force` BOOLEAN NOT NULL DEFAULT FALSE"))
+            print("Success.")
+        except Exception as e:
+            print(f"Skipping processingjob table: {e}")
+
+        # The documentpage table is created by SQLModel.metadata.create_all() on startup.
+        # Existing chunks have no content_hash yet, so their first re-process re-embeds them once.
+        
+        connection.commit()
+    
+    print("Migration columns added.")
+
+if __name__ == "__main__":
+    migrate()
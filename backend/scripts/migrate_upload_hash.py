@@ -0,0 +1,30 @@
+import os
+import sys
+from sqlalchemy import create_engine, text
+
+# Add parent directory to path so we can import config if needed
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import DATABASE_URL
+
+def migrate():
+    engine = create_engine(DATABASE_URL)
+    
+    with engine.connect() as connection:
+        # Upload fingerprint used to short-circuit duplicate uploads
+        try:
+            print("Adding file_sha256 to document table...")
+            connection.execute(text("ALTER TABLE document ADD COLUMN file_sha256 VARCHAR(64) NULL"))
+            connection.execute(text("CREATE INDEX ix_document_file_sha256 ON document (file_sha256)"))
+            print("Success.")
+        except Exception as e:
+            print(f"Skipping document table (might already exist): {e}")
+
+        # Documents uploaded before this migration have no fingerprint and are never treated as duplicates.
+        
+        connection.commit()
+    
+    print("Migration columns added.")
+
+if __name__ == "__main__":
+    migrate()
@@ -0,0 +1,38 @@
+import os
+import sys
+from sqlmodel import Session, select
+
+# Add parent directory to path so we can import config if needed
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.db import engine
+from app.models import Document, Chunk
+from app.services import vector_store
+
+def migrate():
+    """
+    Backfill the user_id metadata on existing vectors.
+    Vector search is filtered by user_id, so vectors indexed before tenant scoping
+    are not returned by chat until this has run (or the documents are re-processed).
+    Safe to run repeatedly.
+    """
+    updated, failed = 0, 0
+    with Session(engine) as session:
+        docs = session.exec(select(Document.id, Document.user_id).where(Document.status != "deleted")).all()
+        print(f"Backfilling user_id for {len(docs)} documents...")
+        for doc_id, user_id in docs:
+            chunk_ids = session.exec(select(Chunk.id).where(Chunk.document_id == doc_id)).all()
+            if not chunk_ids or not user_id:
+                continue
+            missed = vector_store.failed_ids(vector_store.update_metadata(list(chunk_ids), {"user_id": user_id}))
+            updated += len(chunk_ids) - len(missed)
+            failed += len(missed)
+            if missed:
+                print(f"Document {doc_id}: {len(missed)} vectors could not be updated")
+
+    print(f"Updated {updated} vectors ({failed} failed).")
+    if failed:
+        print("Re-run this script to retry the failed vectors.")
+
+if __name__ == "__main__":
+    migrate()
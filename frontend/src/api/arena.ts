@@ -30,11 +30,17 @@ export interface ArenaStartResponse {
     context: string;
 }
 
+const authHeaders = (): Record<string, string> => {
+    const token = localStorage.getItem('token');
+    return token ? { Authorization: `Bearer ${token}` } : {};
+};
+
 export const startArena = async (req: ArenaStartRequest): Promise<ArenaStartResponse> => {
     const response = await fetch(`${API_URL}/start`, {
         method: 'POST',
         headers: {
             'Content-Type': 'application/json',
+            ...authHeaders(),
         },
         body: JSON.stringify(req),
     });
@@ -51,6 +57,7 @@ export const playTurn = async (req: ArenaTurnRequest): Promise<ArenaResponse> =>
         method: 'POST',
         headers: {
             'Content-Type': 'application/json',
+            ...authHeaders(),
         },
         body: JSON.stringify(req),
     });
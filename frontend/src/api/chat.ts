@@ -21,3 +21,69 @@ export async function chat(message: string, document_id?: string, top_k: number
   });
   return res.data;
 }
+
+const STREAM_URL = 'http://localhost:8000/api/chat/stream';
+
+export interface ChatStreamRequest {
+  message: string;
+  document_id?: string;
+  image_url?: string;
+  top_k?: number;
+  history?: { role: string; content: string }[];
+}
+
+export interface ChatStreamHandlers {
+  onCitations?: (citations: ChatCitation[]) => void;
+  onToken?: (text: string) => void;
+}
+
+// POST /api/chat/stream and consume its server-sent events (EventSource can't POST).
+// Resolves with the final answer once the `done` event arrives.
+export async function streamChat(req: ChatStreamRequest, handlers: ChatStreamHandlers = {}): Promise<ChatResponse> {
+  const token = localStorage.getItem('token');
+  const res = await fetch(STREAM_URL, {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+      ...(token ? { Authorization: `Bearer ${token}` } : {}),
+    },
+    body: JSON.stringify(req),
+  });
+  if (!res.ok || !res.body) {
+    throw new Error(`Chat failed: ${res.status}`);
+  }
+
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  let result: ChatResponse = { answer: '', citations: [] };
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let sep;
+    while ((sep = buffer.indexOf('\n\n')) !== -1) {
+      const raw = buffer.slice(0, sep);
+      buffer = buffer.slice(sep + 2);
+      let event = 'message';
+      let data = '';
+      for (const line of raw.split('\n')) {
+        if (line.startsWith('event: ')) event = line.slice(7);
+        else if (line.startsWith('data: ')) data += line.slice(6);
+      }
+      const payload = data ? JSON.parse(data) : {};
+      if (event === 'citations') {
+        result.citations = payload.citations;
+        handlers.onCitations?.(payload.citations);
+      } else if (event === 'token') {
+        result.answer += payload.text;
+        handlers.onToken?.(payload.text);
+      } else if (event === 'done') {
+        result = payload;
+      } else if (event === 'error') {
+        throw new Error(payload.detail);
+      }
+    }
+  }
+  return result;
+}
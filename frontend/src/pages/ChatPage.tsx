@@ -1,7 +1,7 @@
 
 
 import React, { useState, useEffect, useRef } from 'react';
-import { chat, ChatResponse } from '../api/chat';
+import { chat, streamChat, ChatResponse } from '../api/chat';
 import { listDocuments, Document } from '../api/documents';
 import { Section } from '../components/ui/Section';
 import Button from '../components/ui/Button';
@@ -33,6 +33,7 @@ const ChatPage: React.FC = () => {
 	]);
 	const [input, setInput] = useState('');
 	const [loading, setLoading] = useState(false);
+	const [streaming, setStreaming] = useState(false);
 	const [selectedDoc, setSelectedDoc] = useState<string>('');
 	const [documents, setDocuments] = useState<any[]>([]);
 	const [imageUrl, setImageUrl] = useState<string | null>(null);
@@ -80,24 +81,34 @@ const ChatPage: React.FC = () => {
 				content: m.content
 			}));
 
-			const res = await axios.post('http://localhost:8000/api/chat/', {
+			// Show the reply as soon as the first event arrives and grow it token by token
+			let started = false;
+			const updateReply = (update: (msg: Message) => Message) => {
+				const first = !started;
+				started = true;
+				setStreaming(true);
+				setMessages(prev => first
+					? [...prev, update({ role: 'assistant', content: '' })]
+					: [...prev.slice(0, -1), update(prev[prev.length - 1])]);
+			};
+
+			const res = await streamChat({
 				message: userMsg.content,
 				document_id: selectedDoc || undefined,
 				image_url: currentImage || undefined,
 				history: history
+			}, {
+				onCitations: citations => updateReply(msg => ({ ...msg, citations })),
+				onToken: text => updateReply(msg => ({ ...msg, content: msg.content + text }))
 			});
 
-			const botMsg: Message = {
-				role: 'assistant',
-				content: res.data.answer,
-				citations: res.data.citations
-			};
-			setMessages(prev => [...prev, botMsg]);
+			updateReply(msg => ({ ...msg, content: res.answer, citations: res.citations }));
 		} catch (error) {
 			console.error(error);
 			setMessages(prev => [...prev, { role: 'assistant', content: 'Sorry, I encountered an error.' }]);
 		} finally {
 			setLoading(false);
+			setStreaming(false);
 		}
 	};
 
@@ -162,7 +173,7 @@ const ChatPage: React.FC = () => {
 							</div>
 						</div>
 					))}
-					{loading && (
+					{loading && !streaming && (
 						<div className="flex justify-start">
 							<div className="bg-white dark:bg-gray-800 border border-gray-100 dark:border-gray-700 px-5 py-3 rounded-2xl rounded-bl-none shadow-sm flex items-center gap-2">
 								<div className="flex space-x-1">